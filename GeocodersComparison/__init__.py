@@ -2,13 +2,32 @@ name = 'GeocodersComparison'
 
 __author__ = 'catchenal@gmail.com'
 
-__all__ = ['gc4settings', 'gc4utils', 'comparison']
+__all__ = ['gc4settings', 'gc4utils', 'gc4fetch', 'gc4cache', 'gc4bulk',
+           'gc4stub', 'gc4geodist', 'gc4store', 'gc4boro', 'gc4bounds',
+           'gc4shapes', 'gc4maps', 'gc4build', 'gc4snaps', 'gc4sched',
+           'gc4hedge', 'comparison']
 
 
 import os
-from dotenv import find_dotenv
 
-dot_env_path = find_dotenv()
 
+def _find_dotenv(start_dir):
+    # as dotenv.find_dotenv() from this file, without importing dotenv
+    d = os.path.abspath(start_dir)
+    while True:
+        path = os.path.join(d, '.env')
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(d)
+        if parent == d:
+            return ''
+        d = parent
+
+
+dot_env_path = _find_dotenv(os.path.dirname(__file__))
+
+# use the working copy of the package next to the .env file, if any:
 if dot_env_path:
-    __path__ = [os.path.join(os.path.dirname(dot_env_path), name)]
+    _local_path = os.path.join(os.path.dirname(dot_env_path), name)
+    if os.path.isfile(os.path.join(_local_path, '__init__.py')):
+        __path__ = [_local_path]
@@ -6,30 +6,29 @@
 __author__ = 'catchenal@gmail.com'
 
 import os
+import time
 import itertools
 from collections import OrderedDict
 
 from GeocodersComparison import gc4settings
 from GeocodersComparison import gc4utils
+from GeocodersComparison import gc4fetch
+from GeocodersComparison import gc4geodist
+from GeocodersComparison import gc4store
+from GeocodersComparison import gc4bounds
+from GeocodersComparison import gc4shapes
 
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-
-from geopy import distance as geod
-from geopy.geocoders import Nominatim
-from geopy.geocoders import GoogleV3
-from geopy.geocoders import ArcGIS
-from geopy.geocoders import AzureMaps # no longer works; acessing the API w/requests
-
-import folium
-import matplotlib.pyplot as plt
-
-from IPython.display import display
+# The plotting & mapping libraries (matplotlib, seaborn, folium) are imported
+# by the functions using them: importing this module for the fetching &
+# comparison functions stays fast.
 # =============================================================================
 
 
-def get_geodata(geocoder_to_use, query_list, use_local=True, alt_prefix=''):
+def get_geodata(geocoder_to_use, query_list, use_local=True, alt_prefix='',
+                concurrent=False, max_workers=None, use_cache=False,
+                incremental=False, max_age=None):
     """
     Wrapper function for using one of four geocoders: 'Nominatim', 'GoogleV3',
     'ArcGis', 'AzureMaps', to retrieve the geographical data of places in
@@ -42,12 +41,28 @@ def get_geodata(geocoder_to_use, query_list, use_local=True, alt_prefix=''):
     :param: use_local (bool), default=True: a local file returned if found
     :param: alt_prefix (str), default='': to retrieve a geojson file tagged
             with that prefix => use_local=True (old file).
+    :param: concurrent (bool), default=False: fetch the queries from a thread
+            pool, throttled by the geocoder limits in gc4settings.geocs_limits.
+    :param: max_workers (int), default=None: thread pool size; defaults to the
+            geocoder's 'in_flight' limit.
+    :param: use_cache (bool), default=False: when fetching, look up each query
+            in the sqlite cache (gc4cache.get_cache()) first & store the new
+            responses in it.
+    :param: incremental (bool), default=False: only fetch the queries missing
+            from the local file or older than max_age & merge them into it
+            (see update_geodata()); ignored with alt_prefix.
+    :param: max_age (float), default=None: staleness threshold in seconds for
+            incremental; None: only missing queries are fetched.
 
     Returns
     -------
     geodata (odict): odict_keys(['loc', 'box']) where
               loc=['lat', 'lon'] and box=[[NE lat, lon], [SW lat, lon]].
     Note: the loc key identifies the place queried, not the entire string.
+    A place not found has an empty dict. A place whose query failed after its
+    retries (see gc4fetch.geocode_resilient()) keeps its stored geodata, else
+    a RuntimeError is raised (see merge_geodata()); the failed queries are
+    listed by gc4fetch.get_failed_queries().
 
     Example
     -------
@@ -81,6 +96,15 @@ def get_geodata(geocoder_to_use, query_list, use_local=True, alt_prefix=''):
             out = alt_prefix +  out
         
 
+    fetch_kw = dict(concurrent=concurrent, max_workers=max_workers)
+    if use_cache:
+        from GeocodersComparison import gc4cache
+        fetch_kw['cache'] = gc4cache.get_cache()
+
+    if incremental and not no_fetching:
+        return update_geodata(geocoder_to_use, query_list, out,
+                              max_age=max_age, **fetch_kw)
+
     if use_local:
         geodata = gc4utils.get_geo_file(os.path.join(gc4settings.DIR_GEO,
                                                      out + '.json'))
@@ -96,87 +120,132 @@ def get_geodata(geocoder_to_use, query_list, use_local=True, alt_prefix=''):
                 use_local = False
 
     if not use_local:
+        stored, stored_fetched, _ = load_geodata(out)
+        new_geodata, failed = gc4fetch.fetch_geodata(geocoder_to_use,
+                                                     query_list,
+                                                     with_failed=True,
+                                                     **fetch_kw)
+
+        # overwrite the file, but not with the failed queries:
+        geodata = OrderedDict((p, stored.get(p, OrderedDict()))
+                              for p in new_geodata)
+        fetched = {p: stored_fetched[p] for p in new_geodata
+                   if p in stored_fetched}
+        return merge_geodata(geocoder_to_use, query_list, new_geodata, out,
+                             geodata, fetched, failed)
+
+
+def save_geodata(out, geodata, fetched):
+    """
+    Save geodata in DIR_GEO/<out>.json and the fetching time (epoch, s) of
+    each of its places in DIR_GEO/<out>_fetched.json.
+    """
+    outfile = os.path.join(DIR_GEO, out)
+    gc4utils.save_file(outfile, 'json', geodata)
+    gc4utils.save_file(outfile + '_fetched', 'json', fetched)
 
-        tout = 5
-        idx = geocs.index(geocoder_to_use)
 
-        if idx == 0:
-            g = Nominatim(user_agent='this_app', country_bias='USA',
-                          timeout=tout)
-        elif idx == 1:
-            g = GoogleV3(api_key=GOOGLE_KEY, timeout=tout)
-        elif idx == 2:
-            g = ArcGIS(user_agent='this_app', timeout=tout)
-        else:
-            # original setup stopped working 9/12/18: unable to resolve the
-            # http 400 error; reverted to request/json.
-            g = AzureMaps(subscription_key=AZURE_KEY,
-                          user_agent='ths_app', timeout=tout)
-            #url_Azure = 'https://atlas.microsoft.com/search/address/json'
+def load_geodata(out):
+    """
+    Return (geodata, fetched, file_time) as saved by save_geodata(): empty
+    dicts & 0. if DIR_GEO/<out>.json is not found.
+    """
+    geofile = os.path.join(DIR_GEO, out + '.json')
+    ts_file = os.path.join(DIR_GEO, out + '_fetched.json')
 
-        geodata = OrderedDict()
+    geodata = OrderedDict()
+    file_time = 0.
+    if os.path.exists(geofile):
+        geodata.update(gc4utils.get_geo_file(geofile))
+        file_time = os.path.getmtime(geofile)
 
-        for i, q in enumerate(query_list):
-            info_d = OrderedDict()
+    fetched = {}
+    if os.path.exists(ts_file):
+        fetched = gc4utils.get_geo_file(ts_file, show_info=False)
 
-            # build the key=place for the output dict, w.r.t. county or not:
-            if 'county' in q:
-                place = q.split(' county, ')[0] + ' county'
-            else:
-                place = q.split(', ')[0]
+    return geodata, fetched, file_time
 
-            if idx == 0:
-                location = g.geocode(q, addressdetails=True).raw  #exactly_one=False, 
-            else:
-                location = g.geocode(q).raw
-                
-            if isinstance(location, list):
-                location = location[0]
-
-            if len(location):   # not sure that's a sufficient check...
-                
-                if idx == 0:
-                    # pt location
-                    info_d['loc'] = [float(location['lat']),
-                                     float(location['lon'])]
-                    # bounding boxes as 2 corner pts: [NE], [SW]
-                    info_d['box'] = [[float(location['boundingbox'][1]),
-                                      float(location['boundingbox'][3])],
-                                     [float(location['boundingbox'][0]),
-                                      float(location['boundingbox'][2])]]
-
-                elif idx == 1:
-                    info_d['loc'] = [location['geometry']['location']['lat'],
-                                     location['geometry']['location']['lng']]
-                    info_d['box'] = [[location['geometry']['viewport']['northeast']['lat'],
-                                      location['geometry']['viewport']['northeast']['lng']],
-                                     [location['geometry']['viewport']['southwest']['lat'],
-                                      location['geometry']['viewport']['southwest']['lng']]]
-
-                elif idx == 2:
-                    info_d['loc'] = [location['location']['y'],
-                                     location['location']['x']]
-                    info_d['box'] = [[location['extent']['ymax'],
-                                      location['extent']['xmax']],
-                                     [location['extent']['ymin'],
-                                      location['extent']['xmin']]]
-
-                else:
-                    info_d['loc'] = [location['position']['lat'],
-                                     location['position']['lon']]
-                    info_d['box'] = [[location['viewport']['topLeftPoint']['lat'],
-                                      location['viewport']['btmRightPoint']['lon']],
-                                     [location['viewport']['btmRightPoint']['lat'],
-                                      location['viewport']['topLeftPoint']['lon']] ]
 
+def merge_geodata(geocoder_to_use, query_list, new_geodata, out, geodata,
+                  fetched, failed):
+    """
+    Merge the fetched new_geodata of query_list into the stored geodata &
+    fetching times, save them (see save_geodata()) & return geodata.
+    The places whose query failed (failed: the set of these queries, as
+    returned by gc4fetch.fetch_geodata(..., with_failed=True)) keep their
+    stored geodata & time: a refresh while a geocoder is down does not
+    wipe out its data. Without stored geodata, the expired cached answer is
+    kept if any (not as freshly fetched); if none, the place is not saved &
+    a RuntimeError is raised, once the rest is saved.
+    """
+    now = time.time()
+
+    missing = []
+    for q in query_list:
+        place = gc4fetch.get_place_name(q)
+        info_d = new_geodata[place]
+        if q not in failed:
+            geodata[place] = info_d
+            fetched[place] = now
+        elif geodata.get(place):
+            continue
+        elif len(info_d):
             geodata[place] = info_d
+        else:
+            geodata.pop(place, None)
+            missing.append(q)
+
+    save_geodata(out, geodata, fetched)
 
-        # save file (overwrite=default)
-        outfile = os.path.join(DIR_GEO, out)
-        gc4utils.save_file(outfile, 'json', geodata)
+    if missing:
+        msg = '{}: {} queries failed, with no stored geodata: {}'
+        raise RuntimeError(msg.format(geocoder_to_use, len(missing), missing))
+    return geodata
+
+
+def update_geodata(geocoder_to_use, query_list, out, max_age=None,
+                   **fetch_kw):
+    """
+    Incremental refresh of the local geodata file DIR_GEO/<out>.json: only the
+    queries whose place is missing (or empty) in the file, or was fetched more
+    than max_age seconds ago, are geocoded; they are merged into the file.
+    Places without a recorded fetching time are as old as the file.
 
+    Parameters
+    ----------
+    :param: geocoder_to_use (str): to switch geocoding service
+    :param: query_list (list): a list of cities, places or counties
+    :param: out (str): base name of the local file, e.g. 'geodata_Nom'.
+    :param: max_age (float), default=None: staleness threshold in seconds;
+            None: only the missing places are fetched.
+    :param: fetch_kw: passed to gc4fetch.fetch_geodata().
+
+    Returns
+    -------
+    geodata (odict): the merged geodata: stored places first, new ones last.
+    """
+    geodata, fetched, file_time = load_geodata(out)
+    now = time.time()
+
+    def is_stale(place):
+        if not geodata.get(place):
+            return True
+        if max_age is None:
+            return False
+        return (now - fetched.get(place, file_time)) > max_age
+
+    to_fetch = [q for q in query_list if is_stale(gc4fetch.get_place_name(q))]
+    print('{}: {} of {} queries to fetch.'.format(geocoder_to_use,
+                                                  len(to_fetch),
+                                                  len(query_list)))
+    if not to_fetch:
         return geodata
 
+    new_geodata, failed = gc4fetch.fetch_geodata(geocoder_to_use, to_fetch,
+                                                 with_failed=True, **fetch_kw)
+    return merge_geodata(geocoder_to_use, to_fetch, new_geodata, out, geodata,
+                         fetched, failed)
+
 
 def get_pairwise_names(geocs):
     pair_comps = []
@@ -186,14 +255,16 @@ def get_pairwise_names(geocs):
     return pair_comps
 
 
-def compare_geocoords(geo_df, dist_units=['km', 'mi']):
+def compare_geocoords(geo_df, dist_units=['km', 'mi'], method='exact'):
     """
-    To obtain a pairwise comparison of the geodata from exactly 4 geocoders.
+    To obtain a pairwise comparison of the geodata from 2 or more geocoders.
     Parameters
     ----------
     :param geo_df (pandas.DataFrame): Holds the lat, lon, NE and SW data to be
     compared. DataFrame as formatted by :function:get_geodata_df().
     :param dist_units (list) : kilometers (km), miles (mi) or both.
+    :param method (str): 'exact' (ellipsoid) or 'haversine' (sphere, faster);
+    see gc4geodist for the error bounds.
     Returns
     ----------
     df (pandas.DataFrame): Values are the geodesic distance of the pairwise
@@ -201,8 +272,8 @@ def compare_geocoords(geo_df, dist_units=['km', 'mi']):
     """
     # input check:
     msg = __name__
-    if geo_df.shape[0] != 4:
-        msg += ': Expecting 4 rows of geolocation data.\n'
+    if geo_df.shape[0] < 2:
+        msg += ': Expecting at least 2 rows of geolocation data.\n'
         msg += 'Given: {}'.format(geo_df.shape[0])
         raise Exception(msg)
 
@@ -222,50 +293,25 @@ def compare_geocoords(geo_df, dist_units=['km', 'mi']):
     pairwise_comps = get_pairwise_names(geo_df.index.tolist())
     name = geo_df.index.name
 
-    comps_data = dict()
-
-    # point location differences:
-    i = 0
-    # Found out about geopy.distance.util.pairwise, but I would still need
-    # the iteration to populate comps_data, so I did not use it.
-    for comp in itertools.combinations(geo_df[['lat, lon']].values, 2):
-        d = geod.distance(comp[0], comp[1])
+    # All the pairwise distances (location, NE, SW) in one pass:
+    # coords shape: (geocoders, geoms, 2)
+    coords = np.stack([np.array(geo_df[c].tolist(), dtype=float)
+                       for c in ['lat, lon', 'NE', 'SW']], axis=1)
+    dist_km = gc4geodist.pairwise_distances_km(coords, method=method)
 
-        if both_units:
-            comps_data[pairwise_comps[i]] = {'Location_(km)': np.round(d.km, 6),
-                                             'Location_(mi)': np.round(d.mi, 6)}
-        elif (units=='km'):
-            comps_data[pairwise_comps[i]] = {'Location (km)': np.round(d.km, 6)}
-        else:
-            comps_data[pairwise_comps[i]] = {'Location (mi)': np.round(d.mi, 6)}
-        i += 1
-
-    # box corners differences:
-    i = 0
-    for comp in itertools.combinations(geo_df[['NE', 'SW']].values, 2):
-        NE_d = geod.distance(comp[0][0], comp[1][0])
-        SW_d = geod.distance(comp[0][1], comp[1][1])
-
-        if both_units:
-            comps_data[pairwise_comps[i]].update(
-                                               {'NE_(km)': np.round(NE_d.km, 6),
-                                                'NE_(mi)': np.round(NE_d.mi, 6),
-                                                'SW_(km)': np.round(SW_d.km, 6),
-                                                'SW_(mi)': np.round(SW_d.mi, 6)}
-                                               )
-        elif (units=='km'):
-            comps_data[pairwise_comps[i]].update(
-                                               {'NE (km)': np.round(NE_d.km, 6),
-                                                'SW (km)': np.round(SW_d.km, 6)}
-                                               )
-        else:
-            comps_data[pairwise_comps[i]].update(
-                                               {'NE (mi)': np.round(NE_d.mi, 6),
-                                                'SW (mi)': np.round(SW_d.mi, 6)}
-                                               )
-        i += 1
+    geoms = ['Location', 'NE', 'SW']
+    if both_units:
+        data = np.stack([dist_km, dist_km / gc4geodist.KM_PER_MI], axis=2)
+        cols = ['{}_({})'.format(g, u) for g in geoms for u in ['km', 'mi']]
+    elif (units == 'km'):
+        data = dist_km
+        cols = ['{} (km)'.format(g) for g in geoms]
+    else:
+        data = dist_km / gc4geodist.KM_PER_MI
+        cols = ['{} (mi)'.format(g) for g in geoms]
 
-    df = pd.DataFrame(comps_data).T
+    df = pd.DataFrame(np.round(data.reshape(len(pairwise_comps), -1), 6),
+                      index=pairwise_comps, columns=cols)
     df.index.set_names(name, inplace=True)
     if both_units:
         df.columns = df.columns.str.split('_', expand=True)
@@ -274,15 +320,78 @@ def compare_geocoords(geo_df, dist_units=['km', 'mi']):
 
 
 def get_geodata_df(geocs, geo_dict, place):
-    data = [[gd[place]['loc'],
-             gd[place]['box'][0],
-             gd[place]['box'][1]] for _, gd in enumerate(geo_dict)]
+    """
+    Return the DataFrame of the geodata of place from each geocoder.
+    :param geo_dict: list of geodata dicts or a gc4store.GeoStore.
+    """
+    if isinstance(geo_dict, gc4store.GeoStore):
+        store = gc4store.as_geo_store(geocs, geo_dict)
+        coords = store.coords[:, store.places_idx[place]].tolist()
+        data = [[c[0], c[1], c[2]] for c in coords]
+    else:
+        data = [[gd[place]['loc'],
+                 gd[place]['box'][0],
+                 gd[place]['box'][1]] for _, gd in enumerate(geo_dict)]
     df = pd.DataFrame(data, index=geocs, columns=['lat, lon', 'NE', 'SW'])
     df.index.set_names(place, inplace=True)
 
     return df
 
 
+def get_geodist_tensor(geocs, geo_dicts, places, method='exact'):
+    """
+    All the pairwise geodesic distances between any number of geocoders for
+    any number of places, in one pass.
+
+    Parameters
+    ----------
+    :param geocs (list): Geocoders names.
+    :param geo_dicts (list): Geocoding data dictionaries, in geocs order, or
+           a gc4store.GeoStore.
+    :param places (list): Places to compare.
+    :param method (str): 'exact' or 'haversine', see gc4geodist.
+
+    Returns
+    -------
+    (dist_km, pair_names): dist_km is the condensed distance tensor (km) of
+    shape (geocoder pairs, places, 3), the last axis being
+    [Location, NE, SW]; pair_names as per get_pairwise_names(geocs).
+    """
+    store = gc4store.as_geo_store(geocs, geo_dicts, places)
+    dist_km = gc4geodist.pairwise_distances_km(store.coords, method=method)
+
+    return dist_km, get_pairwise_names(geocs)
+
+
+def compare_all_geocoords(geocs, geo_dicts, places=None, unit='km',
+                          method='exact'):
+    """
+    N-way version of compare_geocoords(): pairwise comparison of any number
+    of geocoders for any number of places, e.g. all geopy geocoders (210
+    pairs) in a single run.
+
+    Returns
+    -------
+    df (pandas.DataFrame): Index: (geocoders pair, place); columns: Location,
+    NE, SW geodesic distances in unit ('km' or 'mi').
+    """
+    if places is None:
+        places = gc4store.as_geo_store(geocs, geo_dicts).places
+
+    dist_km, pair_names = get_geodist_tensor(geocs, geo_dicts, places,
+                                             method=method)
+    if unit == 'mi':
+        dist_km = dist_km / gc4geodist.KM_PER_MI
+
+    idx = pd.MultiIndex.from_product([pair_names, places],
+                                     names=['geocoders', 'place'])
+    df = pd.DataFrame(np.round(dist_km.reshape(-1, 3), 6), index=idx,
+                      columns=['Location', 'NE', 'SW'])
+    df.columns.name = 'Distance ({})'.format(unit)
+
+    return df
+
+
 def compare_two_geoboxes(place1, place2, geocs, geo_dict):
     """
     Return a pandas.DataFrame with the np.allclose() results for the bounding
@@ -293,20 +402,27 @@ def compare_two_geoboxes(place1, place2, geocs, geo_dict):
     To answer the question: "How does each geocoder treat the bounding boxes of
     these two locations, identically?". This is a quantitative check usefull to
     run when two boxes visualized on a map appear to have the same coordinates.
+    To find all such pairs at once, see find_identical_geoboxes().
 
     Parameters
     ----------
     :param place1, place2 (str): Places to compare.
     :param geocs (list): Geocoders names.
-    :param geo_dicts (list): Geocoding data dictionaries.
+    :param geo_dicts (list): Geocoding data dictionaries or a
+           gc4store.GeoStore.
 
     Return
     ------
     df (pandas.DataFrame): Geocoder name, bool(Identical box?)
     """
-    data = {}
-    for i, g in enumerate(geo_dict):
-        data[geocs[i]] = np.allclose(g[place1]['box'], g[place2]['box'])
+    if isinstance(geo_dict, gc4store.GeoStore):
+        store = gc4store.as_geo_store(geocs, geo_dict, [place1, place2])
+        boxes = store.boxes
+        data = dict(zip(geocs, [np.allclose(b[0], b[1]) for b in boxes]))
+    else:
+        data = {}
+        for i, g in enumerate(geo_dict):
+            data[geocs[i]] = np.allclose(g[place1]['box'], g[place2]['box'])
 
     df = pd.DataFrame(pd.Series(data), columns=['Identical_bounding boxes?'])
     col0 = '{} & {}:'.format(place1, place2)
@@ -316,52 +432,179 @@ def compare_two_geoboxes(place1, place2, geocs, geo_dict):
     return df
 
 
-def compare_location_with_geobox(places, geocs, geo_dicts, show_values=False):
+def find_identical_geoboxes(geocs, geo_dicts, places=None, decimals=6):
+    """
+    All-pairs version of compare_two_geoboxes(): for each geocoder, find every
+    group of places sharing the same bounding box (e.g. New York City and
+    New York county), by sorting the boxes rounded to decimals: near-linear
+    time instead of a call per pair of places.
+
+    Parameters
+    ----------
+    :param geocs (list): Geocoders names.
+    :param geo_dicts (list): Geocoding data dictionaries or a
+           gc4store.GeoStore.
+    :param places (list): Places to compare; default: all.
+    :param decimals (int): Rounding of the box coordinates; 6 decimals
+           (~0.1 m) is about the np.allclose() tolerance of
+           compare_two_geoboxes().
+
+    Return
+    ------
+    df (pandas.DataFrame): one row per group of places with identical boxes
+    (sparse: places with a unique box are not listed); index: (geocoder,
+    group #); columns: places, count, NE, SW.
+    """
+    store = gc4store.as_geo_store(geocs, geo_dicts, places)
+    # shape (geocoders, places, 4): NE lat, lon, SW lat, lon
+    boxes = np.round(store.boxes.reshape(store.boxes.shape[:2] + (4,)),
+                     decimals)
+    places = np.array(store.places, dtype=object)
+
+    rows = []
+    for i, geo in enumerate(store.geocs):
+        found = store.found[i]
+        if found.sum() < 2:
+            continue
+
+        uniq, inverse, counts = np.unique(boxes[i, found], axis=0,
+                                          return_inverse=True,
+                                          return_counts=True)
+        inverse = inverse.ravel()
+        found_places = places[found]
+
+        for k in np.flatnonzero(counts > 1):
+            rows.append({'geocoder': geo,
+                         'places': found_places[inverse == k].tolist(),
+                         'count': int(counts[k]),
+                         'NE': uniq[k, :2].tolist(),
+                         'SW': uniq[k, 2:].tolist()})
+
+    df = pd.DataFrame(rows, columns=['geocoder', 'places', 'count',
+                                     'NE', 'SW'])
+    df['group'] = df.groupby('geocoder').cumcount() + 1
+    df.set_index(['geocoder', 'group'], inplace=True)
+    df.columns.name = 'Identical bounding boxes'
+
+    return df
+
+
+def compare_location_with_geobox(places, geocs, geo_dicts, show_values=False,
+                                 show_offsets=False, method='exact'):
     """
     Usage
     -----
     To answer the question: "Are a place's coordinates identical to those
     of the center of its bounding box?" for all geocoders in the comparison.
     Note: the earth is flat here, no geodesic distance.
+    All geocoders & places are compared in one array pass.
+
+    Parameters
+    ----------
+    :param places (list): Places to compare.
+    :param geocs (list): Geocoders names.
+    :param geo_dicts (list): Geocoding data dictionaries or a
+           gc4store.GeoStore.
+    :param show_values (bool): Also show the location & box center.
+    :param show_offsets (bool): Also return the geodesic distance (km)
+           between each location and its box center.
+    :param method (str): 'exact' or 'haversine', for the offsets.
     Return
     ------
-    Pandas DataFrame
-    """
-    df_lst = []
-
-    for i, g in enumerate(geo_dicts):
-        geo = geocs[i]
-        data_p = OrderedDict()
-
-        for p, v in g.items():
-            # p: places, v: geoms
-            box_ctr = [(v['box'][0][0] + v['box'][1][0])/2,
-                       (v['box'][0][1] + v['box'][1][1])/2]
-            boo = np.allclose(np.round(v['loc'], 6),
-                              np.round(box_ctr, 6),
-                              atol=1e-06)
-
-            if show_values:
-                data_p[p] = {geo+'_location': np.round(v['loc'], 6),
-                             geo+'_box center': np.round(box_ctr, 6),
-                             geo+'_same?': boo}
-            else:
-                data_p[p] = {geo: boo}
-
-        df_lst.append(pd.DataFrame(data_p).T)
+    Pandas DataFrame; if show_offsets: (DataFrame, offsets DataFrame) where
+    offsets is places x geocoders.
+    """
+    store = gc4store.as_geo_store(geocs, geo_dicts, places)
 
-    df = pd.concat(df_lst, axis=1, sort=False)
+    # shapes (geocoders, places, 2):
+    locs = np.round(store.locs, 6)
+    box_ctrs = np.round((store.boxes[:, :, 0] + store.boxes[:, :, 1]) / 2, 6)
+    # as np.allclose(loc, ctr, atol=1e-06) for each geocoder & place:
+    same = np.isclose(locs, box_ctrs, atol=1e-06).all(axis=2)
 
     if show_values:
+        data = OrderedDict()
+        for i, geo in enumerate(store.geocs):
+            data[geo + '_location'] = list(locs[i])
+            data[geo + '_box center'] = list(box_ctrs[i])
+            data[geo + '_same?'] = same[i]
+        df = pd.DataFrame(data, index=store.places)
         df.columns = df.columns.str.split('_', expand=True)
     else:
-        df.index = places
+        df = pd.DataFrame(same.T, index=store.places, columns=store.geocs)
 
     df.index.name = 'Location is box center?'
 
+    if show_offsets:
+        offsets = gc4geodist.distance_km(store.locs, box_ctrs, method=method)
+        offsets_df = pd.DataFrame(offsets.T, index=store.places,
+                                  columns=store.geocs)
+        offsets_df.index.name = 'Location to box center (km)'
+        return df, offsets_df
+
     return df
 
 
+def get_place_geoms():
+    """
+    Return the dict of the places with a shapefile boundary & their geometry
+    (WGS-84): the NYC counties (boroughs), New York City (all boroughs) and
+    Boston.
+    """
+    county_to_boro = {v + ' county': k for k, v in boro_to_county.items()}
+
+    nyc = get_gdf_nyc_counties().to_crs('EPSG:4326')
+    boros = dict(zip(nyc.BoroName, nyc.geometry))
+
+    place_geoms = OrderedDict()
+    place_geoms['New York City'] = nyc.geometry.union_all()
+    for county, boro in county_to_boro.items():
+        place_geoms[county] = boros[boro]
+    boston = get_gdf_boston().to_crs('EPSG:4326')
+    place_geoms['Boston'] = boston.geometry.union_all()
+
+    return place_geoms
+
+
+_place_bounds = None
+
+
+def get_place_bounds():
+    """Return the gc4bounds.PlaceBounds of get_place_geoms() (built once)."""
+    global _place_bounds
+
+    if _place_bounds is None:
+        _place_bounds = gc4bounds.PlaceBounds(get_place_geoms())
+    return _place_bounds
+
+
+def compare_geoboxes_with_bounds(geocs, geo_dicts, places=None):
+    """
+    To quantify how well each geocoder's bounding box fits the place
+    boundary from the shapefiles (what get_boro_maps() shows), for all places
+    and geocoders in one pass.
+    Parameters:
+    -----------
+    :param geocs (list): Geocoders names.
+    :param geo_dicts (list): Geocoding data dictionaries or a
+           gc4store.GeoStore.
+    :param places (list): default: all the places with a boundary (see
+           get_place_geoms()).
+    Return:
+    -------
+    df (pandas.DataFrame): index: (place, geocoder); columns:
+    IoU, Covered (fraction of the place area within the box), Inside
+    (fraction of the box within the place), N, E, S, W (km the box extends
+    beyond the place bounds on each side; negative: falls short).
+    """
+    pb = get_place_bounds()
+    if places is None:
+        available = gc4store.as_geo_store(geocs, geo_dicts).places
+        places = [p for p in pb.places if p in available]
+
+    return pb.box_metrics(geocs, geo_dicts, places=places)
+
+
 # Dataframe styling functions:
 # These are not applied by the function that creates the df
 # because the final object would be of type "Styler" and no longer open to
@@ -386,8 +629,16 @@ def center_hdr(df):
 
 
 def with_style(df):
-    cap = ('Four geocoders coordinates pairwise difference comparison<br>' +
+    """
+    Style a compare_geocoords() output: min & max highlighted in each column,
+    with a caption counting the geocoders compared (from the pair names of
+    the index, see get_pairwise_names()).
+    """
+    geocs = OrderedDict.fromkeys(g for pair in df.index
+                                 for g in str(pair).split(' v. '))
+    cap = ('{} geocoders coordinates pairwise difference comparison<br>' +
            'with highlighted min (green) and max (pink) in each column.')
+    cap = cap.format(len(geocs))
 
     styles = [dict(selector="th", props=[('background-color', '#f7f7f9'),
                                          ("text-align", "center")]),
@@ -401,47 +652,87 @@ def with_style(df):
     return df
 
 
-def get_geo_dicts(geocs, query_lst, use_local=True, alt_prefix=''):
+def get_geo_dicts(geocs, query_lst, use_local=True, alt_prefix='',
+                  parallel=False, concurrent=False, return_timings=False,
+                  incremental=False, max_age=None):
     """
     For use in get_df_dict(geocs, geo_dicts, places) to obtain
     the respective dataframes for mapping.
+
+    Parameters
+    ----------
+    :param geocs (list): Geocoders names.
+    :param query_lst (list): Places queried.
+    :param use_local, alt_prefix, incremental, max_age: As in get_geodata().
+    :param parallel (bool), default=False: run every geocoder's batch at the
+           same time, each from its own thread; the refresh then takes as long
+           as the slowest geocoder instead of the sum of all of them.
+    :param concurrent (bool), default=False: passed to get_geodata() to also
+           send each geocoder's queries from a (throttled) thread pool.
+    :param return_timings (bool), default=False: also return the wall times.
+
+    Returns
+    -------
+    geo_dicts (list): geodata dicts in geocs order; None if any is missing.
+    If return_timings: (geo_dicts, timings) where timings is an OrderedDict
+    of the wall time in seconds of each geocoder and of the 'Total'.
     """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
     if use_local:
         print('\nLoading geodata...')
     else:
         print('\nFetching geodata...')
-    geo_Nom = get_geodata(geocs[0], query_lst,
-                          use_local=use_local, alt_prefix=alt_prefix)
-    geo_Goo = get_geodata(geocs[1], query_lst,
-                          use_local=use_local, alt_prefix=alt_prefix)
-    geo_Arc = get_geodata(geocs[2], query_lst,
-                          use_local=use_local, alt_prefix=alt_prefix)
-    geo_Azu = get_geodata(geocs[3], query_lst,
-                          use_local=use_local, alt_prefix=alt_prefix)
-
-    geo_dicts = [geo_Nom, geo_Goo, geo_Arc, geo_Azu]
+
+    def timed_get_geodata(geo):
+        t0 = time.perf_counter()
+        geodata = get_geodata(geo, query_lst,
+                              use_local=use_local, alt_prefix=alt_prefix,
+                              concurrent=concurrent,
+                              incremental=incremental, max_age=max_age)
+        return geodata, time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(geocs)) as pool:
+            results = list(pool.map(timed_get_geodata, geocs))
+    else:
+        results = [timed_get_geodata(geo) for geo in geocs]
+
+    timings = OrderedDict((geo, res[1]) for geo, res in zip(geocs, results))
+    timings['Total'] = time.perf_counter() - t0
+
+    print('\nWall time (s): ' + ', '.join('{}: {:.2f}'.format(k, v)
+                                          for k, v in timings.items()))
+
+    geo_dicts = [res[0] for res in results]
     if any(d is None for d in geo_dicts):
         print('\nAlternate geodata not found.\n')
-        return None
+        geo_dicts = None
     else:
         print('\nAll geodata variables gathered into list geo_dicts.\n')
-        return geo_dicts
+
+    if return_timings:
+        return geo_dicts, timings
+    return geo_dicts
 
 
 def get_places(geo_dicts):
     """
     The dict places is used for retrieving the geodata '
     and the distance comparison for a particular place.'
+    Places in NYC are mapped to their borough: counties by name, others
+    as per places_to_boro_d; other places are left out.
     """
+    county_to_boro = {v + ' county': k for k, v in boro_to_county.items()}
+
     places = list(geo_dicts[0].keys())
     places_to_boros = OrderedDict()
-    places_to_boros[places[0]] = 'Manhattan'
-    places_to_boros[places[1]] = 'Manhattan'
-    places_to_boros[places[2]] = 'Bronx'
-    places_to_boros[places[3]] = 'Brooklyn'
-    places_to_boros[places[4]] = 'Manhattan'
-    places_to_boros[places[5]] = 'Queens'
-    places_to_boros[places[6]] = 'Staten Island'
+    for p in places:
+        boro = places_to_boro_d.get(p, county_to_boro.get(p))
+        if boro is not None:
+            places_to_boros[p] = boro
     return places, places_to_boros
 
 
@@ -449,7 +740,11 @@ def get_df_dict(geocs, geo_dicts, places):
     """
     To obtain a dict of each place's data as a tuple (geodata_df, dist_diff_df)
     as per get_geodata_df() and compare_geocoords() outputs, respectively.
+    geo_dicts: list of geodata dicts or a gc4store.GeoStore.
     """
+    # one conversion, instead of a dict traversal per place:
+    geo_dicts = gc4store.as_geo_store(geocs, geo_dicts, places)
+
     df_dict = OrderedDict()
 
     for p in places:
@@ -463,59 +758,69 @@ def get_df_dict(geocs, geo_dicts, places):
     return df_dict
 
 
-def get_geo_dist_heatmap(places, df_dict, unit='km',
-                         save_fig=True, fig_frmt='svg'):
-    """To show the pairwise geodistance comparison in 3 heatmaps for
-       Lcation, NE corner, SW corner.
-    """
-    import seaborn as sns
+heatmap_geoms = ['Location', 'NE', 'SW']
 
-    sns.set_context("notebook", font_scale=1., rc={"lines.linewidth": 1.})
-
-    dist_frames_d = {}
 
-    for p in places:
-        # The pairwise distance daf is the second value;
-        # Its string index is, e.g. 'Nominatim v. GoogleV3'
-        dist_frames_d[p] = df_dict[p][1]
-
-    combined_df = pd.DataFrame()
-
-    for k, df in dist_frames_d.items():
-        drop_unit = '(mi)'
+def get_heatmap_frames(places, df_dict=None, unit='km', geocs=None,
+                       geo_dicts=None, method='exact'):
+    """
+    Return the pairwise geodistance differences shown by
+    get_geo_dist_heatmap(): {geom: DataFrame (geocoder pairs x places)}
+    for geom in heatmap_geoms, the pairs ordered by their second geocoder.
+    The (pairs, places, geoms) array is built in one step: from the
+    comparison tensor (get_geodist_tensor()) if geo_dicts is given, else by
+    stacking the compare_geocoords() frames of df_dict.
+    """
+    if geo_dicts is not None:
+        if geocs is None:
+            geocs = geo_dicts.geocs     # a GeoStore
+        dist, pair_names = get_geodist_tensor(geocs, geo_dicts, places,
+                                              method=method)
         if unit == 'mi':
-            drop_unit = '(km)'
-
-        new = df.T.unstack(level=0).drop(drop_unit, axis=0)
-        new.columns.set_names(['geocoders', 'geom'], inplace=True)
-        new.index = [k]
-        combined_df = pd.concat([combined_df, new])
-
-    combined_df = combined_df.T
-    combined_df.reset_index(inplace=True)
+            dist = dist / gc4geodist.KM_PER_MI
+    else:
+        cols = [(geom, '({})'.format(unit)) for geom in heatmap_geoms]
+        pair_names = list(df_dict[places[0]][1].index)
+        # (places, pairs, geoms) -> (pairs, places, geoms):
+        dist = np.stack([df_dict[p][1].loc[pair_names, cols].to_numpy()
+                         for p in places], axis=1)
 
-    # for sorting by geom location, NE, SW
-    combined_df['sort_geo'] = ([g.split('v. ')[1]
-                               for g in combined_df['geocoders']])
+    # sort by the 2nd geocoder of the pair (stable):
+    order = sorted(range(len(pair_names)),
+                   key=lambda i: pair_names[i].split('v. ')[1])
+    names = [pair_names[i] for i in order]
+    dist = dist[order]
 
-    combined_df.sort_values(by=['geom', 'sort_geo'], inplace=True)
-    combined_df.set_index(combined_df.geocoders + '|' + combined_df.geom,
-                          inplace=True)
+    return OrderedDict((geom, pd.DataFrame(dist[..., k], index=names,
+                                           columns=list(places)))
+                       for k, geom in enumerate(heatmap_geoms))
 
-    names = combined_df.geocoders.unique()
 
-    combined_df.drop(['geocoders', 'geom', 'sort_geo'], axis=1, inplace=True)
+def get_geo_dist_heatmap(places, df_dict, unit='km',
+                         save_fig=True, fig_frmt='svg',
+                         geocs=None, geo_dicts=None,
+                         max_rows=40, max_cols=20, file_prefix=''):
+    """To show the pairwise geodistance comparison in 3 heatmaps for
+       Lcation, NE corner, SW corner.
+       The data is assembled by get_heatmap_frames() (from geo_dicts if
+       given, which df_dict then need not be).
+       When there are more than max_rows geocoder pairs or max_cols places,
+       the heatmaps are split in pages of at most max_rows x max_cols, each
+       saved as <name>_p<page #>.<fig_frmt>.
+       With save_fig, the figures are rendered with the Agg backend (no
+       display needed); return: the list of saved files, named
+       <file_prefix>Heatmap_sns_geodist_difference_<unit>.
+    """
+    import seaborn as sns
 
-    # Split into 3 to show corresponding heatmaps:
-    locs_df = combined_df.loc[combined_df.index.str.endswith('Location')]
-    NE_df = combined_df.loc[combined_df.index.str.endswith('NE')]
-    SW_df = combined_df.loc[combined_df.index.str.endswith('SW')]
+    sns.set_context("notebook", font_scale=1., rc={"lines.linewidth": 1.})
 
-    # Plot heamap with seaborn:
-    fig, ax = plt.subplots(nrows=1, ncols=3, figsize=(18, 8), sharey=True)
+    frames = get_heatmap_frames(places, df_dict=df_dict, unit=unit,
+                                geocs=geocs, geo_dicts=geo_dicts)
+    n_rows, n_cols = frames['Location'].shape
 
-    dfs = {0: locs_df, 1: NE_df, 2: SW_df}
-    which_type = {0: 'Location', 1: 'NE corner', 2: 'SW corner'}
+    which_type = {'Location': 'Location', 'NE': 'NE corner',
+                  'SW': 'SW corner'}
 
     # To center the color map:
     my_max_acceptable_difference = 5  # in km
@@ -523,44 +828,78 @@ def get_geo_dist_heatmap(places, df_dict, unit='km',
     if unit == 'mi':
         my_max_acceptable_difference = my_max_acceptable_difference * 0.62
 
-    for i, a in enumerate(ax):
-
-        df = dfs[i]
-
-        sns.heatmap(df, ax=a,
-                    annot=True, fmt=".2f",
-                    linewidths=0.5,
-                    cmap='coolwarm',
-                    center=my_max_acceptable_difference,
-                    square=True,
-                    cbar=False)
-
-        a.set_xticklabels(a.get_xticklabels(),rotation=60)
-        a.set_yticklabels(names, fontweight='bold', fontsize=12)
-        a.set_title('{}\n'.format(which_type[i]),
-                    fontweight='bold', fontsize=14)
-        a.set_ylabel('')
-        if i == 1:
-            a.annotate(s='Geodesic distance difference ({}):'.format(unit),
-                       xy=[0.5, 1.2], xycoords='axes fraction',
-                       ha="center", fontweight='bold', fontsize=14)
-
-    fig.tight_layout()
-
-    # if not save, show:
-    if save_fig:
-        out = os.path.join(gc4settings.DIR_IMG,
-                           'Heatmap_sns_geodist_difference_'
-                           + unit + '.' + fig_frmt)
-        plt.savefig(out, format=fig_frmt,
-                    orientation='landscape', bbox_inches='tight')
-    else:
-        plt.show()
+    pages = [(r, c) for r in range(0, n_rows, max_rows)
+             for c in range(0, n_cols, max_cols)]
+    saved = []
+
+    for k, (r, c) in enumerate(pages):
+        rows = slice(r, r + max_rows)
+        cols = slice(c, c + max_cols)
+        nr = len(range(n_rows)[rows])
+        nc = len(range(n_cols)[cols])
+        figsize = (max(18, 3 * (0.75 * nc + 1.5)), max(8, 0.45 * nr + 3))
+
+        if save_fig:
+            # headless: no pyplot figure manager
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            ax = fig.subplots(nrows=1, ncols=3, sharey=True)
+        else:
+            import matplotlib.pyplot as plt
+
+            fig, ax = plt.subplots(nrows=1, ncols=3, figsize=figsize,
+                                   sharey=True)
+
+        for i, (a, geom) in enumerate(zip(ax, heatmap_geoms)):
+
+            df = frames[geom].iloc[rows, cols]
+
+            sns.heatmap(df, ax=a,
+                        annot=True, fmt=".2f",
+                        linewidths=0.5,
+                        cmap='coolwarm',
+                        center=my_max_acceptable_difference,
+                        square=True,
+                        cbar=False)
+
+            a.set_xticks(a.get_xticks())
+            a.set_xticklabels(df.columns, rotation=60)
+            a.set_yticks(a.get_yticks())
+            a.set_yticklabels(df.index, fontweight='bold', fontsize=12)
+            a.set_title('{}\n'.format(which_type[geom]),
+                        fontweight='bold', fontsize=14)
+            a.set_ylabel('')
+            if i == 1:
+                title = 'Geodesic distance difference ({}):'.format(unit)
+                if len(pages) > 1:
+                    title += ' page {} of {}'.format(k + 1, len(pages))
+                a.annotate(title,
+                           xy=[0.5, 1.2], xycoords='axes fraction',
+                           ha="center", fontweight='bold', fontsize=14)
+
+        fig.tight_layout()
+
+        # if not save, show:
+        if save_fig:
+            name = file_prefix + 'Heatmap_sns_geodist_difference_' + unit
+            if len(pages) > 1:
+                name += '_p{}'.format(k + 1)
+            out = os.path.join(gc4settings.DIR_IMG, name + '.' + fig_frmt)
+            fig.savefig(out, format=fig_frmt,
+                        orientation='landscape', bbox_inches='tight')
+            saved.append(out)
+        else:
+            plt.show()
 
-    return
+    return saved
 
 
 def get_map(geo, zoom=14, map_style='cartodbpositron'):
+    import folium
+
     g = np.array(geo)
     mean_lat = g[..., 0].mean()
     mean_lon = g[..., 1].mean()
@@ -577,6 +916,7 @@ def add_box_and_markers(mapobj, gdf, colors_d, lc_loc = 'topright'):
     Add location markers and a feature group, which provides an "interactive
     legend".
     """    
+    import folium
         
     place = r'{}'.format(gdf.index.name.replace("'", "\\'"))  # for apostrophes
 
@@ -629,7 +969,10 @@ def get_boro_maps(boro_name,
                   colors_d={},
                   zoom=10,
                   map_style='cartodbpositron',
-                  file_suffix=''):
+                  file_suffix='',
+                  out_dir=None,
+                  external_assets=False,
+                  file_prefix=''):
     """
     To obtain a map with location markers, bounding box and bounds from
     shapefiles.
@@ -639,8 +982,10 @@ def get_boro_maps(boro_name,
     :type: str
     :param locs_df: Aggregated geocoding results for each place queried.
     :type: pandas.DataFrame
-    :param bounds_gdf: Holds the shapfile data (bounds).
-    :type: geopandas.DataFrame
+    :param bounds_gdf: Holds the shapfile data (bounds), or the name of a
+           gc4shapes layer, e.g. 'nyc_counties': the layer is then
+           simplified for the zoom (lighter html, same look).
+    :type: geopandas.DataFrame or str
     :param filter_bounds (default: True): Flag to proceed with the filtering of
            bounds_df with boro_name.
            If False, all the bounds will be rendered on the map, as with e.g.
@@ -650,27 +995,47 @@ def get_boro_maps(boro_name,
     :param colors_d: Dict for each geocoder's color for folium elements.
     :param zoom: Starting zoom level (int).
     :param map_style (str): Default folium Tile.
+    :param out_dir (str): Folder of the html file; default: DIR_HTML.
+    :param file_suffix, file_prefix (str): Added to the html file name
+           (<prefix><place>_<suffix>.html), e.g. prefix='sep2018_'.
+    :param external_assets (bool, default: False): write the boundaries once
+           in a content-hashed file of <out_dir>/assets shared by the
+           frames, instead of inlining them (see gc4maps.py); only the
+           markers & boxes remain in the html file.
     """
+    import folium
+
     def style_bounds(feature):
         return {'fillOpacity': 0.2,
                 'weight': 1,
                 'fillColor': '#eea700',
                 'color': '#404040'}
 
+    if isinstance(bounds_gdf, str):
+        bounds_gdf = gc4shapes.get_layer(bounds_gdf, zoom=zoom)
+
     # Use one of the best geocoder to center the map
     m = get_map(locs_df.loc['Nominatim', ['lat, lon']].tolist(),
                     zoom=zoom, map_style=map_style)
 
+    if out_dir is None:
+        out_dir = gc4settings.DIR_HTML
+
     # show the shapefile data
     if filter_bounds:
         # in case bounds_gdf covers multiple locations
         gdf_boro = bounds_gdf[bounds_gdf.BoroName == boro_name]
-        shp = folium.GeoJson(gdf_boro,
-                       style_function=style_bounds,
-                       name='shapefile bounds'
-                       ).add_to(m)
     else: 
-        shp = folium.GeoJson(bounds_gdf,
+        gdf_boro = bounds_gdf
+
+    if external_assets:
+        from GeocodersComparison import gc4maps
+
+        shp = gc4maps.add_external_geojson(m, gdf_boro, out_dir,
+                                           style=style_bounds(None),
+                                           name='shapefile bounds')
+    else:
+        shp = folium.GeoJson(gdf_boro,
                        style_function=style_bounds,
                        name='shapefile bounds'
                        ).add_to(m)
@@ -703,39 +1068,148 @@ def get_boro_maps(boro_name,
     name = 'map'
     if not (locs_df.index.name is None):
         name = locs_df.index.name.replace(' ', '_')
+    name = file_prefix + name
     if file_suffix:
         name += '_' + file_suffix + '.html'
     else:
         name += '.html'
 
-    m.save(os.path.join(gc4settings.DIR_HTML, name))
+    m.save(os.path.join(out_dir, name))
 
     return m
 
 
-def get_gdf_boston():
+# Map settings of the places rendered by render_boro_maps(): the borough to
+#  show (filtered from the layer if filter_bounds), the shapefile layer
+#  (gc4shapes.shape_layers) & the starting zoom. NYC counties: see
+#  get_map_spec().
+places_map_specs = {'New York City': {'boro_name': 'New York City',
+                                      'layer': 'nyc_counties',
+                                      'filter_bounds': False,
+                                      'zoom': 9},
+                    "Cleopatra's needle": {'boro_name': 'Manhattan',
+                                           'layer': 'nyc_counties',
+                                           'filter_bounds': True,
+                                           'zoom': 12},
+                    'Boston': {'boro_name': 'Boston',
+                               'layer': 'boston',
+                               'filter_bounds': False,
+                               'zoom': 11}}
+
+
+def get_map_spec(place):
+    """Return the map settings of place (see places_map_specs)."""
+    if place in places_map_specs:
+        return dict(places_map_specs[place])
+
+    county_to_boro = {v + ' county': k for k, v in boro_to_county.items()}
+    if place in county_to_boro:
+        return {'boro_name': county_to_boro[place], 'layer': 'nyc_counties',
+                'filter_bounds': True, 'zoom': 10}
+
+    msg = 'No map settings for {}: add them to places_map_specs.'
+    raise ValueError(msg.format(place))
+
+
+def _init_map_worker(layers):
+    # each worker loads the shapefile layers once, for all its maps:
+    for layer, zoom in layers:
+        gc4shapes.get_layer(layer, zoom=zoom)
+
+
+def _render_map(args):
+    place, locs_df, spec, kw = args
+    t0 = time.perf_counter()
+
+    spec = dict(spec)
+    get_boro_maps(locs_df=locs_df, bounds_gdf=spec.pop('layer'), **spec,
+                  **kw)
+
+    return place, time.perf_counter() - t0
+
+
+def render_boro_maps(df_dict, places=None, processes=None, map_specs=None,
+                     colors_d={}, map_style='cartodbpositron', file_suffix='',
+                     out_dir=None, external_assets=False):
     """
-    To obtain a geo dataframe from shapefile with same format as NYC.
-    # Boston: https://data.boston.gov/dataset/city-of-boston-boundary
+    Render & save the get_boro_maps() html frame of each place, the maps
+    being rendered by a pool of processes.
+    Parameters:
+    -----------
+    :param df_dict: Output of get_df_dict(); the first DataFrame of each
+           place is mapped.
+    :param places (list): default: all the places of df_dict.
+    :param processes (int): number of worker processes; default: one per
+           core; 1: render in this process.
+    :param map_specs (dict): {place: settings} overriding get_map_spec(),
+           e.g. {'Kings county': {'zoom': 11}}.
+    :param colors_d, map_style, file_suffix, out_dir, external_assets: see
+           get_boro_maps().
+    Return:
+    -------
+    timings (OrderedDict): seconds per map, in places order, and 'Total'
+    (wall time).
     """
-    from collections import OrderedDict
-    
-    gdf_boston = gpd.read_file(os.path.join(DIR_SHP, 'Boston.shp'),
-                               driver='shapefile')
+    from concurrent.futures import ProcessPoolExecutor
 
-    gdf_boston.drop(['OBJECTID', 'BOSTON_LAN',], axis=1, inplace=True)
+    if places is None:
+        places = list(df_dict.keys())
+    map_specs = map_specs or {}
 
-    newcols = OrderedDict()
-    newcols['CITY'] = 'BoroCode'
-    newcols['COUNTY'] = 'BoroName'
-    newcols['SHAPEarea'] = 'Shape_Area'
-    newcols['SHAPElen'] = 'Shape_Leng'
+    kw = dict(colors_d=colors_d, map_style=map_style,
+              file_suffix=file_suffix, out_dir=out_dir,
+              external_assets=external_assets)
+    jobs = []
+    for p in places:
+        try:
+            spec = get_map_spec(p)
+        except ValueError:
+            if p not in map_specs:
+                raise
+            spec = {}
+        spec.update(map_specs.get(p, {}))
+        missing = [k for k in ['boro_name', 'layer', 'zoom'] if k not in spec]
+        if missing:
+            msg = 'No map settings {} for {}: add them to places_map_specs.'
+            raise ValueError(msg.format(missing, p))
+        jobs.append((p, df_dict[p][0], spec, kw))
+
+    # (layer, zoom) of the maps, simplified level by level:
+    layers = sorted({(job[2]['layer'], job[2]['zoom']) for job in jobs})
+
+    t0 = time.perf_counter()
+    if processes == 1:
+        _init_map_worker(layers)
+        results = [_render_map(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=_init_map_worker,
+                                 initargs=(layers,)) as pool:
+            results = list(pool.map(_render_map, jobs))
 
-    gdf_boston.rename(mapper=newcols, axis=1, inplace=True)
-    gdf_boston['BoroCode'] = 1
-    gdf_boston['BoroName'] = 'Boston'
-    
-    return gdf_boston
+    timings = OrderedDict(results)
+    timings['Total'] = time.perf_counter() - t0
+
+    print('\nWall time (s): ' + ', '.join('{}: {:.2f}'.format(k, v)
+                                          for k, v in timings.items()))
+    return timings
+
+
+def get_gdf_nyc_counties():
+    """
+    Return the geo dataframe of the NYC boroughs/counties boundaries with
+    maritime portion (nybbwi.shp), loaded on first call.
+    """
+    return gc4shapes.get_layer('nyc_counties')
+
+
+def get_gdf_boston():
+    """
+    To obtain a geo dataframe from shapefile with same format as NYC,
+    loaded on first call (see gc4shapes.format_boston()).
+    # Boston: https://data.boston.gov/dataset/city-of-boston-boundary
+    """
+    return gc4shapes.get_layer('boston')
 
 
 def save_df_table_to_html(df, df_title, table_name_without_ext):
@@ -743,12 +1217,13 @@ def save_df_table_to_html(df, df_title, table_name_without_ext):
 
     if isinstance(df, Styler):
         #styling already applied: keep
-        ds = df.render()
+        # (Styler.render() was removed in pandas 2):
+        ds = df.to_html() if hasattr(df, 'to_html') else df.render()
         
         T = '<h5>{}</h5>\n '.format(df_title)
-        style_tag = '<style  type="text/css" >\n'
+        style_tag = '<style'
         # add the title before style_tag:
-        ds = ds.replace(style_tag, T + style_tag)
+        ds = ds.replace(style_tag, T + style_tag, 1)
     else:
         tpl_path = os.path.join(gc4settings.DIR_HTML, 'templates')
         dfstyle = Styler.from_custom_template(tpl_path, "myhtml.tpl")
@@ -757,20 +1232,28 @@ def save_df_table_to_html(df, df_title, table_name_without_ext):
     gc4utils.save_file(table_name_without_ext, 'html', ds)
 
 
-def output_tables_3(places, df_dict):
+def output_table_3(num, place, diff_df, file_prefix=''):
+    """
+    Save the styled distance differences of place (compare_geocoords()
+    output) as html Table 3.<num>; return the file path.
+    """
     caption = 'Coordinates differences for location and box corners'
+
+    df_title = "Table 3.{}: {} [{}]".format(num, caption, place)
+    name = file_prefix + place.replace(' ', '_')
+    table = os.path.join(gc4settings.DIR_HTML, name + '_dist_diff.html')
+
+    ds = with_style(diff_df)
+    save_df_table_to_html(ds, df_title, table)
+
+    return table
+
+
+def output_tables_3(places, df_dict):
     tbl_list = []
     
     for i, p in enumerate(places):
-        diff_df = df_dict[p][1]
-        
-        df_title = "Table 3.{}: {} [{}]".format(i+1, caption, p)
-        name =  p.replace(' ','_')
-        table = os.path.join(gc4settings.DIR_HTML, 
-                             name + '_dist_diff.html')
-
-        ds = with_style(diff_df)
-        save_df_table_to_html(ds, df_title, table)
+        table = output_table_3(i + 1, p, df_dict[p][1])
         tbl_list.append(table)
         
     return tbl_list
@@ -816,6 +1299,7 @@ def df_to_pic(df,
 
     """
     import six          # iteritems
+    import matplotlib.pyplot as plt
 
     col_pad = 0.05
 
@@ -905,9 +1389,23 @@ DIR_HTML = gc4settings.DIR_HTML
 DIR_RPT = gc4settings.DIR_RPT
 NB_CSS = gc4settings.NB_CSS
 
-gdf_nyc_counties = gpd.read_file(os.path.join(DIR_SHP, 'nybbwi.shp'),
-                                 driver='shapefile')
-gdf_boston = get_gdf_boston()
+# The shapefile layers are loaded on first access (e.g.
+# comparison.gdf_boston), not on import:
+_lazy_layers = {'gdf_nyc_counties': get_gdf_nyc_counties,
+                'gdf_boston': get_gdf_boston}
+
+# The API keys are read on first access too (see gc4settings):
+_env_keys = ['GOOGLE_KEY', 'AZURE_KEY', 'W3W_dict']
+
+
+def __getattr__(name):
+    if name in _lazy_layers:
+        return _lazy_layers[name]()
+    if name in _env_keys:
+        return getattr(gc4settings, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                     name))
+
 
 # NYC borough/counties boundaries with maritime portion:
 # https://www1.nyc.gov/site/planning/data-maps/open-data/
@@ -918,26 +1416,31 @@ boro_to_county = {'Manhattan': 'New York',
                   'Bronx': 'Bronx',
                   'Queens': 'Queens'}
 
+# NYC places other than counties, with their borough:
+places_to_boro_d = {'New York City': 'Manhattan',
+                    "Cleopatra's needle": 'Manhattan'}
+
 # Load the geocoding variables in the namespace:
 geocs = gc4settings.geocs
 colors_dict = gc4settings.colors_dict
 
 query_lst = gc4settings.query_lst
-print('\nPlaces queried, var query_lst:\n{}'.format(query_lst))
 
-# Call to load API keys from environment file if found:
-print('\nFetching API keys from environment file if found.')
 
-GOOGLE_KEY = gc4settings.GOOGLE_KEY
-AZURE_KEY = gc4settings.AZURE_KEY
-W3W_dict = gc4settings.W3W_dict
+def show_env_status():
+    """
+    Print the places queried & which API keys were not found in the
+    environment file (printed on import in earlier versions).
+    """
+    print('\nPlaces queried, var query_lst:\n{}'.format(query_lst))
 
-if (AZURE_KEY is None):
-    print('Azure API key not in .env')
-elif (GOOGLE_KEY is None):
-    print('Google API key not in .env')
-elif list(W3W_dict.values()) == [None]*len(W3W_dict):
-    print('W3W API keys not in .env')
+    # Call to load API keys from environment file if found:
+    print('\nFetching API keys from environment file if found.')
 
-print('Module import operations: COMPLETE.')
+    if (gc4settings.AZURE_KEY is None):
+        print('Azure API key not in .env')
+    elif (gc4settings.GOOGLE_KEY is None):
+        print('Google API key not in .env')
+    elif list(gc4settings.W3W_dict.values()) == [None]*len(gc4settings.W3W_dict):
+        print('W3W API keys not in .env')
 #################################################################
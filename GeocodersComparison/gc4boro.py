@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4boro.py
+Bulk borough imputation: which borough (shapefile polygon) contains each
+[lat, lon] point, for arrays of millions of points.
+
+The polygons (prepared geometries, in the shapefile's CRS) are indexed by a
+grid: the points of a cell lying within one polygon get it directly, the
+others are only tested against the few polygons crossing their cell. The
+points are projected once (pyproj) and processed as arrays: ~1M points/s on
+one core for the NYC boroughs. Points outside every polygon (e.g. geocoded
+just off the shoreline) can be assigned to the nearest polygon (STRtree),
+within a maximum distance.
+Requires shapely >= 2 & pyproj >= 2.
+
+Example:
+lats, lons = df.lat.values, df.lon.values
+df[['BoroName', 'BoroCode']] = impute_boros(lats, lons, nearest=True,
+                                            max_dist_km=0.5)
+"""
+__author__ = 'catchenal@gmail.com'
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+class BoroIndex():
+    """
+    Spatial index over the polygons of a geodataframe with a name & a code
+    column, e.g. gdf_nyc_counties (BoroName, BoroCode).
+    :param grid_size (int): number of grid cells along each axis.
+
+    Example:
+    idx = BoroIndex(gdf_nyc_counties)
+    idx.locate([40.78, 40.6], [-73.97, -74.5])  # -> array([0, -1])
+    """
+
+    def __init__(self, gdf, name_col='BoroName', code_col='BoroCode',
+                 grid_size=64):
+        import shapely
+        from pyproj import CRS, Transformer
+
+        self.names = gdf[name_col].to_numpy()
+        self.codes = gdf[code_col].to_numpy()
+
+        self.geoms = np.asarray(gdf.geometry.values, dtype=object)
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+
+        crs = CRS.from_user_input(gdf.crs or 'EPSG:4326')
+        self._transformer = None
+        self.unit_m = None              # meters per CRS unit; None: degrees
+        if crs.is_projected:
+            self._transformer = Transformer.from_crs('EPSG:4326', crs,
+                                                     always_xy=True)
+            self.unit_m = crs.axis_info[0].unit_conversion_factor
+
+        self._build_grid(grid_size)
+
+    def _build_grid(self, grid_size):
+        import shapely
+
+        xmin, ymin, xmax, ymax = shapely.total_bounds(self.geoms)
+        self.grid_size = grid_size
+        self.grid_origin = (xmin, ymin)
+        self.cell_size = (max(xmax - xmin, 1e-12) / grid_size,
+                          max(ymax - ymin, 1e-12) / grid_size)
+
+        i, j = np.divmod(np.arange(grid_size ** 2), grid_size)
+        x0 = xmin + i * self.cell_size[0]
+        y0 = ymin + j * self.cell_size[1]
+        cells = shapely.box(x0, y0, x0 + self.cell_size[0],
+                            y0 + self.cell_size[1])
+
+        # polygon fully covering each cell, if any:
+        self.cell_poly = np.full(len(cells), -1, dtype=np.int64)
+        cell_i, poly_i = self.tree.query(cells, predicate='within')
+        self.cell_poly[cell_i] = poly_i
+
+        # (cell, polygon) pairs to test point by point:
+        cell_i, poly_i = self.tree.query(cells, predicate='intersects')
+        partial = self.cell_poly[cell_i] < 0
+        self.cell_pairs = (cell_i[partial], poly_i[partial])
+
+        # distance from each cell to the nearest polygon, to skip the points
+        # out of reach in the nearest polygon search:
+        (cell_i, _), dist = self.tree.query_nearest(cells,
+                                                    return_distance=True,
+                                                    all_matches=False)
+        self.cell_dist = np.full(len(cells), np.inf)
+        self.cell_dist[cell_i] = dist
+
+    def __len__(self):
+        return len(self.names)
+
+    def project(self, lats, lons):
+        """Return x, y (in the index CRS) & the valid mask of the points."""
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        valid = np.isfinite(lats) & np.isfinite(lons)
+
+        x, y = lons, lats
+        if self._transformer is not None:
+            x, y = self._transformer.transform(lons, lats)
+
+        return np.asarray(x), np.asarray(y), valid
+
+    def locate(self, lats, lons, nearest=False, max_dist_km=None):
+        """
+        Return the index of the polygon containing each point, -1 if none
+        (or if lat/lon is nan).
+        :param nearest (bool): assign the points outside every polygon to the
+               nearest one...
+        :param max_dist_km (float): ...if within that distance (None: any).
+        """
+        import shapely
+
+        x, y, valid = self.project(lats, lons)
+        out = np.full(len(x), -1, dtype=np.int64)
+
+        n = self.grid_size
+        with np.errstate(invalid='ignore'):
+            ci = np.floor((x - self.grid_origin[0]) / self.cell_size[0])
+            cj = np.floor((y - self.grid_origin[1]) / self.cell_size[1])
+        on_grid = valid & (ci >= 0) & (ci < n) & (cj >= 0) & (cj < n)
+
+        todo = np.flatnonzero(on_grid)
+        cell = ci[todo].astype(np.int64) * n + cj[todo].astype(np.int64)
+        out[todo] = self.cell_poly[cell]
+        cell_dist = np.zeros(len(x))
+        cell_dist[todo] = self.cell_dist[cell]
+
+        # points in cells crossed by polygon boundaries, grouped by cell:
+        part = out[todo] < 0
+        todo, cell = todo[part], cell[part]
+        order = np.argsort(cell, kind='stable')
+        todo, cell = todo[order], cell[order]
+        cell_i, poly_i = self.cell_pairs
+        starts = np.searchsorted(cell, cell_i, side='left')
+        ends = np.searchsorted(cell, cell_i, side='right')
+
+        for k, a, b in zip(poly_i, starts, ends):
+            if a == b:
+                continue
+            pts = todo[a:b]
+            pts = pts[out[pts] < 0]
+            # intersects: points on a boundary are not lost
+            hit = shapely.intersects_xy(self.geoms[k], x[pts], y[pts])
+            out[pts[hit]] = k
+
+        if nearest:
+            miss = valid & (out < 0)
+            max_distance = None
+            if max_dist_km is not None:
+                max_distance = max_dist_km * 1000. / self.unit_m \
+                    if self.unit_m else max_dist_km / 111.
+                miss &= cell_dist <= max_distance
+            miss = np.flatnonzero(miss)
+            if len(miss):
+                pt_i, poly_i = self.tree.query_nearest(
+                                    shapely.points(x[miss], y[miss]),
+                                    max_distance=max_distance,
+                                    all_matches=False)
+                out[miss[pt_i]] = poly_i
+
+        return out
+
+    def impute(self, lats, lons, nearest=False, max_dist_km=None):
+        """
+        Return a DataFrame with the BoroName & BoroCode of each point
+        (missing when not found); parameters: see locate().
+        """
+        return self.to_frame(self.locate(lats, lons, nearest=nearest,
+                                         max_dist_km=max_dist_km))
+
+    def to_frame(self, idx):
+        """Return the BoroName & BoroCode DataFrame of locate()'s output."""
+        found = idx >= 0
+
+        names = np.full(len(idx), None, dtype=object)
+        names[found] = self.names[idx[found]]
+        codes = pd.array(np.where(found, self.codes[np.maximum(idx, 0)], 0),
+                         dtype='Int64')
+        codes[~found] = pd.NA
+
+        return pd.DataFrame({'BoroName': names, 'BoroCode': codes})
+
+
+_boro_index = None
+
+
+def get_boro_index():
+    """Return the BoroIndex of the NYC boroughs (built once)."""
+    global _boro_index
+
+    if _boro_index is None:
+        from GeocodersComparison import gc4shapes
+
+        _boro_index = BoroIndex(gc4shapes.get_layer('nyc_counties'))
+    return _boro_index
+
+
+# Index built once per worker process, see impute_boros():
+_worker_index = None
+
+
+def _init_worker(gdf, name_col, code_col):
+    global _worker_index
+    _worker_index = BoroIndex(gdf, name_col=name_col, code_col=code_col)
+
+
+def _locate_chunk(args):
+    lats, lons, nearest, max_dist_km = args
+    return _worker_index.locate(lats, lons, nearest=nearest,
+                                max_dist_km=max_dist_km)
+
+
+def impute_boros(lats, lons, gdf=None, nearest=False, max_dist_km=None,
+                 processes=None, chunksize=500000, name_col='BoroName',
+                 code_col='BoroCode'):
+    """
+    Impute the borough of each [lat, lon] point.
+
+    Parameters
+    ----------
+    :param lats, lons (array-like): point coordinates (degrees, WGS-84);
+           nan for missing points.
+    :param gdf (geopandas.GeoDataFrame): the polygons; default: the NYC
+           boroughs (nybbwi.shp).
+    :param nearest (bool), default=False: assign the points outside every
+           polygon to the nearest one, within max_dist_km (None: any).
+    :param processes (int), default=None: number of worker processes; the
+           points are split in chunks of chunksize. None or 1: run in this
+           process.
+    :param name_col, code_col (str): columns of gdf to return.
+
+    Return
+    ------
+    df (pandas.DataFrame): columns BoroName & BoroCode, one row per point.
+    """
+    if gdf is None:
+        index = get_boro_index()
+        gdf_cols = None
+    else:
+        index = BoroIndex(gdf, name_col=name_col, code_col=code_col)
+        gdf_cols = gdf[[name_col, code_col, gdf.geometry.name]]
+
+    if not processes or processes == 1:
+        return index.impute(lats, lons, nearest=nearest,
+                            max_dist_km=max_dist_km)
+
+    if gdf_cols is None:
+        from GeocodersComparison import gc4shapes
+
+        gdf_cols = gc4shapes.get_layer('nyc_counties')
+
+    lats = np.asarray(lats, dtype=np.float64).ravel()
+    lons = np.asarray(lons, dtype=np.float64).ravel()
+    bounds = range(0, len(lats), chunksize)
+    chunks = [(lats[i:i + chunksize], lons[i:i + chunksize], nearest,
+               max_dist_km) for i in bounds]
+
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(gdf_cols, name_col, code_col)) as pool:
+        idx = np.concatenate(list(pool.map(_locate_chunk, chunks)) or
+                             [np.empty(0, dtype=np.int64)])
+
+    return index.to_frame(idx)
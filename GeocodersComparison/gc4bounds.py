@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4bounds.py
+Accuracy of the geocoders bounding boxes w.r.t. the places boundaries from
+shapefiles, for all geocoders & places at once:
+ * IoU: intersection over union of the box & the place polygon;
+ * Covered: fraction of the polygon area within the box;
+ * Inside: fraction of the box area within the polygon;
+ * N, E, S, W: overshoot (km) of each side of the box beyond the polygon
+   bounds (negative: the box falls short).
+Areas are computed in an equal-area projection; the overshoots are
+geodesic distances (gc4geodist).
+Requires shapely >= 2 & pyproj >= 2.
+"""
+__author__ = 'catchenal@gmail.com'
+
+import numpy as np
+import pandas as pd
+
+from GeocodersComparison import gc4geodist
+from GeocodersComparison import gc4store
+
+
+# NAD83 / Conus Albers: equal-area, for places in the USA:
+EQUAL_AREA_CRS = 'EPSG:5070'
+
+bounds_metrics = ['IoU', 'Covered', 'Inside', 'N', 'E', 'S', 'W']
+
+
+def _to_crs(geoms, transformer):
+    import shapely
+
+    return shapely.transform(geoms,
+                             lambda xy: np.column_stack(
+                                 transformer.transform(xy[:, 0], xy[:, 1])))
+
+
+class PlaceBounds():
+    """
+    The boundaries (shapely geometries, WGS-84 lon/lat) of a set of places,
+    projected & measured once.
+
+    Example:
+    pb = PlaceBounds({'Bronx county': bronx_geom, 'Boston': boston_geom})
+    pb.box_metrics(geocs, geo_dicts)
+    """
+
+    def __init__(self, place_geoms, crs=EQUAL_AREA_CRS, segment_deg=0.005):
+        import shapely
+        from pyproj import Transformer
+
+        self.places = list(place_geoms.keys())
+        self.places_idx = {p: i for i, p in enumerate(self.places)}
+        self.crs = crs
+        # box sides are densified before projection, so that they follow the
+        # parallels & meridians:
+        self.segment_deg = segment_deg
+
+        self._transformer = Transformer.from_crs('EPSG:4326', crs,
+                                                 always_xy=True)
+
+        geoms = np.asarray(list(place_geoms.values()), dtype=object)
+        # [lon_min, lat_min, lon_max, lat_max] per place
+        self.bounds = shapely.bounds(geoms)
+        self.geoms = _to_crs(geoms, self._transformer)
+        shapely.prepare(self.geoms)
+        self.areas = shapely.area(self.geoms)
+
+    def __len__(self):
+        return len(self.places)
+
+    def box_metrics(self, geocs, geo_dicts, places=None):
+        """
+        Return the DataFrame of the bounds_metrics of each geocoder's box,
+        indexed by (place, geocoder).
+        :param geo_dicts (list): geodata dicts or a gc4store.GeoStore.
+        :param places (list): default: the places with bounds.
+        """
+        import shapely
+
+        if places is None:
+            places = self.places
+        store = gc4store.as_geo_store(geocs, geo_dicts, places)
+        pi = np.array([self.places_idx[p] for p in store.places],
+                      dtype=np.int64)
+
+        # (geocoders, places): NE & SW corners
+        ne_lat, ne_lon = store.boxes[..., 0, 0], store.boxes[..., 0, 1]
+        sw_lat, sw_lon = store.boxes[..., 1, 0], store.boxes[..., 1, 1]
+        found = store.found
+
+        lon_min, lat_min, lon_max, lat_max = self.bounds[pi].T
+
+        out = np.full(store.found.shape + (len(bounds_metrics),), np.nan)
+
+        # areas, for the found boxes:
+        g_i, p_j = np.nonzero(found)
+        boxes = shapely.box(sw_lon[g_i, p_j], sw_lat[g_i, p_j],
+                            ne_lon[g_i, p_j], ne_lat[g_i, p_j])
+        boxes = _to_crs(shapely.segmentize(boxes, self.segment_deg),
+                        self._transformer)
+        polys = self.geoms[pi[p_j]]
+
+        box_area = shapely.area(boxes)
+        poly_area = self.areas[pi[p_j]]
+        inter = shapely.area(shapely.intersection(boxes, polys))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[g_i, p_j, 0] = inter / (box_area + poly_area - inter)
+            out[g_i, p_j, 1] = inter / poly_area
+            out[g_i, p_j, 2] = inter / box_area
+
+        # overshoots: geodesic distance between the box side & the bound,
+        # along a meridian (N, S) or the parallel of the place center (E, W)
+        lat_c = (lat_min + lat_max) / 2
+        lon_c = (lon_min + lon_max) / 2
+        dist = gc4geodist.vincenty_km
+
+        out[..., 3] = np.sign(ne_lat - lat_max) * dist(ne_lat, lon_c,
+                                                       lat_max, lon_c)
+        out[..., 4] = np.sign(ne_lon - lon_max) * dist(lat_c, ne_lon,
+                                                       lat_c, lon_max)
+        out[..., 5] = np.sign(lat_min - sw_lat) * dist(sw_lat, lon_c,
+                                                       lat_min, lon_c)
+        out[..., 6] = np.sign(lon_min - sw_lon) * dist(lat_c, sw_lon,
+                                                       lat_c, lon_min)
+
+        # (place, geocoder) rows:
+        out = out.transpose(1, 0, 2).reshape(-1, len(bounds_metrics))
+        idx = pd.MultiIndex.from_product([store.places, store.geocs],
+                                         names=['place', 'geocoder'])
+        df = pd.DataFrame(out, index=idx, columns=bounds_metrics)
+        df.columns.name = 'Box vs bounds'
+
+        return df
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4build.py
+Incremental build of the report artifacts: the dist_diff html tables
+(output_tables_3), the maps (get_boro_maps), the heatmaps
+(get_geo_dist_heatmap) & the table pictures (df_to_pic).
+
+Each artifact is a Target: output files made by a build function from input
+files (geodata json, shapefiles) & parameters. Its key is the hash of all
+three (& of the keys of the targets it depends on); the keys of the last
+build are kept in gc4settings.BUILD_MANIFEST. A target is rebuilt only if its
+key changed or an output is missing; the stale targets are built by a pool
+of processes, each as soon as its dependencies are done.
+
+The input files are hashed once: the manifest keeps the digest of each file
+with its size & mtime, so that a build with nothing to do only stats the
+files (well under a second).
+
+Note: the code of the build functions is not hashed; use force=True after
+changing it.
+
+Example:
+build_report()                      # current geodata
+build_report(alt_prefix='sep2018')  # sep2018_ files
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+from GeocodersComparison import gc4settings
+
+
+class Target():
+    """
+    A report artifact: build(**params) writes the outputs from the inputs.
+    :param name (str): unique name of the target.
+    :param build (function): module-level function (run in worker processes);
+           it may return the list of files it wrote, which then replaces
+           outputs (e.g. pages of a heatmap).
+    :param params (dict): keyword arguments of build (json-able, or with a
+           stable repr).
+    :param inputs (list): files read by build.
+    :param outputs (list): files written by build.
+    :param deps (list): names of the targets to build first.
+    """
+
+    def __init__(self, name, build, params=None, inputs=(), outputs=(),
+                 deps=()):
+        self.name = name
+        self.build = build
+        self.params = params or {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+
+    def __repr__(self):
+        return 'Target({!r})'.format(self.name)
+
+    def get_key(self, file_digest, dep_keys):
+        """
+        Return the hash of the build function, params, inputs (as per
+        file_digest(path)) & dependencies keys.
+        """
+        h = hashlib.sha1()
+        spec = {'build': self.build.__module__ + '.' +
+                         self.build.__qualname__,
+                'params': self.params}
+        h.update(json.dumps(spec, sort_keys=True, default=repr).encode())
+        for f in sorted(self.inputs):
+            h.update(_rel_path(f).encode())
+            h.update(file_digest(f).encode())
+        for d in self.deps:
+            h.update(dep_keys[d].encode())
+
+        return h.hexdigest()
+
+
+def _rel_path(path):
+    # the keys do not depend on the package location:
+    return os.path.relpath(path, gc4settings.BASE_DIR).replace(os.sep, '/')
+
+
+def _file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fr:
+        for block in iter(lambda: fr.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _run_target(build, params):
+    t0 = time.perf_counter()
+    outputs = build(**params)
+    return outputs, time.perf_counter() - t0
+
+
+class Builder():
+    """
+    Builds the stale targets of a dependency graph.
+
+    Example:
+    b = Builder(get_report_targets())
+    b.get_stale()   # names of the targets to rebuild
+    b.run()
+    """
+
+    def __init__(self, targets, manifest=None):
+        self.targets = OrderedDict((t.name, t) for t in targets)
+        for t in self.targets.values():
+            missing = [d for d in t.deps if d not in self.targets]
+            if missing:
+                msg = 'Target {!r}: unknown dependencies {}.'
+                raise ValueError(msg.format(t.name, missing))
+
+        self.manifest_path = manifest or gc4settings.BUILD_MANIFEST
+        self.manifest = self._load_manifest()
+        self._digests = {}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as fr:
+                data = json.load(fr)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault('files', {})
+        data.setdefault('targets', {})
+        return data
+
+    def _save_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as fw:
+            json.dump(self.manifest, fw, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def file_digest(self, path):
+        """
+        Return the sha1 of path, from the manifest if the file size & mtime
+        are unchanged; 'missing' if not found.
+        """
+        if path in self._digests:
+            return self._digests[path]
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 'missing'
+
+        rel = _rel_path(path)
+        stat = [st.st_size, st.st_mtime_ns]
+        entry = self.manifest['files'].get(rel)
+        if entry is None or entry[:2] != stat:
+            entry = stat + [_file_sha1(path)]
+            self.manifest['files'][rel] = entry
+
+        self._digests[path] = entry[2]
+        return entry[2]
+
+    def get_order(self):
+        """Return the target names, each after its dependencies."""
+        order, seen, visiting = [], set(), set()
+
+        def visit(name):
+            if name in seen:
+                return
+            if name in visiting:
+                raise ValueError('Dependency cycle at {!r}.'.format(name))
+            visiting.add(name)
+            for d in self.targets[name].deps:
+                visit(d)
+            visiting.discard(name)
+            seen.add(name)
+            order.append(name)
+
+        for name in self.targets:
+            visit(name)
+        return order
+
+    def get_keys(self):
+        """Return the current key of each target, in build order."""
+        keys = OrderedDict()
+        for name in self.get_order():
+            keys[name] = self.targets[name].get_key(self.file_digest, keys)
+        return keys
+
+    def get_stale(self, force=False):
+        """
+        Return the names of the targets to build (in build order): new key,
+        missing output, or all if force.
+        """
+        stale = []
+        for name, key in self.get_keys().items():
+            done = self.manifest['targets'].get(name)
+            if (force or done is None or done['key'] != key or
+                    not all(os.path.exists(os.path.join(
+                        gc4settings.BASE_DIR, f)) for f in done['outputs'])):
+                stale.append(name)
+        return stale
+
+    def run(self, processes=None, force=False):
+        """
+        Build the stale targets, those not depending on each other at the
+        same time.
+        :param processes (int): number of worker processes; default: one per
+               core; 1: build in this process.
+        :param force (bool): rebuild all the targets.
+        Return: OrderedDict of the build time (s) of each target built, and
+        'Total' (wall time).
+        """
+        from concurrent.futures import ProcessPoolExecutor, wait, \
+            FIRST_COMPLETED
+
+        t0 = time.perf_counter()
+        keys = self.get_keys()
+        stale = self.get_stale(force=force)
+        timings = OrderedDict()
+        errors = OrderedDict()
+
+        def done(name, outputs, secs):
+            t = self.targets[name]
+            if outputs is None:
+                outputs = t.outputs
+            self.manifest['targets'][name] = {
+                'key': keys[name],
+                'outputs': [_rel_path(f) for f in outputs]}
+            timings[name] = secs
+
+        todo = OrderedDict((name, set(self.targets[name].deps) &
+                            set(stale)) for name in stale)
+
+        def skip_failed():
+            # the targets depending on a failed one are not built:
+            for name in list(todo):
+                if todo[name] & set(errors):
+                    errors[name] = 'dependency failed'
+                    del todo[name]
+
+        if processes == 1:
+            for name in list(todo):
+                skip_failed()
+                if name not in todo:
+                    continue
+                del todo[name]
+                t = self.targets[name]
+                try:
+                    done(name, *_run_target(t.build, t.params))
+                except Exception as e:
+                    errors[name] = e
+        elif todo:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                running = {}
+                while todo or running:
+                    skip_failed()
+                    for name in [n for n, deps in todo.items()
+                                 if not deps - set(timings)]:
+                        t = self.targets[name]
+                        del todo[name]
+                        running[pool.submit(_run_target, t.build,
+                                            t.params)] = name
+                    if not running:
+                        break
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        name = running.pop(fut)
+                        try:
+                            done(name, *fut.result())
+                        except Exception as e:
+                            errors[name] = e
+
+        # the dangling entries of removed targets are kept: harmless
+        self._save_manifest()
+        timings['Total'] = time.perf_counter() - t0
+
+        print('\nBuilt {} of {} targets; wall time (s): {:.2f}'.format(
+              len(timings) - 1, len(self.targets), timings['Total']))
+        if errors:
+            msg = 'Failed targets: ' + '; '.join('{}: {!r}'.format(k, v)
+                                                   for k, v in errors.items())
+            raise RuntimeError(msg)
+
+        return timings
+
+
+# Report targets: ------------------------------------------------------------
+# The build functions load the geodata themselves: nothing but the file
+# names is read to plan the build.
+
+def get_geo_files(geocs, alt_prefix=''):
+    """Return the geodata json files of geocs, as get_geodata() names them."""
+    return [os.path.join(gc4settings.DIR_GEO,
+                         alt_prefix + 'geodata_' + g[:3] + '.json')
+            for g in geocs]
+
+
+def _get_store(geocs, alt_prefix, places=None):
+    from GeocodersComparison import gc4store
+
+    return gc4store.GeoStore.from_geo_files(geocs, alt_prefix=alt_prefix,
+                                            places=places)
+
+
+def _build_dist_diff(geocs, alt_prefix, place, num):
+    from GeocodersComparison import comparison
+
+    store = _get_store(geocs, alt_prefix, [place])
+    diff_df = comparison.compare_geocoords(
+                  comparison.get_geodata_df(geocs, store, place))
+    return [comparison.output_table_3(num, place, diff_df,
+                                      file_prefix=alt_prefix)]
+
+
+def _build_map(geocs, alt_prefix, place, spec, colors_d, map_style,
+               external_assets):
+    from GeocodersComparison import comparison
+
+    store = _get_store(geocs, alt_prefix, [place])
+    locs_df = comparison.get_geodata_df(geocs, store, place)
+
+    spec = dict(spec)
+    m = comparison.get_boro_maps(locs_df=locs_df,
+                                 bounds_gdf=spec.pop('layer'),
+                                 colors_d=colors_d, map_style=map_style,
+                                 external_assets=external_assets,
+                                 file_prefix=alt_prefix, **spec)
+
+    outputs = [os.path.join(gc4settings.DIR_HTML,
+                            alt_prefix + place.replace(' ', '_') + '.html')]
+    if external_assets:
+        from GeocodersComparison import gc4maps
+
+        # the content-hashed boundaries, known once written:
+        outputs += gc4maps.get_asset_files(m, gc4settings.DIR_HTML)
+    return outputs
+
+
+def _build_heatmap(geocs, alt_prefix, places, unit):
+    from GeocodersComparison import comparison
+
+    store = _get_store(geocs, alt_prefix, places)
+    return comparison.get_geo_dist_heatmap(places, None, unit=unit,
+                                           geocs=geocs, geo_dicts=store,
+                                           file_prefix=alt_prefix)
+
+
+def _build_table_pic(geocs, alt_prefix, places, table, name):
+    from GeocodersComparison import comparison
+
+    store = _get_store(geocs, alt_prefix, places)
+    if table == 'loc_center':
+        df = comparison.compare_location_with_geobox(places, geocs, store)
+    else:
+        df = comparison.compare_two_geoboxes(places[0], places[1], geocs,
+                                             store)
+    comparison.df_to_pic(df, header_columns=0, save_tbl_name=name)
+
+
+# df_to_pic() tables: name: (table, places or None for all)
+report_pics = {'comp_Loc_center_tbl': ('loc_center', None),
+               'comp_NYC_NYcnty_tbl': ('two_boxes', ['New York City',
+                                                     'New York county'])}
+
+
+def get_report_targets(geocs=None, alt_prefix='', places=None,
+                       colors_d=None, map_style='cartodbpositron',
+                       external_assets=False):
+    """
+    Return the Targets of the report artifacts for the geodata files of
+    geocs (with alt_prefix): per place, the dist_diff table & the map (for
+    the places with map settings, see comparison.get_map_spec()); the km &
+    mi heatmaps; the report_pics table pictures. The output files are
+    prefixed with alt_prefix.
+    :param places (list): default: the places of the first geodata file.
+    """
+    from GeocodersComparison import comparison
+    from GeocodersComparison import gc4shapes
+
+    if geocs is None:
+        geocs = gc4settings.geocs
+    if alt_prefix and alt_prefix[-1] != '_':
+        alt_prefix += '_'
+    if colors_d is None:
+        colors_d = gc4settings.colors_dict
+
+    geo_files = get_geo_files(geocs, alt_prefix)
+    if places is None:
+        with open(geo_files[0]) as fr:
+            places = list(json.load(fr).keys())
+
+    common = dict(geocs=list(geocs), alt_prefix=alt_prefix)
+    targets = []
+
+    for i, p in enumerate(places):
+        name = alt_prefix + p.replace(' ', '_')
+        targets.append(Target(
+            'dist_diff:' + p, _build_dist_diff,
+            params=dict(common, place=p, num=i + 1),
+            inputs=geo_files,
+            outputs=[os.path.join(gc4settings.DIR_HTML,
+                                  name + '_dist_diff.html')]))
+        try:
+            spec = comparison.get_map_spec(p)
+        except ValueError:
+            continue
+        targets.append(Target(
+            'map:' + p, _build_map,
+            params=dict(common, place=p, spec=spec, colors_d=colors_d,
+                        map_style=map_style, external_assets=external_assets),
+            inputs=geo_files + gc4shapes.get_layer_files(spec['layer']),
+            outputs=[os.path.join(gc4settings.DIR_HTML, name + '.html')]))
+
+    for unit in ['km', 'mi']:
+        targets.append(Target(
+            'heatmap:' + unit, _build_heatmap,
+            params=dict(common, places=list(places), unit=unit),
+            inputs=geo_files,
+            outputs=[os.path.join(gc4settings.DIR_IMG, alt_prefix +
+                                  'Heatmap_sns_geodist_difference_' + unit +
+                                  '.svg')]))
+
+    for pic, (table, pic_places) in report_pics.items():
+        if pic_places is None:
+            pic_places = list(places)
+        elif not set(pic_places) <= set(places):
+            continue
+        targets.append(Target(
+            'pic:' + pic, _build_table_pic,
+            params=dict(common, places=pic_places, table=table,
+                        name=alt_prefix + pic),
+            inputs=geo_files,
+            outputs=[os.path.join(gc4settings.DIR_IMG,
+                                  alt_prefix + pic + '.svg')]))
+
+    return targets
+
+
+def build_report(geocs=None, alt_prefix='', places=None, processes=None,
+                 force=False, manifest=None, **kwargs):
+    """
+    Build the stale report artifacts (see get_report_targets() for the
+    parameters & Builder.run() for processes & force); return the timings.
+    """
+    targets = get_report_targets(geocs=geocs, alt_prefix=alt_prefix,
+                                 places=places, **kwargs)
+    return Builder(targets, manifest=manifest).run(processes=processes,
+                                                   force=force)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4bulk.py
+Streaming bulk geocoding of large csv or json lines files, with
+checkpoint/resume.
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import csv
+import json
+import time
+import itertools
+
+from GeocodersComparison import gc4fetch
+from GeocodersComparison import gc4utils
+
+
+def iter_queries(infile, query_col='query', skip=0):
+    """
+    Yield the query strings of infile, one per row, lazily.
+    :param infile (str): a csv file (with header) or a json lines file
+           ('.jsonl', '.ndjson'), where each line is either a json string or
+           an object with a query_col field.
+    :param query_col (str): the name of the column holding the query.
+    :param skip (int): number of rows to skip (already processed).
+    """
+    ext = gc4utils.get_file_ext(infile)
+
+    with open(infile, newline='', encoding='utf-8') as fr:
+        if ext in ['.jsonl', '.ndjson']:
+            rows = (json.loads(line) for line in fr if line.strip())
+            rows = (r if isinstance(r, str) else r[query_col] for r in rows)
+        elif ext == '.csv':
+            rows = (r[query_col] for r in csv.DictReader(fr))
+        else:
+            raise TypeError('Not a csv or json lines file: {}'.format(infile))
+
+        for q in itertools.islice(rows, skip, None):
+            yield q
+
+
+def iter_chunks(iterable, chunksize):
+    """Yield lists of at most chunksize items from iterable."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_checkpoint(ckpt_file):
+    """Return the checkpoint dict {'rows_done', 'out_bytes'}."""
+    if not os.path.exists(ckpt_file):
+        return {'rows_done': 0, 'out_bytes': 0}
+    with open(ckpt_file) as fr:
+        return json.load(fr)
+
+
+def write_checkpoint(ckpt_file, ckpt):
+    """Replace the checkpoint file atomically."""
+    tmp = ckpt_file + '.tmp'
+    with open(tmp, 'w') as fw:
+        json.dump(ckpt, fw)
+        fw.flush()
+        os.fsync(fw.fileno())
+    os.replace(tmp, ckpt_file)
+
+
+def bulk_geocode(geocoder_to_use, infile, outfile=None, query_col='query',
+                 chunksize=500, restart=False, show_info=True, **fetch_kw):
+    """
+    Geocode the queries of a (large) csv or json lines file with one geocoder,
+    chunk by chunk, so that memory use does not depend on the file size.
+
+    After each chunk, the results are appended to outfile (json lines) and
+    the number of rows processed is saved in the checkpoint file
+    <outfile>.ckpt. If the run stops (crash, quota cut-off...), calling
+    bulk_geocode again with the same arguments resumes after the last chunk
+    saved; a partly written chunk is discarded.
+
+    Parameters
+    ----------
+    :param: geocoder_to_use (str): one of gc4settings.geocs.
+    :param: infile (str): csv or json lines input file (see iter_queries()).
+    :param: outfile (str), default=None: json lines output file; default:
+            <infile base name>_geodata_<geocoder_to_use[:3]>.jsonl.
+    :param: query_col (str), default='query': column holding the query.
+    :param: chunksize (int), default=500: rows per chunk (& checkpoint).
+    :param: restart (bool), default=False: ignore the checkpoint & start over.
+            Without restart, a ValueError is raised if the checkpoint was
+            made from another geocoder or input file, or if the input file
+            changed (size or mtime) since.
+    :param: show_info (bool), default=True: print the progress.
+    :param: fetch_kw: passed to gc4fetch.fetch_locations(), e.g.
+            concurrent=True, cache=gc4cache.get_cache(). By default
+            on_error='raise': a query failing after its retries stops the
+            run at the last checkpoint, to be resumed, instead of leaving an
+            empty row.
+
+    Output
+    ------
+    One json object per input row:
+    {"row": 0, "query": "...", "place": "...", "loc": [..], "box": [..]}
+    ("loc" and "box" missing when the geocoder found nothing).
+
+    Returns
+    -------
+    ckpt (dict): the final checkpoint, e.g. {'rows_done': 85000, ...}.
+    """
+    if outfile is None:
+        base = os.path.splitext(infile)[0]
+        outfile = base + '_geodata_' + geocoder_to_use[:3] + '.jsonl'
+    ckpt_file = outfile + '.ckpt'
+
+    if restart:
+        for f in [outfile, ckpt_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    # what the checkpoint was made from:
+    st = os.stat(infile)
+    source = {'infile': os.path.abspath(infile), 'geocoder': geocoder_to_use,
+              'in_size': st.st_size, 'in_mtime': st.st_mtime}
+
+    ckpt = read_checkpoint(ckpt_file)
+    if not os.path.exists(outfile):
+        ckpt = {'rows_done': 0, 'out_bytes': 0}
+    elif ckpt['rows_done']:
+        changed = [k for k in source if k in ckpt and ckpt[k] != source[k]]
+        if changed:
+            msg = ('The checkpoint {} does not match this run ({} changed): '
+                   'use restart=True to start over.')
+            raise ValueError(msg.format(ckpt_file, ', '.join(changed)))
+    ckpt.update(source)
+
+    fetch_kw.setdefault('on_error', 'raise')
+    if fetch_kw.get('g') is None:
+        # one geocoder instance for all the chunks:
+        fetch_kw['g'] = gc4fetch.get_client(geocoder_to_use,
+                                            tout=fetch_kw.pop('tout', 5))
+
+    if show_info and ckpt['rows_done']:
+        print('Resuming after row {}.'.format(ckpt['rows_done']))
+
+    t0 = time.perf_counter()
+    n0 = ckpt['rows_done']
+
+    with open(outfile, 'a+', encoding='utf-8') as fw:
+        # drop any output written after the last checkpoint:
+        fw.truncate(ckpt['out_bytes'])
+        fw.seek(ckpt['out_bytes'])
+
+        queries = iter_queries(infile, query_col=query_col,
+                               skip=ckpt['rows_done'])
+
+        for chunk in iter_chunks(queries, chunksize):
+            results = gc4fetch.fetch_locations(geocoder_to_use, chunk,
+                                               **fetch_kw)
+
+            row = ckpt['rows_done']
+            for i, (q, info_d) in enumerate(zip(chunk, results)):
+                rec = {'row': row + i,
+                       'query': q,
+                       'place': gc4fetch.get_place_name(q)}
+                rec.update(info_d)
+                fw.write(json.dumps(rec) + '\n')
+
+            fw.flush()
+            os.fsync(fw.fileno())
+
+            ckpt['rows_done'] = row + len(chunk)
+            ckpt['out_bytes'] = fw.tell()
+            write_checkpoint(ckpt_file, ckpt)
+
+            if show_info:
+                dt = time.perf_counter() - t0
+                rate = (ckpt['rows_done'] - n0) / dt if dt else 0.
+                print('{}: {} rows done ({:.1f} rows/s)'.format(
+                      geocoder_to_use, ckpt['rows_done'], rate))
+
+    return ckpt
+
+
+def iter_bulk_results(outfile):
+    """Yield the records of a bulk_geocode() output file, lazily."""
+    with open(outfile, encoding='utf-8') as fr:
+        for line in fr:
+            yield json.loads(line)
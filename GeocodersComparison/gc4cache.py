@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4cache.py
+On-disk (sqlite) cache of the geocoders responses, keyed by
+(geocoder, normalized query).
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4utils
+
+
+def normalize_query(q):
+    """
+    Return the cache key of a query string: lower case, single spaces, no
+    space before commas, e.g. ' Boston ,  MA, USA' -> 'boston, ma, usa'.
+    """
+    q = re.sub(r'\s+', ' ', q.strip().lower())
+    return re.sub(r'\s+,', ',', q)
+
+
+class GeoCache():
+    """
+    Sqlite store of geocoding results: one row per (geocoder, query) with the
+    raw response, the normalized geodata {'loc', 'box'}, its creation time and
+    time-to-live (s). Rows past their ttl are ignored, but kept as a fallback
+    (see get(allow_expired=True)); when the row count goes over max_entries,
+    the expired rows are evicted first, then the least recently used ones.
+
+    Example:
+    cache = GeoCache()
+    cache.put('Nominatim', 'Boston, MA, USA', raw, info_d)
+    cache.get('Nominatim', 'boston, MA, USA')  # -> info_d
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        if path is None:
+            path = gc4settings.CACHE_DB
+        if ttl is None:
+            ttl = gc4settings.CACHE_TTL
+        if max_entries is None:
+            max_entries = gc4settings.CACHE_MAX_ENTRIES
+
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # one connection shared by the fetching threads:
+        self._lock = threading.Lock()
+        # access times of the hits, written with the next put, evict or close
+        #  (not one write transaction per lookup):
+        self._touched = {}
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._con:
+            self._con.execute('PRAGMA journal_mode=WAL')
+            self._con.execute("""CREATE TABLE IF NOT EXISTS geocache (
+                                 geocoder TEXT NOT NULL,
+                                 query TEXT NOT NULL,
+                                 raw TEXT,
+                                 geodata TEXT NOT NULL,
+                                 created REAL NOT NULL,
+                                 ttl REAL NOT NULL,
+                                 accessed REAL NOT NULL,
+                                 PRIMARY KEY (geocoder, query))""")
+            self._con.execute("""CREATE INDEX IF NOT EXISTS idx_accessed
+                                 ON geocache (accessed)""")
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute('SELECT COUNT(*) FROM geocache'
+                                     ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            with self._con:
+                self._flush_touched()
+            self._con.close()
+
+    def _flush_touched(self):
+        # under the lock, in a transaction
+        if self._touched:
+            self._con.executemany("""UPDATE geocache SET accessed=?
+                                     WHERE geocoder=? AND query=?""",
+                                  [(t, geo, key) for (geo, key), t
+                                   in self._touched.items()])
+            self._touched.clear()
+
+    def get(self, geocoder, q, with_raw=False, allow_expired=False):
+        """
+        Return the cached geodata of query q (or (geodata, raw) if with_raw),
+        None if missing or expired (unless allow_expired, e.g. as a fallback
+        when the geocoder is unavailable).
+        """
+        key = normalize_query(q)
+        now = time.time()
+
+        with self._lock:
+            row = self._con.execute("""SELECT raw, geodata, created, ttl
+                                       FROM geocache
+                                       WHERE geocoder=? AND query=?""",
+                                    (geocoder, key)).fetchone()
+            if row is None:
+                return None
+
+            raw, geodata, created, ttl = row
+            if now - created > ttl and not allow_expired:
+                return None
+
+            self._touched[(geocoder, key)] = now
+
+        geodata = json.loads(geodata, object_pairs_hook=OrderedDict)
+        if with_raw:
+            return geodata, (None if raw is None else json.loads(raw))
+        return geodata
+
+    def put(self, geocoder, q, raw, geodata, ttl=None):
+        """Insert or replace the row of query q."""
+        self.put_many(geocoder, [(q, raw, geodata)], ttl=ttl)
+
+    def put_many(self, geocoder, rows, ttl=None):
+        """
+        Insert or replace several rows in one transaction.
+        :param rows (iterable): (query, raw, geodata) tuples.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        now = time.time()
+
+        data = [(geocoder, normalize_query(q),
+                 None if raw is None else json.dumps(raw),
+                 json.dumps(geodata), now, ttl, now)
+                for q, raw, geodata in rows]
+
+        with self._lock, self._con:
+            self._flush_touched()
+            self._con.executemany("""INSERT OR REPLACE INTO geocache
+                                     VALUES (?, ?, ?, ?, ?, ?, ?)""", data)
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the rows over max_entries: the expired ones first, then the
+        least recently used. Return the number of rows deleted.
+        """
+        n = 0
+        with self._lock, self._con:
+            self._flush_touched()
+            excess = self._con.execute('SELECT COUNT(*) FROM geocache'
+                                       ).fetchone()[0] - self.max_entries
+            if excess > 0:
+                cur = self._con.execute("""DELETE FROM geocache WHERE rowid IN
+                                           (SELECT rowid FROM geocache
+                                            ORDER BY ? - created > ttl DESC,
+                                                     accessed
+                                            LIMIT ?)""",
+                                        (time.time(), excess))
+                n = cur.rowcount
+        return n
+
+    def import_geo_file(self, geocoder, geofile, query_list=None, ttl=None):
+        """
+        Warm start: load a geodata_XXX.json file into the cache.
+        The json files are keyed by place, so query_list (default:
+        gc4settings.query_lst) maps each query to its place.
+        Return the number of rows imported.
+        """
+        from GeocodersComparison.gc4fetch import get_place_name
+
+        if query_list is None:
+            query_list = gc4settings.query_lst
+
+        geodata = gc4utils.get_geo_file(geofile, show_info=False)
+        if geodata is None:
+            return 0
+
+        rows = [(q, None, geodata[get_place_name(q)]) for q in query_list
+                if geodata.get(get_place_name(q))]
+        self.put_many(geocoder, rows, ttl=ttl)
+        return len(rows)
+
+    def import_geo_files(self, query_list=None, alt_prefix='', ttl=None):
+        """
+        Warm start for all geocoders in gc4settings.geocs from their
+        geodata json files in gc4settings.DIR_GEO.
+        """
+        if alt_prefix and alt_prefix[-1] != '_':
+            alt_prefix += '_'
+
+        n = 0
+        for geo in gc4settings.geocs:
+            out = alt_prefix + 'geodata_' + geo[:3] + '.json'
+            n += self.import_geo_file(geo,
+                                      os.path.join(gc4settings.DIR_GEO, out),
+                                      query_list=query_list, ttl=ttl)
+        return n
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the default GeoCache (gc4settings.CACHE_DB), opened once."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = GeoCache()
+        return _cache
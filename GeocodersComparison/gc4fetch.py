@@ -0,0 +1,710 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4fetch.py
+Geocoding requests: geocoder setup, response parsing & throttled fetching.
+"""
+__author__ = 'catchenal@gmail.com'
+
+import time
+import random
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from GeocodersComparison import gc4settings
+
+
+class RateLimiter():
+    """
+    Thread-safe throttle for one geocoding service: calls are spaced by at
+    least 1/rps seconds and at most in_flight calls run at the same time.
+    Use as a context manager around each request:
+
+    Example:
+    lim = RateLimiter(rps=1, in_flight=1)
+    with lim:
+        location = g.geocode(q)
+    """
+
+    def __init__(self, rps=None, in_flight=None):
+        self._lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._active = 0
+        self._next_start = 0.
+        self._base = {'rps': rps, 'in_flight': in_flight}
+        self._overrides = []
+        self._apply()
+
+    def _apply(self):
+        # the latest override active, else the base limits
+        with self._slots:
+            limits = self._overrides[-1][1] if self._overrides else self._base
+            self.rps = limits.get('rps')
+            self.in_flight = limits.get('in_flight')
+            self.interval = 1. / self.rps if self.rps else 0.
+            self._slots.notify_all()
+
+    @contextlib.contextmanager
+    def limits(self, rps=None, in_flight=None):
+        """
+        Context manager: the limits are rps & in_flight until exit, then the
+        previous ones are restored; the throttle state is kept, so that the
+        concurrent callers stay within the limits in force.
+        """
+        token = object()
+        with self._slots:
+            self._overrides.append((token, {'rps': rps,
+                                            'in_flight': in_flight}))
+            self._apply()
+        try:
+            yield self
+        finally:
+            with self._slots:
+                self._overrides = [o for o in self._overrides
+                                   if o[0] is not token]
+                self._apply()
+
+    def __enter__(self):
+        with self._slots:
+            while self.in_flight and self._active >= self.in_flight:
+                self._slots.wait()
+            self._active += 1
+
+        # reserve the next start time, then wait for it outside the lock:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+
+        wait = start - now
+        if wait > 0:
+            time.sleep(wait)
+        return self
+
+    def __exit__(self, *exc):
+        with self._slots:
+            self._active -= 1
+            self._slots.notify()
+        return False
+
+
+# One limiter per geocoder, shared by all the calls made in this process:
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(geocoder_to_use):
+    """
+    Return the RateLimiter shared by all requests to geocoder_to_use, with
+    the limits of gc4settings.geocs_limits (see rate_limits() to override
+    them).
+    """
+    with _limiters_lock:
+        lim = _limiters.get(geocoder_to_use)
+        if lim is None:
+            limits = gc4settings.geocs_limits.get(geocoder_to_use, {})
+            lim = _limiters[geocoder_to_use] = RateLimiter(**limits)
+        return lim
+
+
+@contextlib.contextmanager
+def rate_limits(geocoder_to_use, limits=None):
+    """
+    Context manager yielding the shared RateLimiter of geocoder_to_use,
+    with limits {'rps': x, 'in_flight': n} (if given) until exit only.
+
+    Example:
+    with rate_limits('Nominatim', {'rps': 2}) as lim:
+        ...
+    """
+    lim = get_rate_limiter(geocoder_to_use)
+    if limits is None:
+        yield lim
+    else:
+        with lim.limits(**limits):
+            yield lim
+
+
+def reset_rate_limiters():
+    """Drop the shared limiters: the next ones have the settings limits."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit is open."""
+
+
+class CircuitBreaker():
+    """
+    Thread-safe circuit breaker for one geocoding service: after `failures`
+    failed requests in a row, the circuit opens & the requests fail fast
+    (CircuitOpenError) for reset_after seconds, instead of each waiting for
+    its timeout; then one trial request is let through (half-open): its
+    success closes the circuit, its failure opens it again.
+
+    Example:
+    cb = CircuitBreaker(failures=5, reset_after=30)
+    if cb.allow():
+        ...     # then cb.record_success() or cb.record_failure()
+    """
+
+    def __init__(self, failures=5, reset_after=30.):
+        self.failures = failures
+        self.reset_after = reset_after
+
+        self._lock = threading.Lock()
+        self._n_failed = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        """'closed', 'open' or 'half-open'."""
+        with self._lock:
+            return self._get_state(time.monotonic())
+
+    def _get_state(self, now):
+        if self._opened_at is None:
+            return 'closed'
+        if now - self._opened_at < self.reset_after:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """Return True if a request may be sent now."""
+        with self._lock:
+            state = self._get_state(time.monotonic())
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._n_failed = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._n_failed += 1
+            if self._trial or self._n_failed >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+# One circuit breaker per geocoder, shared by all the calls of this process:
+_breakers = {}
+
+
+def get_circuit_breaker(geocoder_to_use):
+    """
+    Return the CircuitBreaker shared by all requests to geocoder_to_use, set
+    from gc4settings.CIRCUIT_BREAKER.
+    """
+    with _limiters_lock:
+        if geocoder_to_use not in _breakers:
+            _breakers[geocoder_to_use] = CircuitBreaker(
+                                             **gc4settings.CIRCUIT_BREAKER)
+        return _breakers[geocoder_to_use]
+
+
+def reset_circuit_breakers():
+    """Close all the circuits (e.g. after changing the geocoders domains)."""
+    with _limiters_lock:
+        _breakers.clear()
+
+
+# Queries that could not be geocoded, by geocoder: {query: error}; a query
+#  is removed once geocoded:
+_failed = {}
+
+
+def record_failed_query(geocoder_to_use, q, error=None):
+    with _limiters_lock:
+        _failed.setdefault(geocoder_to_use, OrderedDict())[q] = repr(error)
+
+
+def get_failed_queries(geocoder_to_use=None):
+    """
+    Return the failed queries {query: error} of geocoder_to_use, or of all
+    the geocoders as {geocoder: {query: error}}.
+    """
+    with _limiters_lock:
+        if geocoder_to_use is not None:
+            return OrderedDict(_failed.get(geocoder_to_use, {}))
+        return OrderedDict((k, OrderedDict(v)) for k, v in _failed.items())
+
+
+def clear_failed_queries(geocoder_to_use=None):
+    with _limiters_lock:
+        if geocoder_to_use is None:
+            _failed.clear()
+        else:
+            _failed.pop(geocoder_to_use, None)
+
+
+def _iter_error_chain(error):
+    # error, then the exceptions it was raised from or while handling
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def get_http_status(error):
+    """
+    Return the http status code of a geocoding error: that of the HTTPError
+    geopy raised it from (possibly while handling another error), or None.
+    """
+    for e in _iter_error_chain(error):
+        code = getattr(e, 'code', None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_rate_limited(error):
+    """
+    True if error is a throttling answer (http 429), which may succeed
+    later; geopy < 2 raises GeocoderQuotaExceeded for both the 429 & the
+    used-up quota (402, or OVER_QUERY_LIMIT from GoogleV3), which will not.
+    """
+    from geopy import exc
+
+    rate_limited = getattr(exc, 'GeocoderRateLimited', None)
+    if rate_limited is not None and isinstance(error, rate_limited):
+        return True
+    return isinstance(error, exc.GeocoderQuotaExceeded) and \
+        get_http_status(error) == 429
+
+
+def is_transient(error):
+    """
+    True if a request failing with error may succeed later: timeouts,
+    unavailable service, server errors (http 5xx) & throttling (http 429,
+    see is_rate_limited()); not the authentication or query errors (other
+    http 4xx), nor a used-up quota.
+    """
+    from geopy import exc
+
+    if is_rate_limited(error):
+        return True
+    if isinstance(error, (exc.GeocoderTimedOut, exc.GeocoderUnavailable,
+                          TimeoutError, ConnectionError)):
+        return True
+    if type(error) is not exc.GeocoderServiceError:
+        return False
+
+    # geopy's generic error, e.g. for the http codes it does not map:
+    status = get_http_status(error)
+    if status is not None:
+        return 500 <= status < 600
+    return any(isinstance(e, (TimeoutError, ConnectionError))
+               for e in _iter_error_chain(error))
+
+
+def get_backoff_delay(attempt, base_delay=0.5, max_delay=8.):
+    """
+    Return the wait (s) before retry number attempt (from 0): random in
+    [0, min(max_delay, base_delay * 2**attempt)] ("full jitter"), so that
+    the retries of concurrent requests do not hit the service together.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def get_place_name(q):
+    """
+    Return the key identifying the place queried in the geodata dict, w.r.t.
+    county or not, e.g.: 'Bronx county, NY, USA' -> 'Bronx county'.
+    """
+    if 'county' in q:
+        return q.split(' county, ')[0] + ' county'
+    return q.split(', ')[0]
+
+
+def get_geocoder(geocoder_to_use, tout=5, domain=None, scheme=None):
+    """
+    Return a geopy geocoder instance for one of gc4settings.geocs.
+    :param domain (str): host[:port] of the service; default:
+           gc4settings.geocs_domains, else geopy's.
+    :param scheme (str): 'http' or 'https'; default:
+           gc4settings.GEOCODERS_SCHEME, else geopy's.
+    """
+    idx = gc4settings.geocs.index(geocoder_to_use)
+
+    kw = dict(timeout=tout)
+    if domain is None:
+        domain = gc4settings.geocs_domains.get(geocoder_to_use)
+    if domain:
+        kw['domain'] = domain
+    if scheme is None:
+        scheme = gc4settings.GEOCODERS_SCHEME
+    if scheme:
+        kw['scheme'] = scheme
+
+    if idx == 0:
+        from geopy.geocoders import Nominatim
+
+        return Nominatim(user_agent='this_app', country_bias='USA', **kw)
+    elif idx == 1:
+        from geopy.geocoders import GoogleV3
+
+        return GoogleV3(api_key=gc4settings.GOOGLE_KEY, **kw)
+    elif idx == 2:
+        from geopy.geocoders import ArcGIS
+
+        return ArcGIS(user_agent='this_app', **kw)
+    else:
+        # original setup stopped working 9/12/18: unable to resolve the
+        # http 400 error; reverted to request/json.
+        from geopy.geocoders import AzureMaps
+
+        return AzureMaps(subscription_key=gc4settings.AZURE_KEY,
+                         user_agent='ths_app', **kw)
+
+
+# Long-lived http session & geocoder clients, shared by all the calls made in
+# this process (see get_session() & get_client()):
+_session = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_session(pool_size=None):
+    """
+    Return the requests.Session shared by the geocoder clients: its
+    connections are kept alive & pooled (pool_size per host; default:
+    gc4settings.HTTP_POOL_SIZE), so a batch pays the TCP & TLS handshakes
+    once per connection instead of once per query.
+    """
+    global _session
+
+    with _clients_lock:
+        if _session is None or pool_size is not None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            if pool_size is None:
+                pool_size = gc4settings.HTTP_POOL_SIZE
+            if _session is not None:
+                _session.close()
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=len(gc4settings.geocs),
+                                  pool_maxsize=pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            # a new session: the clients using the old one are dropped
+            _clients.clear()
+
+        return _session
+
+
+def reset_session():
+    """Close the shared session & drop the clients using it."""
+    global _session
+
+    with _clients_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _clients.clear()
+
+
+def get_session_urlopen(session):
+    """
+    Return a replacement for a geopy geocoder's urlopen (urllib: one
+    connection per request) that sends the request with session.
+    HTTP & connection errors are raised as urllib's, so that geopy maps them
+    to its usual exceptions.
+    """
+    import io
+    import socket
+    from urllib.error import HTTPError, URLError
+
+    import requests
+
+    def urlopen(req, timeout=None, **kwargs):
+        url = req.get_full_url()
+        try:
+            r = session.get(url, headers=dict(req.header_items()),
+                            timeout=timeout)
+        except requests.Timeout:
+            raise socket.timeout('timed out')
+        except requests.ConnectionError as e:
+            raise URLError('Service unreachable: {}'.format(e))
+
+        if r.status_code >= 400:
+            raise HTTPError(url, r.status_code, r.reason, r.headers,
+                            io.BytesIO(r.content))
+        return r
+
+    return urlopen
+
+
+def get_client(geocoder_to_use, tout=5):
+    """
+    Return the long-lived geocoder client for geocoder_to_use: a geopy
+    geocoder (see get_geocoder()) sending its requests through the shared
+    keep-alive session (see get_session()).
+    Clients are reused across get_geodata() & get_geo_dicts() calls.
+    """
+    session = get_session()
+
+    key = (geocoder_to_use, tout,
+           gc4settings.geocs_domains.get(geocoder_to_use),
+           gc4settings.GEOCODERS_SCHEME)
+
+    with _clients_lock:
+        g = _clients.get(key)
+        if g is None:
+            g = get_geocoder(geocoder_to_use, tout=tout)
+            g.urlopen = get_session_urlopen(session)
+            _clients[key] = g
+        return g
+
+
+def geocode_raw(g, geocoder_to_use, q):
+    """
+    Return the raw json response of geocoder g for query q; an empty dict if
+    q is not found.
+    """
+    if geocoder_to_use == 'Nominatim':
+        location = g.geocode(q, addressdetails=True)
+    else:
+        location = g.geocode(q)
+
+    if location is None:
+        return {}
+    location = location.raw
+
+    if isinstance(location, list):
+        location = location[0]
+    return location
+
+
+def geocode_resilient(g, geocoder_to_use, q, limiter=None, retry=None,
+                      breaker=None, retry_throttled=True):
+    """
+    geocode_raw() with retries & circuit breaker: the transient failures
+    (see is_transient()) are retried after a jittered exponential backoff
+    (see get_backoff_delay()); each failed request counts towards opening
+    the geocoder's circuit, which then fails fast.
+    :param limiter (RateLimiter): throttle of each request (not of the
+           waits between retries).
+    :param retry (dict): overrides gc4settings.RETRY_POLICY, e.g.
+           {'retries': 0}.
+    :param breaker (CircuitBreaker): default: get_circuit_breaker().
+    :param retry_throttled (bool): if False, a 429 (see is_rate_limited())
+           is raised at once & not counted by the breaker, for the callers
+           pacing themselves on the 429s (gc4sched).
+    Raise CircuitOpenError, or the last error.
+    """
+    retry = dict(gc4settings.RETRY_POLICY, **(retry or {}))
+    retries = retry.pop('retries')
+    if breaker is None:
+        breaker = get_circuit_breaker(geocoder_to_use)
+
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            msg = '{}: circuit open, query not sent: {}'
+            raise CircuitOpenError(msg.format(geocoder_to_use, q))
+        try:
+            if limiter is not None:
+                with limiter:
+                    location = geocode_raw(g, geocoder_to_use, q)
+            else:
+                location = geocode_raw(g, geocoder_to_use, q)
+        except Exception as e:
+            if not retry_throttled and is_rate_limited(e):
+                raise
+            if not is_transient(e):
+                # the service answered: it is up
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt >= retries:
+                raise
+            time.sleep(get_backoff_delay(attempt, **retry))
+            attempt += 1
+        else:
+            breaker.record_success()
+            return location
+
+
+def parse_location(geocoder_to_use, location):
+    """
+    Return the normalized geodata of a raw response:
+    odict_keys(['loc', 'box']) where loc=['lat', 'lon'] and
+    box=[[NE lat, lon], [SW lat, lon]].
+    """
+    info_d = OrderedDict()
+
+    if not len(location):   # not sure that's a sufficient check...
+        return info_d
+
+    idx = gc4settings.geocs.index(geocoder_to_use)
+
+    if idx == 0:
+        # pt location
+        info_d['loc'] = [float(location['lat']),
+                         float(location['lon'])]
+        # bounding boxes as 2 corner pts: [NE], [SW]
+        info_d['box'] = [[float(location['boundingbox'][1]),
+                          float(location['boundingbox'][3])],
+                         [float(location['boundingbox'][0]),
+                          float(location['boundingbox'][2])]]
+
+    elif idx == 1:
+        info_d['loc'] = [location['geometry']['location']['lat'],
+                         location['geometry']['location']['lng']]
+        info_d['box'] = [[location['geometry']['viewport']['northeast']['lat'],
+                          location['geometry']['viewport']['northeast']['lng']],
+                         [location['geometry']['viewport']['southwest']['lat'],
+                          location['geometry']['viewport']['southwest']['lng']]]
+
+    elif idx == 2:
+        info_d['loc'] = [location['location']['y'],
+                         location['location']['x']]
+        info_d['box'] = [[location['extent']['ymax'],
+                          location['extent']['xmax']],
+                         [location['extent']['ymin'],
+                          location['extent']['xmin']]]
+
+    else:
+        info_d['loc'] = [location['position']['lat'],
+                         location['position']['lon']]
+        info_d['box'] = [[location['viewport']['topLeftPoint']['lat'],
+                          location['viewport']['btmRightPoint']['lon']],
+                         [location['viewport']['btmRightPoint']['lat'],
+                          location['viewport']['topLeftPoint']['lon']]]
+
+    return info_d
+
+
+def fetch_locations(geocoder_to_use, query_list, g=None, tout=5,
+                    concurrent=False, max_workers=None, limits=None,
+                    cache=None, retry=None, on_error='record',
+                    with_failed=False):
+    """
+    Geocode every query in query_list with one geocoder.
+    Return the list of normalized geodata {'loc', 'box'}, in query order
+    (& the set of the queries that failed, if with_failed).
+    Parameters: see fetch_geodata().
+    """
+    if on_error not in ['record', 'raise']:
+        msg = "on_error must be 'record' or 'raise'. Given: {}"
+        raise ValueError(msg.format(on_error))
+
+    if g is None:
+        g = get_client(geocoder_to_use, tout=tout)
+
+    # the queries failed in this call (get_failed_queries(): in any call):
+    failed = set()
+
+    def forget_failure(q):
+        with _limiters_lock:
+            _failed.get(geocoder_to_use, {}).pop(q, None)
+
+    def fetch_one(q):
+        if cache is not None:
+            info_d = cache.get(geocoder_to_use, q)
+            if info_d is not None:
+                forget_failure(q)
+                return info_d
+
+        try:
+            location = geocode_resilient(g, geocoder_to_use, q, limiter=lim,
+                                         retry=retry)
+        except Exception as e:
+            if on_error == 'raise':
+                raise
+            record_failed_query(geocoder_to_use, q, e)
+            failed.add(q)
+            info_d = None
+            if cache is not None:
+                # an expired answer is better than none:
+                info_d = cache.get(geocoder_to_use, q, allow_expired=True)
+            return info_d if info_d is not None else OrderedDict()
+
+        forget_failure(q)
+        info_d = parse_location(geocoder_to_use, location)
+
+        if cache is not None and len(info_d):
+            cache.put(geocoder_to_use, q, location, info_d)
+        return info_d
+
+    # limits overrides the shared limits for this call only:
+    with rate_limits(geocoder_to_use, limits) as lim:
+        if not concurrent:
+            results = [fetch_one(q) for q in query_list]
+        else:
+            if max_workers is None:
+                max_workers = lim.in_flight or 4
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                # map() yields the results in query order:
+                results = list(pool.map(fetch_one, query_list))
+
+    if with_failed:
+        return results, failed
+    return results
+
+
+def fetch_geodata(geocoder_to_use, query_list, g=None, tout=5,
+                  concurrent=False, max_workers=None, limits=None,
+                  cache=None, retry=None, on_error='record',
+                  with_failed=False):
+    """
+    Geocode every query in query_list with one geocoder.
+
+    Parameters
+    ----------
+    :param: geocoder_to_use (str): one of gc4settings.geocs.
+    :param: query_list (list): a list of cities, places or counties.
+    :param: g (geopy geocoder), default=None: instance to use instead of
+            the shared client get_client(geocoder_to_use, tout).
+    :param: tout (int): request timeout in seconds.
+    :param: concurrent (bool), default=False: send the requests from a thread
+            pool, throttled by the geocoder's RateLimiter.
+    :param: max_workers (int), default=None: pool size; defaults to the
+            geocoder's 'in_flight' limit.
+    :param: limits (dict), default=None: {'rps': x, 'in_flight': n} to
+            override gc4settings.geocs_limits[geocoder_to_use].
+    :param: cache (gc4cache.GeoCache), default=None: if given, queries found
+            in the cache are not sent and new responses are stored.
+    :param: retry (dict), default=None: overrides gc4settings.RETRY_POLICY
+            (see geocode_resilient()).
+    :param: on_error (str), default='record': for a query that still fails
+            after its retries, or while the geocoder's circuit is open:
+            'record': its expired cached geodata if any, else an empty dict,
+            the query being recorded (see get_failed_queries());
+            'raise': the error is raised (the batch is lost).
+    :param: with_failed (bool), default=False: also return the set of the
+            queries that failed in this call.
+
+    Returns
+    -------
+    geodata (odict): same format & order as comparison.get_geodata().
+    failed (set): if with_failed.
+    """
+    results, failed = fetch_locations(geocoder_to_use, query_list, g=g,
+                                      tout=tout, concurrent=concurrent,
+                                      max_workers=max_workers, limits=limits,
+                                      cache=cache, retry=retry,
+                                      on_error=on_error, with_failed=True)
+
+    geodata = OrderedDict()
+    for q, info_d in zip(query_list, results):
+        geodata[get_place_name(q)] = info_d
+
+    if with_failed:
+        return geodata, failed
+    return geodata
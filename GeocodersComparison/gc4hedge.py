@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4hedge.py
+Hedged geocoding, for latency-critical lookups: the query goes to a
+preferred geocoder first; if it has not answered after a delay (a
+percentile of its past response times), a backup geocoder gets the query
+too, and the first acceptable answer (not empty) wins.
+
+Hedging trades consistency for latency: the geocoders do not agree on where
+a place is (see comparison.compare_geocoords()). Each answer is returned
+with the geocoder that gave it & the expected distance (km) of its location
+from the preferred geocoder's, i.e. their median disagreement over the
+places of the stored geodata; HedgedGeocoder.get_stats() tells how often
+the backups answered.
+
+Example:
+hg = HedgedGeocoder('GoogleV3', backups=['ArcGis'], percentile=95)
+res = hg.geocode('Boston, MA, USA')
+res.geocoder, res.expected_km, res.info_d['loc']
+"""
+__author__ = 'catchenal@gmail.com'
+
+import time
+import warnings
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4fetch
+
+
+TIMEOUT, FAILOVER = 'timeout', 'failover'
+
+HedgedResult = namedtuple('HedgedResult', ['query', 'place', 'geocoder',
+                                           'info_d', 'latency', 'hedged',
+                                           'backups', 'expected_km'])
+HedgedResult.__doc__ = """
+Answer of HedgedGeocoder.geocode(): the geocoder that answered (None if
+none did), its normalized geodata {'loc', 'box'} (empty if none), the
+latency (s), whether a backup was sent the query because the geocoders
+asked were too slow (hedged), the backups sent {geocoder: reason}, reason
+being TIMEOUT or FAILOVER (after the geocoders asked failed or found
+nothing), & the expected distance (km) from the preferred geocoder's
+location."""
+
+
+def get_disagreement_km(geocs=None, geo_dicts=None, places=None,
+                        method='exact'):
+    """
+    Return the historical disagreement between the geocoders: the symmetric
+    DataFrame (geocoders x geocoders) of the median distance (km) between
+    their locations, over the places geocoded by both, as in
+    comparison.compare_geocoords().
+    :param geo_dicts (list): geodata dicts or a gc4store.GeoStore; default:
+           the local geodata files.
+    """
+    import pandas as pd
+
+    from GeocodersComparison import comparison
+    from GeocodersComparison import gc4geodist
+    from GeocodersComparison import gc4store
+
+    if geocs is None:
+        geocs = gc4settings.geocs
+    if geo_dicts is None:
+        geo_dicts = gc4store.GeoStore.from_geo_files(geocs, places=places)
+    store = gc4store.as_geo_store(geocs, geo_dicts, places)
+
+    dist, _ = comparison.get_geodist_tensor(geocs, store, store.places,
+                                            method=method)
+    n = len(geocs)
+    med = np.zeros((n, n))
+    i, j = gc4geodist.get_pair_indices(n)
+    with warnings.catch_warnings():
+        # nan for the pairs without common places:
+        warnings.simplefilter('ignore', RuntimeWarning)
+        med[i, j] = np.nanmedian(dist[..., 0], axis=1)
+    med[j, i] = med[i, j]
+
+    df = pd.DataFrame(med, index=list(geocs), columns=list(geocs))
+    df.index.name = 'Median distance (km)'
+    return df
+
+
+class HedgedGeocoder():
+    """
+    Hedged geocoding of single queries; see the module docstring.
+
+    Parameters
+    ----------
+    :param preferred (str): the geocoder asked first.
+    :param backups (list): geocoders asked next, one more after each delay;
+           default: the other geocoders, closest to preferred first (see
+           get_disagreement_km()).
+    :param percentile (float): the delay before a backup is the percentile
+           of the preferred geocoder's past response times...
+    :param default_delay (float): ...or this delay (s) until min_samples
+           responses have been timed (the last `history` are kept).
+    :param disagreement (DataFrame): get_disagreement_km() output; default:
+           computed from the local geodata files.
+    :param tout (int): request timeout (s).
+    :param retry (dict): see gc4fetch.geocode_resilient(); default: no
+           retries (the backups are the retries).
+    :param cache (gc4cache.GeoCache): if given, a cached answer of the
+           preferred geocoder is returned at once & new answers are stored.
+    """
+
+    def __init__(self, preferred, backups=None, percentile=95.,
+                 default_delay=1., min_samples=20, history=200,
+                 disagreement=None, tout=5, retry=None, cache=None):
+        if disagreement is None:
+            disagreement = get_disagreement_km()
+        self.disagreement = disagreement
+
+        if backups is None:
+            others = disagreement.loc[preferred].drop(preferred)
+            backups = list(others.sort_values().index)
+        self.preferred = preferred
+        self.backups = list(backups)
+        self.geocs = [preferred] + self.backups
+
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.tout = tout
+        self.retry = retry if retry is not None else {'retries': 0}
+        self.cache = cache
+
+        self._lock = threading.Lock()
+        self._latencies = {geo: deque(maxlen=history) for geo in self.geocs}
+        self._answered = OrderedDict((geo, 0) for geo in self.geocs)
+        self._answered[None] = 0
+        self._n_hedged = 0
+        self._n_failover = 0
+        # the losing requests run to completion in the background:
+        self._pool = ThreadPoolExecutor(max_workers=2 * len(self.geocs))
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def get_delay(self):
+        """Return the current delay (s) before asking the next geocoder."""
+        with self._lock:
+            lat = list(self._latencies[self.preferred])
+        if len(lat) < self.min_samples:
+            return self.default_delay
+        return float(np.percentile(lat, self.percentile))
+
+    def expected_km(self, geocoder):
+        """Median distance (km) between geocoder's & preferred's answers."""
+        if geocoder is None:
+            return np.nan
+        if geocoder == self.preferred:
+            return 0.
+        return float(self.disagreement.loc[self.preferred, geocoder])
+
+    def _fetch(self, geocoder, q):
+        # in a worker thread; times the successful requests
+        g = gc4fetch.get_client(geocoder, tout=self.tout)
+        lim = gc4fetch.get_rate_limiter(geocoder)
+        t0 = time.monotonic()
+        location = gc4fetch.geocode_resilient(g, geocoder, q, limiter=lim,
+                                              retry=self.retry)
+        with self._lock:
+            self._latencies[geocoder].append(time.monotonic() - t0)
+        return location, gc4fetch.parse_location(geocoder, location)
+
+    def geocode(self, q):
+        """Return the HedgedResult of query q."""
+        place = gc4fetch.get_place_name(q)
+        t0 = time.monotonic()
+
+        if self.cache is not None:
+            info_d = self.cache.get(self.preferred, q)
+            if info_d is not None:
+                return HedgedResult(q, place, self.preferred, info_d,
+                                    time.monotonic() - t0, False,
+                                    OrderedDict(), 0.)
+
+        delay = self.get_delay()
+        waiting = list(self.geocs)
+        running = {}
+        backups = OrderedDict()
+        reason = None
+        answer = None
+
+        while answer is None and (waiting or running):
+            if waiting:
+                geo = waiting.pop(0)
+                running[self._pool.submit(self._fetch, geo, q)] = geo
+                if reason is not None:
+                    backups[geo] = reason
+            # next geocoder after the delay, or at once if all failed:
+            timeout = delay if waiting else None
+            finished, _ = wait(running, timeout=timeout,
+                               return_when=FIRST_COMPLETED)
+            reason = FAILOVER if finished else TIMEOUT
+            for fut in finished:
+                geo = running.pop(fut)
+                try:
+                    location, info_d = fut.result()
+                except Exception as e:
+                    gc4fetch.record_failed_query(geo, q, e)
+                    continue
+                if len(info_d) and answer is None:
+                    answer = (geo, location, info_d)
+
+        hedged = TIMEOUT in backups.values()
+        with self._lock:
+            self._n_hedged += hedged
+            self._n_failover += FAILOVER in backups.values()
+            self._answered[answer[0] if answer else None] += 1
+
+        if answer is None:
+            return HedgedResult(q, place, None, OrderedDict(),
+                                time.monotonic() - t0, hedged, backups,
+                                np.nan)
+
+        geo, location, info_d = answer
+        if self.cache is not None:
+            self.cache.put(geo, q, location, info_d)
+        return HedgedResult(q, place, geo, info_d, time.monotonic() - t0,
+                            hedged, backups, self.expected_km(geo))
+
+    def get_stats(self):
+        """
+        Return a DataFrame per geocoder (& None: no answer) of the number of
+        answers, the expected distance (km) from preferred & the median and
+        percentile response times; .attrs['hedged'] & .attrs['failover']:
+        fraction of the queries sent to a backup on timeout (the latency
+        hedges), & after a failure or not found.
+        """
+        import pandas as pd
+
+        rows = OrderedDict()
+        with self._lock:
+            for geo, n in self._answered.items():
+                lat = list(self._latencies.get(geo, []))
+                rows[geo] = OrderedDict([
+                    ('answers', n),
+                    ('expected_km', self.expected_km(geo)),
+                    ('median_s', np.median(lat) if lat else np.nan),
+                    ('p{:g}_s'.format(self.percentile),
+                     np.percentile(lat, self.percentile) if lat else np.nan)])
+            total = sum(self._answered.values())
+            hedged = self._n_hedged / total if total else np.nan
+            failover = self._n_failover / total if total else np.nan
+
+        df = pd.DataFrame.from_dict(rows, orient='index')
+        df.index.name = 'Hedged answers'
+        df.attrs['hedged'] = hedged
+        df.attrs['failover'] = failover
+        return df
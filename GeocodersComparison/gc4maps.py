@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4maps.py
+Boundary layers written once as shared, content-hashed assets & referenced
+by the map frames, instead of a copy of the GeoJSON inlined in each frame
+(see comparison.get_boro_maps(..., external_assets=True)).
+
+An asset is a small script defining the GeoJSON as a js variable:
+<out_dir>/assets/bounds_<hash>.js; a frame loads it with a <script> tag,
+which works when the frames are opened from disk (file://) as well as from
+a server. The hash is that of the content: frames showing the same
+boundaries share one file, and an asset is written only if it is new.
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import hashlib
+
+import folium
+from branca.element import JavascriptLink
+from jinja2 import Template
+
+
+ASSETS_DIR_NAME = 'assets'
+
+
+def write_geojson_asset(gdf, out_dir, name='bounds'):
+    """
+    Write gdf (as WGS-84 GeoJSON) as a content-hashed asset in
+    <out_dir>/assets, unless already there.
+    Return (src, var_name): the asset path relative to out_dir & the name of
+    the js variable holding the GeoJSON.
+    """
+    if gdf.crs is not None and gdf.crs != 'EPSG:4326':
+        gdf = gdf.to_crs('EPSG:4326')
+    text = gdf.to_json()
+
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+    var_name = 'gc4_geojson_' + digest
+    fname = '{}_{}.js'.format(name, digest)
+
+    path = os.path.join(out_dir, ASSETS_DIR_NAME, fname)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fw:
+            fw.write('var {} = {};\n'.format(var_name, text))
+        os.replace(tmp, path)
+
+    return ASSETS_DIR_NAME + '/' + fname, var_name
+
+
+class ExternalGeoJson(folium.map.Layer):
+    """
+    Map layer drawing the GeoJSON of an asset (see write_geojson_asset())
+    with one style for all the features.
+    :param bounds: [[lat_min, lon_min], [lat_max, lon_max]] of the data.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJson({{ this.var_name }}, {
+                style: function(feature) { return {{ this.style|tojson }}; }
+            }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, src, var_name, bounds, style=None, name=None,
+                 overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control,
+                         show=show)
+        self._name = 'ExternalGeoJson'
+        self.src = src
+        self.var_name = var_name
+        self.bounds = bounds
+        self.style = style or {}
+
+    def get_bounds(self):
+        return self.bounds
+
+    def render(self, **kwargs):
+        # one <script> tag per asset, in the frame's header:
+        self.get_root().header.add_child(JavascriptLink(self.src),
+                                         name=self.var_name)
+        super().render(**kwargs)
+
+
+def add_external_geojson(mapobj, gdf, out_dir, style=None, name=None,
+                         asset_name='bounds'):
+    """
+    Write gdf as an asset of the frames in out_dir (if new) & add the layer
+    showing it to mapobj; return the layer.
+    """
+    src, var_name = write_geojson_asset(gdf, out_dir, name=asset_name)
+
+    wgs = gdf if gdf.crs is None else gdf.to_crs('EPSG:4326')
+    lon_min, lat_min, lon_max, lat_max = wgs.total_bounds.tolist()
+
+    layer = ExternalGeoJson(src, var_name,
+                            [[lat_min, lon_min], [lat_max, lon_max]],
+                            style=style, name=name)
+    layer.add_to(mapobj)
+    return layer
+
+
+def get_asset_files(mapobj, out_dir):
+    """
+    Return the paths of the asset files (in out_dir) shown by the
+    ExternalGeoJson layers of mapobj.
+    """
+    return [os.path.join(out_dir, *child.src.split('/'))
+            for child in mapobj._children.values()
+            if isinstance(child, ExternalGeoJson)]
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4sched.py
+Batch scheduler for several geocoders at once: the queries of all the
+geocoders are sent from one shared thread pool, each geocoder paced by its
+own limits (gc4settings.geocs_limits: rps & in_flight, and
+gc4settings.geocs_daily_quotas), so that a slow or throttled geocoder never
+holds up the others: whichever geocoder can send next, does. The queries
+are sent through gc4fetch.geocode_resilient(): within the geocoder's shared
+RateLimiter (so that the schedulers & other fetches of the process together
+stay within its limits), with its retries & circuit breaker.
+
+The pacing adapts to the http 429 (Too Many Requests) answers: the
+geocoder's rate is halved & it pauses (Retry-After if known, else an
+exponential backoff), & the query is sent again; the rate then climbs back
+by steps to just below the rate that was throttled, and only slowly beyond,
+up to its limit. The rate never exceeds the configured rps (e.g.
+Nominatim's usage policy of 1 request per second). A geocoder answering 429
+too many times in a row, or out of daily quota (ours, or the service's: a
+quota error other than a 429), is stopped.
+
+The completion time of each geocoder's queue is estimated from its effective
+rate, min(rps, in_flight / mean latency), and shown with the progress.
+
+Example:
+sched = BatchScheduler()
+sched.add_all(query_lst)        # every geocoder
+sched.estimate()                # expected seconds to completion
+geodata = sched.run()           # {geocoder: odict as get_geodata()}
+sched.get_stats()
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import json
+import time
+import datetime
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4fetch
+
+
+class NotSentError(Exception):
+    """The query was not sent: its geocoder was stopped (see stopped)."""
+
+
+class QuotaLedger():
+    """
+    Number of requests sent to each geocoder today, kept in a json file
+    (default: gc4settings.QUOTA_FILE) so that the daily quotas hold across
+    runs.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or gc4settings.QUOTA_FILE
+        self._lock = threading.Lock()
+        self.usage = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as fr:
+                return json.load(fr)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def today():
+        return datetime.date.today().isoformat()
+
+    def used(self, geocoder):
+        """Return the number of requests sent to geocoder today."""
+        with self._lock:
+            entry = self.usage.get(geocoder, {})
+            return entry.get('used', 0) if entry.get('day') == self.today() \
+                else 0
+
+    def add(self, geocoder, n=1):
+        with self._lock:
+            day = self.today()
+            entry = self.usage.get(geocoder)
+            if entry is None or entry.get('day') != day:
+                entry = self.usage[geocoder] = {'day': day, 'used': 0}
+            entry['used'] += n
+
+    def save(self):
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as fw:
+                    json.dump(self.usage, fw)
+                os.replace(tmp, self.path)
+            except OSError:
+                # read-only install: no persistence
+                pass
+
+
+class ProviderQueue():
+    """
+    Queue & adaptive pacing of one geocoder's queries (used by
+    BatchScheduler, from its dispatching thread only).
+    :param rps (float): maximum requests per second; None: no limit.
+    :param in_flight (int): maximum requests sent at the same time.
+    :param quota_left (int): requests left today; None: no quota.
+    :param increase (float): rate increase after each success, as a fraction
+           of rps.
+    :param min_rate (float): lowest rate after 429s, as a fraction of rps.
+    :param max_backoff (float): longest pause (s) after 429s.
+    :param max_throttled (int): 429s in a row after which the geocoder is
+           stopped.
+    """
+
+    def __init__(self, geocoder, rps=None, in_flight=None, quota_left=None,
+                 increase=0.1, min_rate=0.05, max_backoff=60.,
+                 max_throttled=8):
+        self.geocoder = geocoder
+        self.max_rps = rps
+        self.rps = rps
+        self.ceiling = rps          # lowered by the 429s
+        self.in_flight = in_flight or 4
+        self.quota_left = quota_left
+        self.increase = increase
+        self.min_rate = min_rate
+        self.max_backoff = max_backoff
+        self.max_throttled = max_throttled
+
+        self.queue = deque()        # (query index, query)
+        self.running = 0
+        self.next_start = 0.
+        self.paused_until = 0.
+        self.throttled_streak = 0
+        self.stopped = None         # reason, when stopped
+        self.latency = None         # moving average (s)
+        self.t_start = None
+        self.counts = OrderedDict((k, 0) for k in ['sent', 'done', 'found',
+                                                   'throttled', 'errors'])
+
+    def __len__(self):
+        return len(self.queue)
+
+    def ready_at(self, now):
+        """Return when the next query can be sent; None if it cannot."""
+        if not self.queue or self.stopped or self.running >= self.in_flight:
+            return None
+        if self.quota_left is not None and self.quota_left <= 0:
+            self.stopped = 'daily quota'
+            return None
+        return max(now, self.next_start, self.paused_until)
+
+    def start(self, now):
+        """Pop the next query & book its send time."""
+        if self.t_start is None:
+            self.t_start = now
+        interval = 1. / self.rps if self.rps else 0.
+        self.next_start = max(now, self.next_start) + interval
+        self.running += 1
+        self.counts['sent'] += 1
+        if self.quota_left is not None:
+            self.quota_left -= 1
+        return self.queue.popleft()
+
+    def _answered(self):
+        # not throttled: the rate climbs back quickly to the ceiling, then
+        #  probes above it slowly, up to the limit
+        self.running -= 1
+        self.counts['done'] += 1
+        self.throttled_streak = 0
+        if self.max_rps:
+            step = self.increase * self.max_rps
+            if self.rps < self.ceiling:
+                self.rps = min(self.ceiling, self.rps + step)
+            else:
+                self.rps = self.ceiling = min(self.max_rps,
+                                              self.rps + step / 10)
+
+    def on_done(self, latency, found):
+        self._answered()
+        self.counts['found'] += bool(found)
+        self.latency = latency if self.latency is None \
+            else 0.8 * self.latency + 0.2 * latency
+
+    def on_throttled(self, item, now, retry_after=None):
+        """Slow down, pause & queue the query again."""
+        self.running -= 1
+        self.counts['throttled'] += 1
+        self.throttled_streak += 1
+        if self.quota_left is not None:
+            # not served, not counted
+            self.quota_left += 1
+
+        if self.rps is None:
+            # no limit set: start from half the rate observed
+            elapsed = now - self.t_start
+            self.rps = self.counts['sent'] / elapsed if elapsed > 0 else 1.
+            self.max_rps = self.rps
+        # the rate that was too high:
+        self.ceiling = max(0.9 * self.rps, self.min_rate * self.max_rps)
+        self.rps = max(self.rps / 2, self.min_rate * self.max_rps)
+
+        if retry_after is None:
+            retry_after = 2. ** (self.throttled_streak - 1)
+        self.paused_until = now + min(retry_after, self.max_backoff)
+
+        self.queue.appendleft(item)
+        if self.throttled_streak >= self.max_throttled:
+            self.stopped = 'throttled'
+
+    def on_error(self):
+        self._answered()
+        self.counts['errors'] += 1
+
+    def on_quota_exceeded(self, item):
+        """The service's quota is used up: queue the query again & stop."""
+        self.running -= 1
+        if self.quota_left is not None:
+            self.quota_left += 1
+        self.queue.appendleft(item)
+        self.stopped = 'quota exceeded'
+
+    def get_rate(self, latency=None):
+        """
+        Return the expected rate (queries/s): min(rps, in_flight / latency);
+        latency: default, the measured one.
+        """
+        if latency is None:
+            latency = self.latency
+        rates = [r for r in [self.rps,
+                             self.in_flight / latency if latency else None]
+                 if r]
+        return min(rates) if rates else None
+
+    def get_eta(self, now, latency=None):
+        """
+        Return the expected seconds to complete the queue (nan if unknown);
+        the queries beyond the daily quota are not counted.
+        """
+        n = len(self.queue)
+        if self.quota_left is not None:
+            n = min(n, self.quota_left)
+        if self.stopped or not (n or self.running):
+            return 0.
+        rate = self.get_rate(latency)
+        if rate is None:
+            return float('nan')
+        wait_s = max(0., self.paused_until - now)
+        return wait_s + (n + self.running) / rate
+
+
+class BatchScheduler():
+    """
+    Geocode batches of queries with several geocoders at once, each within
+    its limits; see the module docstring.
+
+    Parameters
+    ----------
+    :param geocs (list): geocoders that may be used; default: gc4settings.geocs.
+    :param limits (dict): {geocoder: {'rps': x, 'in_flight': n}} overriding
+           the limits of the geocoder's shared RateLimiter during run() (see
+           gc4fetch.rate_limits()); default: gc4settings.geocs_limits.
+    :param quotas (dict): {geocoder: requests per day} overriding
+           gc4settings.geocs_daily_quotas.
+    :param tout (int): request timeout in seconds.
+    :param retry (dict): see gc4fetch.geocode_resilient(); the 429s are not
+           retried there, but paced as above.
+    :param cache (gc4cache.GeoCache): if given, the queries found in the cache
+           are not sent & the new responses are stored.
+    :param ledger (QuotaLedger): requests count of the day; default: the one
+           of gc4settings.QUOTA_FILE.
+    :param show_info (bool): print the progress & expected completion time
+           every progress_every seconds.
+    :param queue_kw: passed to ProviderQueue, e.g. max_backoff=30.
+    """
+
+    def __init__(self, geocs=None, limits=None, quotas=None, tout=5,
+                 retry=None, cache=None, ledger=None, show_info=True,
+                 progress_every=10., **queue_kw):
+        if geocs is None:
+            geocs = gc4settings.geocs
+        quotas = dict(gc4settings.geocs_daily_quotas, **(quotas or {}))
+
+        self.tout = tout
+        self.retry = retry
+        self.cache = cache
+        self.ledger = ledger if ledger is not None else QuotaLedger()
+        self.show_info = show_info
+        self.progress_every = progress_every
+        self.limits = dict(limits or {})
+
+        self.limiters = OrderedDict()
+        self.providers = OrderedDict()
+        for geo in geocs:
+            quota = quotas.get(geo)
+            quota_left = None if quota is None \
+                else max(0, quota - self.ledger.used(geo))
+            lim = self.limiters[geo] = gc4fetch.get_rate_limiter(geo)
+            rps, in_flight = lim.rps, lim.in_flight
+            if geo in self.limits:
+                rps = self.limits[geo].get('rps')
+                in_flight = self.limits[geo].get('in_flight')
+            self.providers[geo] = ProviderQueue(geo, rps=rps,
+                                                in_flight=in_flight,
+                                                quota_left=quota_left,
+                                                **queue_kw)
+        self.queries = OrderedDict((geo, []) for geo in geocs)
+        self.results = OrderedDict((geo, []) for geo in geocs)
+        self.failed = OrderedDict((geo, []) for geo in geocs)
+
+    def add(self, geocoder, query_list):
+        """Queue the queries of one geocoder."""
+        pq = self.providers[geocoder]
+        queries, results = self.queries[geocoder], self.results[geocoder]
+
+        for q in query_list:
+            i = len(queries)
+            queries.append(q)
+            results.append(None)
+            if self.cache is not None:
+                info_d = self.cache.get(geocoder, q)
+                if info_d is not None:
+                    results[i] = info_d
+                    continue
+            pq.queue.append((i, q))
+
+    def add_all(self, query_list):
+        """Queue the queries for every geocoder."""
+        for geo in self.providers:
+            self.add(geo, query_list)
+
+    def estimate(self, latency=None):
+        """
+        Return the expected seconds to completion of each geocoder's queue
+        & of the batch ('Total'), as an OrderedDict.
+        :param latency (float): expected response time (s); default: the
+               measured one, else the time given by the rps limits only.
+        """
+        now = time.monotonic()
+        eta = OrderedDict((geo, pq.get_eta(now, latency))
+                          for geo, pq in self.providers.items())
+        known = [v for v in eta.values() if v == v]
+        eta['Total'] = max(known) if len(known) == len(eta) \
+            else float('nan')
+        return eta
+
+    def _fetch(self, geocoder, q):
+        # in a worker thread: no scheduler state is changed here
+        from geopy.exc import GeocoderQuotaExceeded
+
+        g = gc4fetch.get_client(geocoder, tout=self.tout)
+        lim = self.limiters[geocoder]
+        t0 = time.monotonic()
+        try:
+            location = gc4fetch.geocode_resilient(g, geocoder, q, limiter=lim,
+                                                  retry=self.retry,
+                                                  retry_throttled=False)
+        except GeocoderQuotaExceeded as e:
+            if gc4fetch.is_rate_limited(e):
+                # http 429 (geopy >= 2: GeocoderRateLimited, with retry_after)
+                return 'throttled', getattr(e, 'retry_after', None), \
+                    time.monotonic() - t0
+            return 'quota', e, time.monotonic() - t0
+        except Exception as e:
+            # incl. gc4fetch.CircuitOpenError: fails fast
+            return 'error', e, time.monotonic() - t0
+
+        info_d = gc4fetch.parse_location(geocoder, location)
+        return 'ok', (location, info_d), time.monotonic() - t0
+
+    def _on_result(self, geocoder, item, result, now):
+        pq = self.providers[geocoder]
+        status, value, latency = result
+        i, q = item
+
+        if status == 'throttled':
+            pq.on_throttled(item, now, retry_after=value)
+            return
+        if status == 'quota':
+            pq.on_quota_exceeded(item)
+            return
+
+        self.ledger.add(geocoder)
+        if status == 'error':
+            pq.on_error()
+            self.results[geocoder][i] = OrderedDict()
+            self._record_failed(geocoder, q, value)
+            return
+
+        location, info_d = value
+        pq.on_done(latency, len(info_d))
+        self.results[geocoder][i] = info_d
+        if self.cache is not None and len(info_d):
+            self.cache.put(geocoder, q, location, info_d)
+
+    def _record_failed(self, geocoder, q, error):
+        self.failed[geocoder].append((q, repr(error)))
+        gc4fetch.record_failed_query(geocoder, q, error)
+
+    def _show_progress(self):
+        eta = self.estimate()
+        parts = []
+        for geo, pq in self.providers.items():
+            n = len(self.queries[geo])
+            if not n:
+                continue
+            done = n - len(pq) - pq.running
+            part = '{}: {}/{}'.format(geo, done, n)
+            if pq.stopped:
+                part += ' (stopped: {})'.format(pq.stopped)
+            elif pq.rps:
+                part += ' ({:.1f}/s)'.format(pq.get_rate() or pq.rps)
+            parts.append(part)
+        print(' | '.join(parts) + '; ETA (s): {:.0f}'.format(eta['Total']))
+
+    def run(self, max_workers=None):
+        """
+        Send all the queued queries; return {geocoder: geodata} where
+        geodata is an odict {place: {'loc', 'box'}} as get_geodata()'s
+        (empty dict for a query not found, failed or not sent). The failed
+        queries & those of a stopped geocoder (NotSentError), which are not
+        "not found", are listed in self.failed {geocoder: [(query, error)]}
+        & recorded (see gc4fetch.get_failed_queries()).
+        :param max_workers (int): thread pool size; default: the sum of the
+               geocoders in_flight limits.
+        """
+        if max_workers is None:
+            max_workers = sum(pq.in_flight for pq in self.providers.values()
+                              if len(pq))
+        t0 = time.monotonic()
+
+        with contextlib.ExitStack() as stack:
+            # the limits given are those of the shared limiters until done:
+            for geo, geo_limits in self.limits.items():
+                if geo in self.limiters:
+                    stack.enter_context(gc4fetch.rate_limits(geo, geo_limits))
+            self._run(max_workers)
+
+        # a stopped geocoder's queries left: failed, not "not found"
+        for geo, pq in self.providers.items():
+            for i, q in pq.queue:
+                self._record_failed(geo, q, NotSentError(pq.stopped))
+
+        self.ledger.save()
+        self.wall_time = time.monotonic() - t0
+        if self.show_info:
+            self._show_progress()
+            print('Wall time (s): {:.2f}'.format(self.wall_time))
+
+        geodata = OrderedDict()
+        for geo, queries in self.queries.items():
+            if not queries:
+                continue
+            geodata[geo] = OrderedDict()
+            for q, info_d in zip(queries, self.results[geo]):
+                geodata[geo][gc4fetch.get_place_name(q)] = \
+                    info_d if info_d is not None else OrderedDict()
+        return geodata
+
+    def _run(self, max_workers):
+        last_shown = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            running = {}
+            while True:
+                now = time.monotonic()
+                # send whatever can be sent now, geocoders in turn:
+                next_at = None
+                sent = True
+                while sent:
+                    sent = False
+                    for geo, pq in self.providers.items():
+                        at = pq.ready_at(now)
+                        if at is None:
+                            continue
+                        if at <= now and len(running) < max_workers:
+                            item = pq.start(now)
+                            fut = pool.submit(self._fetch, geo, item[1])
+                            running[fut] = (geo, item)
+                            sent = True
+                        elif next_at is None or at < next_at:
+                            next_at = at
+
+                if not running and next_at is None:
+                    break
+
+                timeout = None if next_at is None else max(0., next_at - now)
+                if not running:
+                    # nothing to wait for but the next send time:
+                    time.sleep(timeout)
+                    continue
+                finished, _ = wait(running, timeout=timeout,
+                                   return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for fut in finished:
+                    geo, item = running.pop(fut)
+                    self._on_result(geo, item, fut.result(), now)
+
+                if self.show_info and now - last_shown >= self.progress_every:
+                    self._show_progress()
+                    last_shown = now
+
+    def get_stats(self):
+        """
+        Return a DataFrame of the counts of each geocoder (sent, done, found,
+        throttled, errors, not sent), its current rate & mean latency.
+        """
+        import pandas as pd
+
+        rows = OrderedDict()
+        for geo, pq in self.providers.items():
+            row = OrderedDict(pq.counts)
+            row['not sent'] = len(pq)
+            row['rps'] = pq.rps
+            row['latency'] = pq.latency
+            row['stopped'] = pq.stopped
+            rows[geo] = row
+        df = pd.DataFrame.from_dict(rows, orient='index')
+        df.index.name = 'Scheduler stats'
+        return df
+
+
+def schedule_geodata(query_list, geocs=None, **kw):
+    """
+    Geocode query_list with every geocoder of geocs at once with a
+    BatchScheduler (kw: its parameters); return the list of geodata dicts in
+    geocs order, as comparison.get_geo_dicts().
+    """
+    sched = BatchScheduler(geocs=geocs, **kw)
+    sched.add_all(query_list)
+    if sched.show_info:
+        eta = sched.estimate()
+        print('Expected completion (s): ' +
+              ', '.join('{}: {:.1f}'.format(k, v) for k, v in eta.items()))
+    geodata = sched.run()
+    return [geodata[geo] for geo in sched.providers]
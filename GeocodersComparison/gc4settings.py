@@ -6,7 +6,7 @@
 __author__ = 'catchenal@gmail.com'
 
 import os
-from dotenv import load_dotenv, find_dotenv
+import functools
 
 
 # globals, paths:
@@ -54,31 +54,115 @@ query_lst = ["New York City, NY, USA",
 geocs = ['Nominatim', 'GoogleV3', 'ArcGis', 'AzureMaps']
 colors_dict = dict(zip(geocs, ['red', 'green', 'darkblue', 'cyan']))
 
+# globals, request limits for each geocoder:
+#  rps: requests per second; in_flight: requests sent at the same time.
+#  Nominatim's usage policy: an absolute maximum of 1 request per second.
+geocs_limits = {'Nominatim': {'rps': 1, 'in_flight': 1},
+                'GoogleV3': {'rps': 25, 'in_flight': 10},
+                'ArcGis': {'rps': 10, 'in_flight': 8},
+                'AzureMaps': {'rps': 5, 'in_flight': 5}}
+
+# globals, daily request quota of each geocoder (see gc4sched.py), to set as
+#  per your plan; None: no quota. The requests of the day are counted in
+#  QUOTA_FILE.
+geocs_daily_quotas = {'Nominatim': None,
+                      'GoogleV3': 2500,
+                      'ArcGis': None,
+                      'AzureMaps': 5000}
+QUOTA_FILE = os.path.join(DIR_GEO, '.quota_usage.json')
+
+# globals, geocoders domain (host[:port]) & scheme overrides, e.g. to use a
+#  local stand-in server (see gc4stub.py); empty/None: geopy defaults.
+geocs_domains = {}
+GEOCODERS_SCHEME = None
+
+# globals, keep-alive connections per host in the shared http session:
+HTTP_POOL_SIZE = 16
+
+# globals, retries of the failed requests (timeouts, server errors, 429, see
+#  gc4fetch.geocode_resilient()): before retry k (from 0), a random wait in
+#  [0, min(max_delay, base_delay * 2**k)] seconds (full jitter).
+RETRY_POLICY = {'retries': 3, 'base_delay': 0.5, 'max_delay': 8.}
+
+# globals, per-geocoder circuit breaker (see gc4fetch.CircuitBreaker): after
+#  `failures` failed requests in a row, the requests fail fast for
+#  reset_after seconds.
+CIRCUIT_BREAKER = {'failures': 5, 'reset_after': 30.}
+
+# globals, geocoding responses cache (see gc4cache.py):
+CACHE_DB = os.path.join(DIR_GEO, 'geocache.sqlite')
+CACHE_TTL = 30 * 24 * 3600     # seconds
+CACHE_MAX_ENTRIES = 500000
+
+# globals, report build manifest (see gc4build.py):
+BUILD_MANIFEST = os.path.join(DIR_GEO, '.build_manifest.json')
+
+
+@functools.lru_cache(maxsize=None)
+def find_env_file(start_dir=BASE_DIR):
+    """
+    Return the path of the first '.env' file found walking up from
+    start_dir (as dotenv.find_dotenv() does from this module), else ''.
+    Cached: the directories are walked once per process.
+    """
+    d = os.path.abspath(start_dir)
+    while True:
+        path = os.path.join(d, '.env')
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(d)
+        if parent == d:
+            return ''
+        d = parent
+
+
+_env_loaded = False
+
 
 def load_env():
     """
-    Find .env automacically by walking up directories until it's found
+    Find .env automacically by walking up directories until it's found,
+    and load its entries as environment variables (once).
     """
-    d_env_path = find_dotenv()
+    global _env_loaded
+
+    d_env_path = find_env_file()
     
-    if (d_env_path is None) or (len(d_env_path)== 0):
-        msg = "Local '.env' file not found.\n \
+    if not d_env_path:
+        if not _env_loaded:
+            msg = "Local '.env' file not found.\n \
         The Socrata credential variables are set to None, which may not be accepted.\n \
         If that's the case, create the file with the credentials as KEY=value on each line.\n \
         Google Maps/Places is also loaded (temp)."
-        print(msg)
+            print(msg)
+        _env_loaded = True
         return None
-    else:
+    elif not _env_loaded:
+        from dotenv import load_dotenv
+
         # load up the entries as environment variables
         load_dotenv(dotenv_path=d_env_path, verbose=True)
-        
-
-# globals, account keys:
-local_data_found = load_env()
-
-GOOGLE_KEY = os.getenv("GOO_GEO_API_1")
-AZURE_KEY = os.getenv("AZ_KEY_1")
-W3W_dict = {w:os.getenv(w) for w in ['W3W_USER','W3W_PWD','W3W_NAME','W3W_API']}
+        _env_loaded = True
+    return d_env_path
+
+
+# globals, account keys: read from the environment (after loading .env) on
+# first access, e.g. gc4settings.GOOGLE_KEY, not on import.
+_env_keys = {'GOOGLE_KEY': lambda: os.getenv("GOO_GEO_API_1"),
+             'AZURE_KEY': lambda: os.getenv("AZ_KEY_1"),
+             'W3W_dict': lambda: {w: os.getenv(w) for w in ['W3W_USER',
+                                                             'W3W_PWD',
+                                                             'W3W_NAME',
+                                                             'W3W_API']},
+             'local_data_found': lambda: load_env()}
+
+
+def __getattr__(name):
+    if name in _env_keys:
+        load_env()
+        return _env_keys[name]()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                     name))
 
 
 def copy_nb_css():
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4shapes.py
+Shapefile layers, loaded on first use & cached in a binary format.
+
+Nothing is read on import. A shapefile parsed once is saved by
+read_shapefile() in SHP_CACHE_DIR: GeoParquet if pyarrow is installed, else
+the geometries as WKB with the attribute table (pickle); a new process
+(e.g. a worker) then loads it several times faster than parsing it with
+GDAL. The cache file name holds the shapefile's mtime: when the shapefile
+changes, the cache is rebuilt.
+
+For the maps, get_layer(name, zoom) returns the layer simplified for that
+zoom (topology-preserving simplification, to half a screen pixel, in WGS-84):
+a fraction of the vertices, with no visible change at that zoom. The
+simplified levels are cached as the full layers are.
+
+Example:
+gdf = get_layer('nyc_counties')     # parsed once, then cached
+gdf = get_layer('boston', zoom=11)  # ~1600 of 57000 vertices
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import glob
+import pickle
+import threading
+
+from GeocodersComparison import gc4settings
+
+
+SHP_CACHE_DIR = os.path.join(gc4settings.DIR_SHP, '_cache')
+
+# layer name: (shapefile in DIR_SHP, post-processing function name or None)
+shape_layers = {'nyc_counties': ('nybbwi.shp', None),
+                'boston': ('Boston.shp', 'format_boston')}
+
+# Zoom levels of the simplified layers: a map at zoom z uses the first level
+#  >= z; above the last level, the full resolution layer:
+simplify_zooms = [6, 8, 10, 12, 14, 16]
+# Simplification tolerance, in screen pixels at the level's zoom:
+SIMPLIFY_PX = 0.5
+# Web mercator (EPSG:3857) meters per pixel at zoom 0:
+MERCATOR_M_PER_PX = 156543.03392804097
+# Coordinates precision of the simplified layers (degrees, ~0.1 m):
+COORDS_PRECISION = 1e-6
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_source_files(shp_path):
+    """
+    Return the shapefile's component files (.shp, .dbf, .prj...), without
+    the metadata documents.
+    """
+    stem = os.path.splitext(shp_path)[0]
+    parts = glob.glob(glob.escape(stem) + '.*')
+    return sorted(f for f in parts
+                  if not f.endswith('.xml') and not f.endswith('.pdf'))
+
+
+def get_source_mtime(shp_path):
+    """Return the latest mtime (ns) of the shapefile's component files."""
+    return max([os.stat(f).st_mtime_ns for f in get_source_files(shp_path)] or
+               [os.stat(shp_path).st_mtime_ns])
+
+
+def get_layer_files(name):
+    """Return the source files of one of shape_layers."""
+    shp_file = shape_layers[name][0]
+    return get_source_files(os.path.join(gc4settings.DIR_SHP, shp_file))
+
+
+def get_cache_path(shp_path, cache_dir=None, suffix=''):
+    """
+    Return the cache file path of the current version of shp_path.
+    :param suffix (str): variant of the layer, e.g. get_simplified_suffix(10).
+    """
+    if cache_dir is None:
+        cache_dir = SHP_CACHE_DIR
+    stem = os.path.splitext(os.path.basename(shp_path))[0]
+    ext = '.parquet' if _has_pyarrow() else '.wkb.pkl'
+    return os.path.join(cache_dir, '{}.{}{}{}'.format(
+                            stem, get_source_mtime(shp_path), suffix, ext))
+
+
+def _write_cache(gdf, cache_path):
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # drop the versions of other mtimes:
+    stem, mtime = os.path.basename(cache_path).split('.')[:2]
+    for f in glob.glob(os.path.join(glob.escape(cache_dir), stem + '.*')):
+        if os.path.basename(f).split('.')[1] != mtime:
+            os.remove(f)
+
+    tmp = cache_path + '.tmp'
+    if cache_path.endswith('.parquet'):
+        gdf.to_parquet(tmp)
+    else:
+        import shapely
+        import pandas as pd
+
+        geom_col = gdf.geometry.name
+        data = {'crs': gdf.crs.to_wkt() if gdf.crs is not None else None,
+                'geom_col': geom_col,
+                # plain DataFrame: the dtypes are kept
+                'attrs': pd.DataFrame(gdf.drop(columns=geom_col)),
+                'columns': list(gdf.columns),
+                'wkb': shapely.to_wkb(gdf.geometry.values)}
+        with open(tmp, 'wb') as fw:
+            pickle.dump(data, fw, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache_path)
+
+
+def _read_cache(cache_path):
+    import geopandas as gpd
+
+    if cache_path.endswith('.parquet'):
+        return gpd.read_parquet(cache_path)
+
+    import shapely
+
+    with open(cache_path, 'rb') as fr:
+        data = pickle.load(fr)
+
+    gdf = gpd.GeoDataFrame(data['attrs'],
+                           geometry=shapely.from_wkb(data['wkb']),
+                           crs=data['crs'])
+    if data['geom_col'] != gdf.geometry.name:
+        gdf = gdf.rename_geometry(data['geom_col'])
+    return gdf[data['columns']]
+
+
+def _cached(cache_path, build):
+    # the cached geodataframe if readable, else build() (& cache it)
+    if os.path.exists(cache_path):
+        try:
+            return _read_cache(cache_path)
+        except Exception:
+            # unreadable (partial, other library version): rebuilt below
+            pass
+
+    gdf = build()
+    try:
+        _write_cache(gdf, cache_path)
+    except OSError:
+        # read-only install: no cache
+        pass
+    return gdf
+
+
+def read_shapefile(shp_path, use_cache=True, cache_dir=None):
+    """
+    Return the geodataframe of shp_path, from the binary cache if it is up
+    to date, else parsed from the shapefile (& cached, if use_cache).
+    """
+    import geopandas as gpd
+
+    if not use_cache:
+        return gpd.read_file(shp_path)
+
+    return _cached(get_cache_path(shp_path, cache_dir=cache_dir),
+                   lambda: gpd.read_file(shp_path))
+
+
+def get_simplify_zoom(zoom):
+    """
+    Return the simplified level (a zoom of simplify_zooms) to use for a map
+    at zoom, or None for the full resolution.
+    """
+    if zoom is None:
+        return None
+    for z in simplify_zooms:
+        if z >= zoom:
+            return z
+    return None
+
+
+def simplify_layer(gdf, zoom):
+    """
+    Return gdf in WGS-84, simplified for a map at zoom: topology-preserving
+    simplification in web mercator with a tolerance of SIMPLIFY_PX pixels,
+    coordinates rounded to COORDS_PRECISION.
+    Each geometry remains valid; the borders shared by two polygons are
+    simplified separately, with differences below the tolerance.
+    """
+    import shapely
+
+    tol = SIMPLIFY_PX * MERCATOR_M_PER_PX / 2 ** zoom
+
+    merc = gdf.to_crs('EPSG:3857')
+    merc = merc.set_geometry(merc.geometry.simplify(tol,
+                                                    preserve_topology=True))
+    out = merc.to_crs('EPSG:4326')
+    return out.set_geometry(shapely.set_precision(out.geometry.values,
+                                                  COORDS_PRECISION))
+
+
+def get_simplified_suffix(zoom):
+    """
+    Return the cache suffix of the layers simplified for zoom, e.g.
+    '.z10_px0.5_p1e-06': the level & the simplification parameters, so that
+    a change of SIMPLIFY_PX or COORDS_PRECISION invalidates the cache.
+    """
+    return '.z{}_px{:g}_p{:g}'.format(zoom, SIMPLIFY_PX, COORDS_PRECISION)
+
+
+def format_boston(gdf):
+    """
+    To obtain a geo dataframe from shapefile with same format as NYC.
+    # Boston: https://data.boston.gov/dataset/city-of-boston-boundary
+    """
+    gdf = gdf.drop(['OBJECTID', 'BOSTON_LAN'], axis=1)
+    gdf = gdf.rename(columns={'CITY': 'BoroCode',
+                              'COUNTY': 'BoroName',
+                              'SHAPEarea': 'Shape_Area',
+                              'SHAPElen': 'Shape_Leng'})
+    gdf['BoroCode'] = 1
+    gdf['BoroName'] = 'Boston'
+
+    return gdf
+
+
+# Layers loaded in this process, by (name, simplified level):
+_layers = {}
+_layers_lock = threading.RLock()
+
+
+def get_layer(name, zoom=None):
+    """
+    Return the geodataframe of one of shape_layers, loaded on first call
+    (see read_shapefile()), then shared.
+    :param zoom (int): if given, the layer simplified for a map at that zoom
+           (see get_simplify_zoom() & simplify_layer()).
+    """
+    level = get_simplify_zoom(zoom)
+
+    with _layers_lock:
+        if (name, level) not in _layers:
+            shp_file, post = shape_layers[name]
+            shp_path = os.path.join(gc4settings.DIR_SHP, shp_file)
+
+            if level is None:
+                gdf = read_shapefile(shp_path)
+                if post is not None:
+                    gdf = globals()[post](gdf)
+            else:
+                cache_path = get_cache_path(
+                    shp_path, suffix=get_simplified_suffix(level))
+                gdf = _cached(cache_path,
+                              lambda: simplify_layer(get_layer(name), level))
+            _layers[(name, level)] = gdf
+        return _layers[(name, level)]
+
+
+def build_simplified_layers(names=None):
+    """Precompute (& cache) all the simplified levels of the layers."""
+    for name in names or shape_layers:
+        for z in simplify_zooms:
+            get_layer(name, zoom=z)
+
+
+def clear_layers():
+    """Forget the loaded layers (the cache files are kept)."""
+    with _layers_lock:
+        _layers.clear()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4snaps.py
+Geodata snapshots over time: the geodata files saved with a prefix (e.g.
+sep2018_geodata_Nom.json) & the current ones, in one float64 array indexed
+by (snapshot, geocoder, place, field), as gc4store.GeoStore for one snapshot.
+
+The drift of each geocoder's location & box corners between snapshots is
+computed for all the snapshots, geocoders & places in one pass (gc4geodist);
+the changes above a threshold tell which places need their frames
+regenerated.
+
+Example:
+snaps = SnapshotStore.from_geo_files()   # all the snapshots in DIR_GEO
+snaps.snapshots                          # -> ['sep2018', 'current']
+snaps.changes(threshold_km=0.1)
+comparison.render_boro_maps(df_dict, places=snaps.changed_places())
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import re
+import glob
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4geodist
+from GeocodersComparison import gc4store
+
+
+CURRENT = 'current'
+
+drift_geoms = ['Location', 'NE', 'SW']
+
+# snapshot prefix date formats, e.g. sep2018, 2019-05-24:
+_date_formats = ['%b%Y', '%Y-%m-%d', '%Y%m%d', '%Y%m', '%b_%Y']
+
+
+def get_snapshot_date(prefix, geocs=None):
+    """
+    Return the date of a snapshot: from its prefix if it is a date (e.g.
+    'sep2018'), else the latest mtime of its geodata files.
+    """
+    label = prefix.rstrip('_')
+    for frmt in _date_formats:
+        try:
+            return datetime.datetime.strptime(label, frmt)
+        except ValueError:
+            pass
+
+    if geocs is None:
+        geocs = gc4settings.geocs
+    files = [os.path.join(gc4settings.DIR_GEO,
+                          prefix + 'geodata_' + g[:3] + '.json')
+             for g in geocs]
+    mtimes = [os.stat(f).st_mtime for f in files if os.path.exists(f)]
+    return datetime.datetime.fromtimestamp(max(mtimes or [0]))
+
+
+def get_snapshot_prefixes(geocs=None, geo_dir=None):
+    """
+    Return the prefixes of the geodata files of geocs in geo_dir (default:
+    DIR_GEO), in date order (see get_snapshot_date()); '' for the current
+    files. A prefix is listed if any geocoder has a file with it.
+    """
+    if geocs is None:
+        geocs = gc4settings.geocs
+    if geo_dir is None:
+        geo_dir = gc4settings.DIR_GEO
+
+    suffixes = tuple('geodata_' + g[:3] + '.json' for g in geocs)
+    prefixes = set()
+    for f in glob.glob(os.path.join(glob.escape(geo_dir), '*geodata_*.json')):
+        name = os.path.basename(f)
+        if name.endswith(suffixes):
+            prefixes.add(name[:name.rindex('geodata_')])
+
+    return sorted(prefixes, key=lambda p: (get_snapshot_date(p, geocs), p))
+
+
+class SnapshotStore():
+    """
+    Geocoding data of several snapshots in a float64 array of shape
+    (snapshots, geocoders, places, 6), the fields being gc4store.geo_fields;
+    nan where a snapshot has no data for a geocoder & place.
+
+    Attributes
+    ----------
+    data (numpy.ndarray): the (snapshots, geocoders, places, 6) array.
+    snapshots (list): snapshot names, oldest first: the file prefix without
+              its trailing '_', or CURRENT for the files without prefix.
+    dates (list): datetime of each snapshot.
+    geocs, places (list): names along the next two axes.
+
+    Example:
+    snaps = SnapshotStore.from_geo_files(['sep2018_', ''])
+    snaps['sep2018']    # -> GeoStore
+    """
+
+    def __init__(self, data, snapshots, geocs, places, dates=None):
+        data = np.asarray(data, dtype=np.float64)
+        shape = (len(snapshots), len(geocs), len(places),
+                 len(gc4store.geo_fields))
+        if data.shape != shape:
+            msg = 'Expected data of shape {}, given: {}'
+            raise ValueError(msg.format(shape, data.shape))
+        self.data = data
+        self.snapshots = list(snapshots)
+        self.dates = list(dates) if dates is not None else [None] * len(data)
+        self.geocs = list(geocs)
+        self.places = list(places)
+        self.snapshots_idx = {s: i for i, s in enumerate(self.snapshots)}
+
+    def __repr__(self):
+        return 'SnapshotStore({} snapshots x {} geocoders x {} places)'.format(
+                   len(self.snapshots), len(self.geocs), len(self.places))
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __getitem__(self, snapshot):
+        """The GeoStore of a snapshot (name or index)."""
+        i = self._index(snapshot)
+        return gc4store.GeoStore(self.data[i], self.geocs, self.places)
+
+    def _index(self, snapshot):
+        if isinstance(snapshot, str):
+            return self.snapshots_idx[snapshot]
+        return range(len(self.snapshots))[snapshot]
+
+    @property
+    def coords(self):
+        """View of shape (snapshots, geocoders, places, 3, 2)."""
+        return self.data.reshape(self.data.shape[:3] + (3, 2))
+
+    @property
+    def found(self):
+        """Bool array (snapshots, geocoders, places): True where data."""
+        return ~np.isnan(self.data).any(axis=3)
+
+    @classmethod
+    def from_geo_stores(cls, stores, snapshots, dates=None):
+        """
+        Stack the GeoStores of the same geocoders (one per snapshot); the
+        places are the union of the stores places, in order of appearance.
+        """
+        geocs = stores[0].geocs
+        if any(s.geocs != geocs for s in stores):
+            raise ValueError('The snapshots must have the same geocoders.')
+        places = list(OrderedDict.fromkeys(p for s in stores
+                                           for p in s.places))
+
+        data = np.full((len(stores), len(geocs), len(places),
+                        len(gc4store.geo_fields)), np.nan)
+        for i, s in enumerate(stores):
+            pj = [places.index(p) for p in s.places]
+            data[i][:, pj] = s.data
+
+        return cls(data, snapshots, geocs, places, dates=dates)
+
+    @classmethod
+    def from_geo_files(cls, prefixes=None, geocs=None, places=None):
+        """
+        Load the geodata files of each snapshot prefix (default: all, see
+        get_snapshot_prefixes()); '' for the current files.
+        """
+        if geocs is None:
+            geocs = gc4settings.geocs
+        if prefixes is None:
+            prefixes = get_snapshot_prefixes(geocs)
+        prefixes = [p + '_' if p and p[-1] != '_' else p for p in prefixes]
+
+        stores = [gc4store.GeoStore.from_geo_files(geocs, alt_prefix=p,
+                                                   places=places)
+                  for p in prefixes]
+        names = [p.rstrip('_') or CURRENT for p in prefixes]
+        dates = [get_snapshot_date(p, geocs) for p in prefixes]
+
+        return cls.from_geo_stores(stores, names, dates=dates)
+
+    def _get_bases(self, base):
+        # (snapshot indices, base indices) of the comparisons
+        n = len(self.snapshots)
+        if base == 'previous':
+            return np.arange(1, n), np.arange(n - 1)
+        b = self._index(base)
+        idx = np.array([i for i in range(n) if i != b], dtype=np.int64)
+        return idx, np.full(len(idx), b)
+
+    def drift_km(self, base='previous', method='exact'):
+        """
+        Return (drift, labels): drift is the array (comparisons, geocoders,
+        places, 3) of the geodesic distances (km) of the location, NE & SW
+        corners between each snapshot & its base; inf where a place is found
+        in one snapshot only, nan where in neither.
+        :param base: 'previous' (each snapshot vs the one before), or a
+               snapshot (name or index): every other one vs it.
+        :param method (str): 'exact' or 'haversine', see gc4geodist.
+        """
+        idx, bases = self._get_bases(base)
+        coords = self.coords
+
+        drift = gc4geodist.distance_km(coords[idx], coords[bases],
+                                       method=method)
+        found = self.found
+        appeared = found[idx] != found[bases]
+        drift[appeared] = np.inf
+
+        labels = ['{} v. {}'.format(self.snapshots[i], self.snapshots[b])
+                  for i, b in zip(idx, bases)]
+        return drift, labels
+
+    def drift(self, base='previous', method='exact'):
+        """
+        Return the drift_km() DataFrame: index (snapshots, place, geocoder)
+        where snapshots is '<snapshot> v. <base>'; columns: drift_geoms & Max.
+        """
+        drift, labels = self.drift_km(base=base, method=method)
+        # (comparisons, places, geocoders, 3) rows:
+        out = drift.transpose(0, 2, 1, 3).reshape(-1, len(drift_geoms))
+
+        idx = pd.MultiIndex.from_product([labels, self.places, self.geocs],
+                                         names=['snapshots', 'place',
+                                                'geocoder'])
+        df = pd.DataFrame(out, index=idx, columns=drift_geoms)
+        df['Max'] = df[drift_geoms].max(axis=1)
+        df.columns.name = 'Drift (km)'
+
+        return df
+
+    def changes(self, threshold_km=0.1, base='previous', method='exact'):
+        """Return the rows of drift() with a Max above threshold_km."""
+        df = self.drift(base=base, method=method)
+        return df[df['Max'] > threshold_km]
+
+    def changed_places(self, threshold_km=0.1, snapshot=-1, base='previous',
+                       method='exact'):
+        """
+        Return the places (in places order) of which any geocoder's location
+        or corner moved by more than threshold_km in snapshot (default: the
+        latest) w.r.t. its base.
+        """
+        drift, _ = self.drift_km(base=base, method=method)
+        idx, _ = self._get_bases(base)
+        k = np.flatnonzero(idx == self._index(snapshot))
+        if not len(k):
+            return []
+
+        with np.errstate(invalid='ignore'):
+            moved = (drift[k[0]] > threshold_km).any(axis=(0, 2))
+        return [p for p, m in zip(self.places, moved) if m]
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4store.py
+Columnar store of the geocoding data: one float64 array indexed by
+(geocoder, place, field), instead of a list of nested dicts.
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4utils
+
+
+geo_fields = ['lat', 'lon', 'NE_lat', 'NE_lon', 'SW_lat', 'SW_lon']
+
+
+class GeoStore():
+    """
+    Geocoding data of several geocoders for several places in a float64
+    array of shape (geocoders, places, 6), the fields being geo_fields;
+    nan where a geocoder has no data for a place.
+
+    Attributes
+    ----------
+    data (numpy.ndarray): the (geocoders, places, 6) array.
+    geocs, places (list): names along the first two axes.
+    geocs_idx, places_idx (dict): name -> index lookup tables.
+
+    Example:
+    store = GeoStore.from_geo_dicts(geocs, geo_dicts)
+    store.coords[store.geocs_idx['ArcGis'], store.places_idx['Boston']]
+    # -> [[lat, lon], [NE lat, lon], [SW lat, lon]]
+    """
+
+    def __init__(self, data, geocs, places):
+        data = np.asarray(data, dtype=np.float64)
+        if data.shape != (len(geocs), len(places), len(geo_fields)):
+            msg = 'Expected data of shape {}, given: {}'
+            raise ValueError(msg.format((len(geocs), len(places),
+                                         len(geo_fields)), data.shape))
+        self.data = data
+        self.geocs = list(geocs)
+        self.places = list(places)
+        self.geocs_idx = {g: i for i, g in enumerate(self.geocs)}
+        self.places_idx = {p: i for i, p in enumerate(self.places)}
+
+    def __repr__(self):
+        return 'GeoStore({} geocoders x {} places)'.format(len(self.geocs),
+                                                           len(self.places))
+
+    @property
+    def coords(self):
+        """View of shape (geocoders, places, 3, 2): [loc, NE, SW] x [lat, lon]"""
+        return self.data.reshape(self.data.shape[:2] + (3, 2))
+
+    @property
+    def locs(self):
+        """View of shape (geocoders, places, 2): [lat, lon]."""
+        return self.coords[:, :, 0]
+
+    @property
+    def boxes(self):
+        """View of shape (geocoders, places, 2, 2): [NE, SW] x [lat, lon]."""
+        return self.coords[:, :, 1:]
+
+    @property
+    def found(self):
+        """Bool array (geocoders, places): True where there is data."""
+        return ~np.isnan(self.data).any(axis=2)
+
+    def select(self, geocs=None, places=None):
+        """Return a GeoStore restricted to the given geocoders & places."""
+        geocs = self.geocs if geocs is None else list(geocs)
+        places = self.places if places is None else list(places)
+        gi = [self.geocs_idx[g] for g in geocs]
+        pj = [self.places_idx[p] for p in places]
+        return GeoStore(self.data[np.ix_(gi, pj)], geocs, places)
+
+    @classmethod
+    def from_geo_dicts(cls, geocs, geo_dicts, places=None):
+        """
+        Build the store from the geodata dicts (get_geo_dicts() output).
+        :param places (list): default: the union of the places, in order of
+               first appearance.
+        """
+        if places is None:
+            places = list(OrderedDict.fromkeys(p for gd in geo_dicts
+                                               for p in gd))
+
+        data = np.full((len(geocs), len(places), len(geo_fields)), np.nan)
+        for i, gd in enumerate(geo_dicts):
+            for j, p in enumerate(places):
+                v = gd.get(p)
+                if v:
+                    data[i, j] = [v['loc'][0], v['loc'][1],
+                                  v['box'][0][0], v['box'][0][1],
+                                  v['box'][1][0], v['box'][1][1]]
+
+        return cls(data, geocs, places)
+
+    def to_geo_dicts(self):
+        """
+        Return the list of geodata dicts (one per geocoder) in the format of
+        get_geodata(); missing places are empty dicts.
+        """
+        geo_dicts = []
+        for i in range(len(self.geocs)):
+            gd = OrderedDict()
+            for j, p in enumerate(self.places):
+                info_d = OrderedDict()
+                if self.found[i, j]:
+                    lat, lon, ne_lat, ne_lon, sw_lat, sw_lon = \
+                        self.data[i, j].tolist()
+                    info_d['loc'] = [lat, lon]
+                    info_d['box'] = [[ne_lat, ne_lon], [sw_lat, sw_lon]]
+                gd[p] = info_d
+            geo_dicts.append(gd)
+
+        return geo_dicts
+
+    @classmethod
+    def from_geo_files(cls, geocs=None, alt_prefix='', places=None):
+        """
+        Load the geodata json files (geodata_XXX.json in DIR_GEO, with the
+        optional alt_prefix) of geocs (default: gc4settings.geocs).
+        """
+        if geocs is None:
+            geocs = gc4settings.geocs
+        if alt_prefix and alt_prefix[-1] != '_':
+            alt_prefix += '_'
+
+        geo_dicts = []
+        for g in geocs:
+            geofile = os.path.join(gc4settings.DIR_GEO,
+                                   alt_prefix + 'geodata_' + g[:3] + '.json')
+            geo_dicts.append(gc4utils.get_geo_file(geofile, show_info=False)
+                             or {})
+
+        return cls.from_geo_dicts(geocs, geo_dicts, places=places)
+
+    def save_geo_files(self, alt_prefix=''):
+        """Save one geodata json file per geocoder, as get_geodata() does."""
+        if alt_prefix and alt_prefix[-1] != '_':
+            alt_prefix += '_'
+
+        for g, gd in zip(self.geocs, self.to_geo_dicts()):
+            outfile = os.path.join(gc4settings.DIR_GEO,
+                                   alt_prefix + 'geodata_' + g[:3])
+            gc4utils.save_file(outfile, 'json', gd)
+
+
+def as_geo_store(geocs, geo_dicts, places=None):
+    """
+    Return geo_dicts as a GeoStore (restricted to places if given); a
+    GeoStore is returned as is, or its selection of geocs & places.
+    """
+    if isinstance(geo_dicts, GeoStore):
+        same_geocs = geocs is None or list(geocs) == geo_dicts.geocs
+        same_places = places is None or list(places) == geo_dicts.places
+        if same_geocs and same_places:
+            return geo_dicts
+        return geo_dicts.select(geocs=geocs, places=places)
+
+    return GeoStore.from_geo_dicts(geocs, geo_dicts, places=places)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Cat Chenal
+@module: gc4stub.py
+Local http stand-in for the four geocoding services: replays the stored
+geodata (or recorded raw responses) in each service's response format, with
+configurable latency, jitter, error rate & http 429 throttling.
+For offline benchmarking of the fetching path (concurrency, retries, cache).
+
+Example:
+with StubGeocoderServer(latency=0.2, jitter=0.1, throttle_rps=5) as stub:
+    use_stub_server(stub)
+    geo = comparison.get_geodata('ArcGis', query_lst, use_local=False)
+reset_geocoders_domains()
+"""
+__author__ = 'catchenal@gmail.com'
+
+import os
+import json
+import time
+import random
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4utils
+from GeocodersComparison import gc4fetch
+from GeocodersComparison.gc4fetch import get_place_name
+
+
+# geopy's request path & query parameter for each geocoder:
+stub_routes = {'/search': ('Nominatim', 'q'),
+               '/maps/api/geocode/json': ('GoogleV3', 'address'),
+               '/arcgis/rest/services/World/GeocodeServer/findAddressCandidates':
+                   ('ArcGis', 'singleLine'),
+               '/search/address/json': ('AzureMaps', 'query')}
+
+
+def to_raw_location(geocoder, q, info_d):
+    """
+    Return a raw response item in the geocoder's format from the normalized
+    geodata {'loc', 'box'}; inverse of gc4fetch.parse_location().
+    """
+    (lat, lon), ((n, e), (s, w)) = info_d['loc'], info_d['box']
+
+    if geocoder == 'Nominatim':
+        return {'lat': str(lat), 'lon': str(lon), 'display_name': q,
+                'boundingbox': [str(s), str(n), str(w), str(e)]}
+
+    elif geocoder == 'GoogleV3':
+        return {'formatted_address': q,
+                'geometry': {'location': {'lat': lat, 'lng': lon},
+                             'viewport': {'northeast': {'lat': n, 'lng': e},
+                                          'southwest': {'lat': s, 'lng': w}}}}
+
+    elif geocoder == 'ArcGis':
+        return {'address': q, 'score': 100, 'attributes': {},
+                'location': {'x': lon, 'y': lat},
+                'extent': {'xmin': w, 'ymin': s, 'xmax': e, 'ymax': n}}
+
+    else:
+        return {'address': {'freeformAddress': q},
+                'position': {'lat': lat, 'lon': lon},
+                'viewport': {'topLeftPoint': {'lat': n, 'lon': w},
+                             'btmRightPoint': {'lat': s, 'lon': e}}}
+
+
+def to_response(geocoder, raw_list):
+    """Wrap the raw items in the geocoder's response envelope."""
+    if geocoder == 'Nominatim':
+        return raw_list
+    elif geocoder == 'GoogleV3':
+        return {'status': 'OK' if raw_list else 'ZERO_RESULTS',
+                'results': raw_list}
+    elif geocoder == 'ArcGis':
+        return {'candidates': raw_list}
+    else:
+        return {'results': raw_list}
+
+
+class StubGeocoderServer():
+    """
+    Threaded local http server answering geopy's requests for the geocoders
+    in gc4settings.geocs from the stored geodata files.
+
+    Parameters
+    ----------
+    :param host, port: Address to bind; port=0 picks a free port.
+    :param alt_prefix (str): geodata files to replay, e.g. 'sep2018'.
+    :param cache (gc4cache.GeoCache): if given, its recorded raw responses are
+           replayed first.
+    :param latency (float or dict): Mean response delay (s); dict: by
+           geocoder name.
+    :param jitter (float): Delay spread: uniform in latency +/- jitter.
+    :param error_rate (float): Fraction of requests answered with http 500.
+    :param throttle_rps (float or dict): Requests per second accepted per
+           geocoder (dict: by geocoder name); the others get an http 429 with
+           a Retry-After header.
+    :param seed: Random seed, for repeatable benchmarks.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, alt_prefix='', cache=None,
+                 latency=0., jitter=0., error_rate=0., throttle_rps=None,
+                 seed=None):
+        self.alt_prefix = alt_prefix
+        self.cache = cache
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._last_accepted = {}
+        self.stats = {'connections': 0, 'requests': 0, 'errors': 0,
+                      'throttled': 0}
+
+        self.geodata = self._load_geodata()
+
+        self._httpd = ThreadingHTTPServer((host, port), self._get_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def domain(self):
+        host, port = self._httpd.server_address[:2]
+        return '{}:{}'.format(host, port)
+
+    def _load_geodata(self):
+        prefix = self.alt_prefix
+        if prefix and prefix[-1] != '_':
+            prefix += '_'
+
+        geodata = {}
+        for geo in gc4settings.geocs:
+            geofile = os.path.join(gc4settings.DIR_GEO,
+                                   prefix + 'geodata_' + geo[:3] + '.json')
+            if os.path.exists(geofile):
+                geodata[geo] = gc4utils.get_geo_file(geofile, show_info=False)
+            else:
+                geodata[geo] = {}
+        return geodata
+
+    def get_raw_list(self, geocoder, q):
+        """Return the list of raw items answering query q (may be empty)."""
+        if self.cache is not None:
+            found = self.cache.get(geocoder, q, with_raw=True)
+            if found is not None and found[1] is not None:
+                return [found[1]]
+
+        info_d = self.geodata[geocoder].get(get_place_name(q))
+        if not info_d:
+            return []
+        return [to_raw_location(geocoder, q, info_d)]
+
+    def _throttled(self, geocoder):
+        rps = self.throttle_rps
+        if isinstance(rps, dict):
+            rps = rps.get(geocoder)
+        if not rps:
+            return False
+
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_accepted.get(geocoder, -1e9) < 1. / rps:
+                return True
+            self._last_accepted[geocoder] = now
+            return False
+
+    def _get_handler(self):
+        stub = self
+
+        class StubHandler(BaseHTTPRequestHandler):
+            # keep-alive connections, as the geocoding services:
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.stats['connections'] += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                route = stub_routes.get(url.path)
+
+                with stub._lock:
+                    stub.stats['requests'] += 1
+
+                if route is None:
+                    return self._send(404, {'error': 'Unknown path'})
+                geocoder, param = route
+
+                delay = stub.latency
+                if isinstance(delay, dict):
+                    delay = delay.get(geocoder, 0.)
+                if stub.jitter:
+                    delay += stub._random.uniform(-stub.jitter, stub.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+
+                if stub._throttled(geocoder):
+                    with stub._lock:
+                        stub.stats['throttled'] += 1
+                    return self._send(429, {'error': 'Too Many Requests'},
+                                      {'Retry-After': '1'})
+
+                if stub.error_rate and stub._random.random() < stub.error_rate:
+                    with stub._lock:
+                        stub.stats['errors'] += 1
+                    return self._send(500, {'error': 'Stub server error'})
+
+                q = parse_qs(url.query).get(param, [''])[0]
+                raw_list = stub.get_raw_list(geocoder, q)
+                self._send(200, to_response(geocoder, raw_list))
+
+        return StubHandler
+
+    def start(self):
+        """Serve from a daemon thread; return self."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def use_stub_server(stub):
+    """
+    Point get_geocoder() (hence get_geodata()) at the stub server: set all
+    geocoders domains to stub.domain & the scheme to http.
+    """
+    for geo in gc4settings.geocs:
+        gc4settings.geocs_domains[geo] = stub.domain
+    gc4settings.GEOCODERS_SCHEME = 'http'
+    gc4fetch.reset_circuit_breakers()
+
+
+def reset_geocoders_domains():
+    """Point get_geocoder() back at the geocoding services."""
+    gc4settings.geocs_domains.clear()
+    gc4settings.GEOCODERS_SCHEME = None
+    gc4fetch.reset_circuit_breakers()
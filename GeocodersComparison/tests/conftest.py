@@ -0,0 +1,12 @@
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4fetch
+
+
+@pytest.fixture(autouse=True)
+def restore_rate_limits():
+    # the shared limiters outlive the tests: back to the settings limits
+    yield
+    gc4fetch.reset_rate_limiters()
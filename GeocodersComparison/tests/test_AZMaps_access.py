@@ -1,6 +1,7 @@
 # To test access to AzureMaps w/Geopy -> HTTP 400 error, Bad Request
 from geopy.geocoders import AzureMaps
-import requests
+
+from GeocodersComparison import gc4fetch
 
 AZK = GeoComp4.AZURE_KEY
 
@@ -40,7 +41,8 @@ for i, q in enumerate(query_lst):
                   'query': q,
                   'typeahead': False,
                   'limit': 1}
-        r = requests.get(url_Azure, params=params)
+        # shared keep-alive session:
+        r = gc4fetch.get_session().get(url_Azure, params=params)
         location = r.json()['results']
     
     if len(location):   # not sure that's a sufficient check...
@@ -112,4 +112,184 @@ def compare_check4(geos=geo_dicts2, locale='Staten Island', which='bounds'):
     except:
         print("Unexpected error:", sys.exc_info()[0])
         raise          
-"""
\ No newline at end of file
+"""
+
+from GeocodersComparison import comparison
+
+from .test_gc4fetch import FakeNominatim
+
+
+def test_update_geodata_fetches_only_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(comparison, 'DIR_GEO', str(tmp_path))
+    queries = ['New York City, NY, USA', 'Boston, MA, USA']
+
+    g = FakeNominatim()
+    geodata = comparison.update_geodata('Nominatim', queries[:1],
+                                        'geodata_Nom', g=g, limits={})
+    assert list(geodata.keys()) == ['New York City']
+
+    calls = []
+    g.geocode = lambda q, **kw: calls.append(q) or FakeNominatim.geocode(g, q)
+    geodata = comparison.update_geodata('Nominatim', queries,
+                                        'geodata_Nom', g=g, limits={})
+    assert calls == ['Boston, MA, USA']
+    assert list(geodata.keys()) == ['New York City', 'Boston']
+
+    # stale places are fetched again:
+    calls.clear()
+    comparison.update_geodata('Nominatim', queries, 'geodata_Nom',
+                              max_age=-1, g=g, limits={})
+    assert calls == queries
+
+
+def test_failed_refresh_keeps_stored_geodata(tmp_path, monkeypatch):
+    from geopy.exc import GeocoderTimedOut
+    from GeocodersComparison import gc4fetch
+    from GeocodersComparison import gc4settings
+    from .test_gc4fetch import FailingGeocoder
+
+    monkeypatch.setattr(comparison, 'DIR_GEO', str(tmp_path))
+    monkeypatch.setitem(gc4settings.RETRY_POLICY, 'retries', 0)
+    queries = ['New York City, NY, USA', 'Boston, MA, USA']
+    comparison.update_geodata('Nominatim', queries[:1], 'geodata_Nom',
+                              g=FakeNominatim(), limits={})
+    stored, fetched, _ = comparison.load_geodata('geodata_Nom')
+
+    # the geocoder is down: the stored place is kept, the new one raises
+    failing = FailingGeocoder(GeocoderTimedOut('Service timed out'))
+    monkeypatch.setattr(gc4fetch, 'get_client', lambda *a, **kw: failing)
+    with pytest.raises(RuntimeError, match='Boston'):
+        comparison.get_geodata('Nominatim', queries, use_local=False)
+    assert failing.calls == 2
+    assert comparison.load_geodata('geodata_Nom')[:2] == (stored, fetched)
+
+
+def test_cache_hit_is_not_a_failed_query(tmp_path, monkeypatch):
+    from geopy.exc import GeocoderTimedOut
+    from GeocodersComparison import gc4cache
+    from GeocodersComparison import gc4fetch
+    from .test_gc4fetch import FailingGeocoder
+
+    monkeypatch.setattr(comparison, 'DIR_GEO', str(tmp_path))
+    q = 'Boston, MA, USA'
+    info_d = {'loc': [42.36, -71.06], 'box': [[42.4, -70.99], [42.23, -71.19]]}
+    cache = gc4cache.GeoCache(str(tmp_path / 'c.sqlite'))
+    cache.put('Nominatim', q, None, info_d)
+    # failed in an earlier call:
+    gc4fetch.record_failed_query('Nominatim', q, GeocoderTimedOut())
+
+    failing = FailingGeocoder(GeocoderTimedOut('Service timed out'))
+    geodata = comparison.update_geodata('Nominatim', [q], 'geodata_Nom',
+                                        g=failing, cache=cache, limits={})
+    assert failing.calls == 0
+    assert geodata['Boston'] == info_d
+    _, fetched, _ = comparison.load_geodata('geodata_Nom')
+    assert 'Boston' in fetched
+    assert q not in gc4fetch.get_failed_queries('Nominatim')
+    cache.close()
+
+    gc4fetch.clear_failed_queries()
+    gc4fetch.reset_circuit_breakers()
+
+
+def test_compare_all_geocoords_n_way():
+    places = ['A', 'B']
+    names = ['G{}'.format(i) for i in range(6)]
+    geo_dicts = [{p: {'loc': [40. + i / 100., -74.],
+                      'box': [[41., -73.], [40., -75.]]} for p in places}
+                 for i in range(6)]
+    del geo_dicts[5]['B']
+
+    df = comparison.compare_all_geocoords(names, geo_dicts, places)
+    assert df.shape == (15 * 2, 3)
+    assert df.loc[('G0 v. G1', 'A'), 'NE'] == 0
+    assert df.loc[('G0 v. G5', 'B')].isna().all()
+
+    geo_df = comparison.get_geodata_df(names[:3], geo_dicts[:3], 'A')
+    diff_df = comparison.compare_geocoords(geo_df)
+    assert diff_df.shape == (3, 6)
+    assert comparison.with_style(diff_df).caption.startswith('3 geocoders')
+
+
+def test_compare_location_with_geobox_vectorized():
+    geo_dicts = [{'A': {'loc': [40.5, -74.5], 'box': [[41., -74.], [40., -75.]]},
+                  'B': {'loc': [40.9, -74.5], 'box': [[41., -74.], [40., -75.]]}},
+                 {'A': {'loc': [40.2, -74.5], 'box': [[41., -74.], [40., -75.]]},
+                  'B': {'loc': [40.5, -74.5], 'box': [[41., -74.], [40., -75.]]}}]
+
+    df, offsets = comparison.compare_location_with_geobox(
+                      ['A', 'B'], ['G1', 'G2'], geo_dicts, show_offsets=True)
+
+    assert df.values.tolist() == [[True, False], [False, True]]
+    assert offsets.loc['A', 'G1'] == 0
+    assert offsets.loc['A', 'G2'] == pytest.approx(33.3, abs=0.1)
+
+
+def test_find_identical_geoboxes():
+    box = [[41., -73.], [40., -75.]]
+    geo_dicts = [{'A': {'loc': [40.5, -74.], 'box': box},
+                  'B': {'loc': [40.6, -74.], 'box': [[41., -73.0000001],
+                                                     [40., -75.]]},
+                  'C': {'loc': [40.5, -74.], 'box': [[42., -73.], [40., -75.]]}},
+                 {'A': {'loc': [40.5, -74.], 'box': box},
+                  'B': {},
+                  'C': {'loc': [40.5, -74.], 'box': [[42., -73.], [40., -75.]]}}]
+
+    df = comparison.find_identical_geoboxes(['G1', 'G2'], geo_dicts)
+    assert df.index.tolist() == [('G1', 1)]
+    assert df.loc[('G1', 1), 'places'] == ['A', 'B']
+    assert df.loc[('G1', 1), 'count'] == 2
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_render_boro_maps(tmp_path, processes):
+    pytest.importorskip('folium')
+    places = ['Bronx county', 'Richmond county']
+    geo_dicts = comparison.get_geo_dicts(comparison.geocs,
+                                         comparison.query_lst)
+    df_dict = comparison.get_df_dict(comparison.geocs, geo_dicts, places)
+
+    timings = comparison.render_boro_maps(df_dict, processes=processes,
+                                          map_specs={'Bronx county':
+                                                     {'zoom': 11}},
+                                          out_dir=str(tmp_path))
+
+    assert list(timings.keys()) == places + ['Total']
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+        ['Bronx_county.html', 'Richmond_county.html']
+    assert '"zoom": 11' in (tmp_path / 'Bronx_county.html').read_text()
+    with pytest.raises(ValueError):
+        comparison.get_map_spec('Paris')
+    # a spec given for a place unknown to get_map_spec() must be complete:
+    with pytest.raises(ValueError, match='layer'):
+        comparison.render_boro_maps({'Paris': df_dict['Bronx county']},
+                                    processes=1,
+                                    map_specs={'Paris': {'boro_name': 'Paris',
+                                                         'zoom': 11}},
+                                    out_dir=str(tmp_path))
+
+
+def test_heatmap_frames_paging(tmp_path, monkeypatch):
+    pytest.importorskip('seaborn')
+    geocs = ['G1', 'G2', 'G3']
+    places = ['A', 'B', 'C']
+    box = [[41., -73.], [40., -75.]]
+    geo_dicts = [{p: {'loc': [40.5 + 0.1 * i * j, -74.], 'box': box}
+                  for j, p in enumerate(places)} for i in range(3)]
+
+    frames = comparison.get_heatmap_frames(places, unit='mi', geocs=geocs,
+                                           geo_dicts=geo_dicts)
+    assert list(frames.keys()) == comparison.heatmap_geoms
+    # sorted by the 2nd geocoder:
+    assert frames['Location'].index.tolist() == ['G1 v. G2', 'G1 v. G3',
+                                                 'G2 v. G3']
+    assert frames['Location'].loc['G1 v. G2', 'A'] == 0
+    assert frames['NE'].values.max() == 0
+
+    monkeypatch.setattr(comparison.gc4settings, 'DIR_IMG', str(tmp_path))
+    saved = comparison.get_geo_dist_heatmap(places, None, geocs=geocs,
+                                            geo_dicts=geo_dicts,
+                                            max_rows=2, max_cols=2)
+    assert len(saved) == 4
+    assert sorted(p.name for p in tmp_path.iterdir())[0] == \
+        'Heatmap_sns_geodist_difference_km_p1.svg'
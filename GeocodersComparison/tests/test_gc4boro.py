@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4boro
+
+gpd = pytest.importorskip('geopandas')
+shapely = pytest.importorskip('shapely')
+
+
+# Cleopatra's needle, Staten Island, Atlantic ocean, none:
+lats = [40.7794, 40.5795, 40.50, np.nan]
+lons = [-73.9653, -74.1502, -73.85, -74.]
+
+
+def test_impute_boros():
+    df = gc4boro.impute_boros(lats, lons)
+    assert df.BoroName.tolist()[:2] == ['Manhattan', 'Staten Island']
+    assert df.BoroCode.tolist()[:2] == [1, 5]
+    assert df.BoroName[2:].isna().all()
+    assert df.BoroCode[2:].isna().all()
+
+
+def test_grid_matches_tree_query():
+    idx = gc4boro.get_boro_index()
+    rng = np.random.default_rng(0)
+    la = rng.uniform(40.49, 40.92, 20000)
+    lo = rng.uniform(-74.26, -73.69, 20000)
+
+    x, y, _ = idx.project(la, lo)
+    pt_i, poly_i = idx.tree.query(shapely.points(x, y),
+                                  predicate='intersects')
+    expected = np.full(len(la), -1)
+    expected[pt_i] = poly_i
+
+    assert (idx.locate(la, lo) == expected).all()
+
+
+def test_nearest_fallback():
+    # ~6.6 km off the Rockaways:
+    la, lo = lats[2:], lons[2:]
+    assert gc4boro.impute_boros(la, lo).BoroName.isna().all()
+    df = gc4boro.impute_boros(la, lo, nearest=True, max_dist_km=5)
+    assert df.BoroName.isna().all()
+    df = gc4boro.impute_boros(la, lo, nearest=True, max_dist_km=10)
+    assert df.BoroName[0] == 'Queens'
+    assert pd.isna(df.BoroName[1])
+
+
+def test_process_pool_same_result():
+    df = gc4boro.impute_boros(lats, lons)
+    df2 = gc4boro.impute_boros(lats, lons, processes=2, chunksize=2)
+    assert df2.equals(df)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4bounds
+
+shapely = pytest.importorskip('shapely')
+
+
+def test_box_metrics():
+    # 0.1 x 0.1 degree square place; boxes: exact, extended north by 0.1,
+    # missing
+    sq = shapely.segmentize(shapely.box(-74.1, 40.6, -74., 40.7), 0.005)
+    pb = gc4bounds.PlaceBounds({'Sq': sq})
+
+    geo_dicts = [{'Sq': {'loc': [40.65, -74.05],
+                         'box': [[40.7, -74.], [40.6, -74.1]]}},
+                 {'Sq': {'loc': [40.65, -74.05],
+                         'box': [[40.8, -74.], [40.6, -74.1]]}},
+                 {'Sq': {}}]
+    df = pb.box_metrics(['G1', 'G2', 'G3'], geo_dicts)
+
+    assert df.shape == (3, len(gc4bounds.bounds_metrics))
+    assert df.loc[('Sq', 'G1'), 'IoU'] == pytest.approx(1.)
+    assert df.loc[('Sq', 'G1'), ['N', 'E', 'S', 'W']].tolist() == \
+        pytest.approx([0.] * 4, abs=1e-9)
+
+    g2 = df.loc[('Sq', 'G2')]
+    assert g2['IoU'] == pytest.approx(0.5, abs=0.01)
+    assert g2['Covered'] == pytest.approx(1.)
+    assert g2['Inside'] == pytest.approx(0.5, abs=0.01)
+    # 0.1 degree of latitude:
+    assert g2['N'] == pytest.approx(11.1, abs=0.05)
+
+    assert df.loc[('Sq', 'G3')].isna().all()
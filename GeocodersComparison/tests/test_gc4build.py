@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4build
+
+
+def concat(inputs, out):
+    # test build function: out is the concatenation of the inputs
+    with open(out, 'w') as fw:
+        for f in inputs:
+            with open(f) as fr:
+                fw.write(fr.read())
+
+
+def fail(out):
+    raise ValueError('no build')
+
+
+def get_builder(tmp_path):
+    a, b = str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')
+    ab, abb = str(tmp_path / 'ab.txt'), str(tmp_path / 'abb.txt')
+
+    targets = [gc4build.Target('abb', concat, {'inputs': [ab, b], 'out': abb},
+                               inputs=[b], outputs=[abb], deps=['ab']),
+               gc4build.Target('ab', concat, {'inputs': [a, b], 'out': ab},
+                               inputs=[a, b], outputs=[ab])]
+    return gc4build.Builder(targets, manifest=str(tmp_path / 'm.json'))
+
+
+def test_builder_incremental(tmp_path):
+    (tmp_path / 'a.txt').write_text('a')
+    (tmp_path / 'b.txt').write_text('b')
+    builder = get_builder(tmp_path)
+    assert builder.get_order() == ['ab', 'abb']
+
+    timings = builder.run(processes=1)
+    assert list(timings) == ['ab', 'abb', 'Total']
+    assert (tmp_path / 'abb.txt').read_text() == 'abb'
+
+    # no-op: a new builder reads the manifest
+    builder = get_builder(tmp_path)
+    assert builder.get_stale() == []
+    assert list(builder.run(processes=1)) == ['Total']
+
+    # same content, new mtime: still up to date
+    os.utime(str(tmp_path / 'a.txt'), ns=(0, 0))
+    assert get_builder(tmp_path).get_stale() == []
+
+    # a changed input: its dependent too
+    (tmp_path / 'a.txt').write_text('A')
+    builder = get_builder(tmp_path)
+    assert builder.get_stale() == ['ab', 'abb']
+    builder.run(processes=2)
+    assert (tmp_path / 'abb.txt').read_text() == 'Abb'
+
+    # a missing output:
+    os.remove(str(tmp_path / 'abb.txt'))
+    assert get_builder(tmp_path).get_stale() == ['abb']
+
+
+def test_builder_errors(tmp_path):
+    out = str(tmp_path / 'x.txt')
+    targets = [gc4build.Target('x', fail, {'out': out}, outputs=[out]),
+               gc4build.Target('y', concat, {'inputs': [out], 'out': out},
+                               deps=['x'])]
+    builder = gc4build.Builder(targets, manifest=str(tmp_path / 'm.json'))
+    with pytest.raises(RuntimeError, match='dependency failed'):
+        builder.run(processes=1)
+
+    with pytest.raises(ValueError):
+        gc4build.Builder(targets[1:], manifest=str(tmp_path / 'm.json'))
+
+
+def test_get_report_targets():
+    targets = gc4build.get_report_targets(alt_prefix='sep2018',
+                                          places=['Boston', 'Paris'])
+    names = [t.name for t in targets]
+    assert names == ['dist_diff:Boston', 'map:Boston', 'dist_diff:Paris',
+                     'heatmap:km', 'heatmap:mi', 'pic:comp_Loc_center_tbl']
+    assert os.path.basename(targets[1].outputs[0]) == 'sep2018_Boston.html'
+    assert any(f.endswith('Boston.shp') for f in targets[1].inputs)
+
+
+def test_map_target_outputs_assets(tmp_path, monkeypatch):
+    pytest.importorskip('folium')
+    from GeocodersComparison import comparison
+    from GeocodersComparison import gc4settings
+
+    monkeypatch.setattr(gc4settings, 'DIR_HTML', str(tmp_path))
+    outputs = gc4build._build_map(gc4settings.geocs, 'sep2018_', 'Boston',
+                                  comparison.get_map_spec('Boston'),
+                                  gc4settings.colors_dict, 'cartodbpositron',
+                                  external_assets=True)
+
+    assert os.path.basename(outputs[0]) == 'sep2018_Boston.html'
+    assert len(outputs) == 2
+    assert os.path.dirname(outputs[1]) == str(tmp_path / 'assets')
+    assert all(os.path.exists(f) for f in outputs)
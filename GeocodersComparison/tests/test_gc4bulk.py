@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4bulk
+
+from .test_gc4fetch import FakeNominatim
+
+
+class QuotaNominatim(FakeNominatim):
+    """Fails after n calls, like a geocoder whose quota ran out."""
+
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+
+    def geocode(self, q, **kwargs):
+        self.n -= 1
+        if self.n < 0:
+            raise RuntimeError('quota exceeded')
+        return super().geocode(q, **kwargs)
+
+
+def test_bulk_geocode_resumes(tmp_path):
+    infile = tmp_path / 'records.csv'
+    rows = ['{} Main St, Boston, MA, USA'.format(i) for i in range(25)]
+    infile.write_text('id,query\n' + '\n'.join('{},"{}"'.format(i, q)
+                                               for i, q in enumerate(rows)))
+    outfile = str(tmp_path / 'out.jsonl')
+
+    with pytest.raises(RuntimeError):
+        gc4bulk.bulk_geocode('Nominatim', str(infile), outfile, chunksize=10,
+                             g=QuotaNominatim(15), limits={},
+                             show_info=False)
+    assert gc4bulk.read_checkpoint(outfile + '.ckpt')['rows_done'] == 10
+
+    ckpt = gc4bulk.bulk_geocode('Nominatim', str(infile), outfile,
+                                chunksize=10, g=FakeNominatim(), limits={},
+                                show_info=False)
+    assert ckpt['rows_done'] == 25
+
+    recs = list(gc4bulk.iter_bulk_results(outfile))
+    assert [r['row'] for r in recs] == list(range(25))
+    assert recs[-1]['query'] == rows[-1]
+    assert recs[-1]['place'] == '24 Main St'
+
+
+def test_bulk_geocode_checks_checkpoint(tmp_path):
+    infile, other = tmp_path / 'records.csv', tmp_path / 'other.csv'
+    infile.write_text('query\n' + '\n'.join('"{}, MA, USA"'.format(i)
+                                             for i in range(15)))
+    other.write_text('query\n"Boston, MA, USA"\n')
+    outfile = str(tmp_path / 'out.jsonl')
+
+    with pytest.raises(RuntimeError):
+        gc4bulk.bulk_geocode('Nominatim', str(infile), outfile, chunksize=10,
+                             g=QuotaNominatim(12), limits={},
+                             show_info=False)
+
+    # a stale checkpoint: not resumed
+    with pytest.raises(ValueError, match='infile'):
+        gc4bulk.bulk_geocode('Nominatim', str(other), outfile,
+                             g=FakeNominatim(), limits={}, show_info=False)
+    with pytest.raises(ValueError, match='geocoder'):
+        gc4bulk.bulk_geocode('ArcGis', str(infile), outfile,
+                             g=FakeNominatim(), limits={}, show_info=False)
+
+    ckpt = gc4bulk.bulk_geocode('Nominatim', str(other), outfile,
+                                g=FakeNominatim(), limits={}, restart=True,
+                                show_info=False)
+    assert ckpt['rows_done'] == 1
+
+
+def test_iter_queries_jsonl(tmp_path):
+    infile = tmp_path / 'q.jsonl'
+    infile.write_text('"Boston, MA, USA"\n{"query": "Bronx county, NY, USA"}\n')
+    assert list(gc4bulk.iter_queries(str(infile), skip=1)) == \
+        ['Bronx county, NY, USA']
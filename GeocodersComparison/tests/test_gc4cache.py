@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4cache
+from GeocodersComparison import gc4settings
+
+
+info_d = {'loc': [42.36, -71.06], 'box': [[42.40, -70.99], [42.23, -71.19]]}
+
+
+def test_normalize_query():
+    assert gc4cache.normalize_query(' Boston ,  MA, USA') == 'boston, ma, usa'
+
+
+def test_cache_get_put(tmp_path):
+    cache = gc4cache.GeoCache(str(tmp_path / 'c.sqlite'))
+    assert cache.get('Nominatim', 'Boston, MA, USA') is None
+
+    cache.put('Nominatim', 'Boston, MA, USA', {'lat': '42.36'}, info_d)
+    assert cache.get('Nominatim', 'boston,  MA, USA') == info_d
+    assert cache.get('GoogleV3', 'Boston, MA, USA') is None
+
+    geodata, raw = cache.get('Nominatim', 'Boston, MA, USA', with_raw=True)
+    assert raw == {'lat': '42.36'}
+
+
+def test_cache_ttl_and_eviction(tmp_path):
+    cache = gc4cache.GeoCache(str(tmp_path / 'c.sqlite'), max_entries=2)
+
+    cache.put('ArcGis', 'a', None, info_d, ttl=-1)
+    assert cache.get('ArcGis', 'a') is None
+
+    for q in ['b', 'c', 'd']:
+        cache.put('ArcGis', q, None, info_d)
+        time.sleep(0.01)
+    assert len(cache) == 2
+    assert cache.get('ArcGis', 'b') is None
+
+
+def test_cache_hits_do_not_write(tmp_path):
+    cache = gc4cache.GeoCache(str(tmp_path / 'c.sqlite'), max_entries=2)
+    for q in ['a', 'b']:
+        cache.put('ArcGis', q, None, info_d)
+        time.sleep(0.01)
+
+    changes = cache._con.total_changes
+    assert cache.get('ArcGis', 'a') == info_d
+    assert cache._con.total_changes == changes
+
+    # the hit is written with the next put: 'b' is the least recently used
+    cache.put('ArcGis', 'c', None, info_d)
+    assert cache.get('ArcGis', 'b') is None
+    assert cache.get('ArcGis', 'a') == info_d
+
+
+def test_cache_expired_fallback(tmp_path):
+    cache = gc4cache.GeoCache(str(tmp_path / 'c.sqlite'))
+    cache.put('ArcGis', 'a', None, info_d, ttl=-1)
+    # another put does not delete the expired row:
+    cache.put('ArcGis', 'b', None, info_d)
+    assert cache.get('ArcGis', 'a') is None
+    assert cache.get('ArcGis', 'a', allow_expired=True) == info_d
+
+
+def test_import_geo_files(tmp_path):
+    cache = gc4cache.GeoCache(str(tmp_path / 'c.sqlite'))
+    n = cache.import_geo_files(alt_prefix='sep2018')
+
+    assert n == len(gc4settings.geocs) * len(gc4settings.query_lst)
+    assert cache.get('Nominatim', 'Boston, MA, USA')['loc']
@@ -0,0 +1,160 @@
+import time
+import threading
+
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4fetch
+from GeocodersComparison import gc4settings
+
+
+class FakeLocation():
+    def __init__(self, raw):
+        self.raw = raw
+
+
+class FakeNominatim():
+    """Stands in for geopy's Nominatim: answers in the Nominatim json format."""
+
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def geocode(self, q, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+
+        n = float(len(q))
+        return FakeLocation([{'lat': str(n), 'lon': str(-n),
+                              'boundingbox': [str(n - 1), str(n + 1),
+                                              str(-n - 1), str(-n + 1)]}])
+
+
+query_lst = ['New York City, NY, USA',
+             'Bronx county, NY, USA',
+             'Boston, MA, USA']
+
+
+def test_get_place_name():
+    assert gc4fetch.get_place_name(query_lst[0]) == 'New York City'
+    assert gc4fetch.get_place_name(query_lst[1]) == 'Bronx county'
+
+
+def test_fetch_geodata_concurrent_keeps_order():
+    g = FakeNominatim(delay=0.05)
+    limits = {'rps': None, 'in_flight': 2}
+
+    geodata = gc4fetch.fetch_geodata('Nominatim', query_lst, g=g,
+                                     concurrent=True, limits=limits)
+
+    assert list(geodata.keys()) == ['New York City', 'Bronx county', 'Boston']
+    n = float(len(query_lst[1]))
+    assert geodata['Bronx county']['loc'] == [n, -n]
+    assert geodata['Bronx county']['box'] == [[n + 1, -n + 1], [n - 1, -n - 1]]
+    assert g.max_in_flight <= 2
+
+
+def test_rate_limiter_spacing():
+    lim = gc4fetch.RateLimiter(rps=20)
+    t0 = time.monotonic()
+    for _ in range(5):
+        with lim:
+            pass
+    # 5 calls at 20 rps: the last one starts >= 4 intervals after the first
+    assert time.monotonic() - t0 >= 4 / 20. - 0.01
+
+
+def test_shared_rate_limiter_keeps_state():
+    lim = gc4fetch.get_rate_limiter('Nominatim')
+    with gc4fetch.rate_limits('Nominatim', {'rps': 10}) as same:
+        assert same is lim and lim.interval == 0.1
+        with lim:
+            pass
+        # new limits for the same shared limiter: the next start is kept
+        with gc4fetch.rate_limits('Nominatim', {'rps': 5, 'in_flight': 1}):
+            assert lim.interval == 0.2 and lim.in_flight == 1
+            t0 = time.monotonic()
+            with lim:
+                pass
+            assert time.monotonic() - t0 >= 0.1 - 0.01
+        assert lim.interval == 0.1
+
+    # the override is for its scope only:
+    assert gc4fetch.get_rate_limiter('Nominatim') is lim
+    assert lim.rps == gc4settings.geocs_limits['Nominatim']['rps']
+
+
+def test_circuit_breaker():
+    cb = gc4fetch.CircuitBreaker(failures=2, reset_after=0.05)
+    cb.record_failure()
+    assert cb.allow()
+    cb.record_failure()
+    assert cb.state == 'open' and not cb.allow()
+
+    time.sleep(0.06)
+    # half-open: one trial request
+    assert cb.allow() and not cb.allow()
+    cb.record_failure()
+    assert cb.state == 'open'
+
+    time.sleep(0.06)
+    assert cb.allow()
+    cb.record_success()
+    assert cb.state == 'closed' and cb.allow()
+
+
+def test_backoff_delay():
+    delays = [gc4fetch.get_backoff_delay(k, base_delay=1., max_delay=4.)
+              for k in range(6) for _ in range(20)]
+    assert 0 <= min(delays) and max(delays) <= 4.
+    assert max(delays[:20]) <= 1.
+
+
+def get_http_error(code):
+    # as geopy raises it: from the urllib HTTPError
+    from urllib.error import HTTPError
+    from geopy import exc
+
+    try:
+        try:
+            raise HTTPError('http://geo', code, 'msg', {}, None)
+        except HTTPError:
+            raise exc.GeocoderQuotaExceeded('msg')
+    except exc.GeocoderQuotaExceeded as e:
+        return e
+
+
+class FailingGeocoder():
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def geocode(self, q, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def test_used_up_quota_is_not_retried():
+    assert gc4fetch.is_transient(get_http_error(429))
+    assert not gc4fetch.is_transient(get_http_error(402))
+
+    retry = {'retries': 2, 'base_delay': 0.}
+    breaker = gc4fetch.CircuitBreaker(failures=1)
+    g = FailingGeocoder(get_http_error(402))
+    with pytest.raises(Exception):
+        gc4fetch.geocode_resilient(g, 'ArcGis', 'a', retry=retry,
+                                   breaker=breaker)
+    assert g.calls == 1 and breaker.state == 'closed'
+
+    g = FailingGeocoder(get_http_error(429))
+    with pytest.raises(Exception):
+        gc4fetch.geocode_resilient(g, 'ArcGis', 'a', retry=retry,
+                                   breaker=gc4fetch.CircuitBreaker())
+    assert g.calls == 3
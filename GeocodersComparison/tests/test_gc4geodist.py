@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4geodist
+
+from geopy import distance as geod
+
+
+pts = np.array([[40.7128, -74.0060],      # NYC
+                [42.3601, -71.0589],      # Boston
+                [-33.8688, 151.2093],     # Sydney
+                [0., 0.],
+                [0.5, 179.7]])            # nearly antipodal to [0, 0]
+
+
+def test_exact_matches_geopy():
+    d = gc4geodist.pairwise_distances_km(pts)
+    i, j = gc4geodist.get_pair_indices(len(pts))
+
+    expected = [geod.distance(pts[a], pts[b]).km for a, b in zip(i, j)]
+    np.testing.assert_allclose(d, expected, rtol=0, atol=1e-6)
+
+
+def test_haversine_error_bound():
+    d = gc4geodist.pairwise_distances_km(pts)
+    h = gc4geodist.pairwise_distances_km(pts, method='haversine')
+    assert np.all(np.abs(h - d) / d < 0.006)
+
+
+def test_pair_order_and_shape():
+    coords = np.zeros((4, 7, 3, 2))
+    assert gc4geodist.pairwise_distances_km(coords).shape == (6, 7, 3)
+
+    with pytest.raises(ValueError):
+        gc4geodist.distance_km(pts[0], pts[1], method='flat')
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4hedge
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4stub
+
+
+query_lst = gc4settings.query_lst
+
+
+@pytest.fixture
+def stub():
+    server = gc4stub.StubGeocoderServer(alt_prefix='sep2018', seed=0)
+    with server:
+        gc4stub.use_stub_server(server)
+        yield server
+    gc4stub.reset_geocoders_domains()
+
+
+@pytest.fixture
+def hedger():
+    disagreement = gc4hedge.get_disagreement_km()
+    hg = gc4hedge.HedgedGeocoder('ArcGis', backups=['AzureMaps'],
+                                 default_delay=0.4, min_samples=2,
+                                 disagreement=disagreement)
+    with hg:
+        yield hg
+
+
+def test_get_disagreement_km():
+    df = gc4hedge.get_disagreement_km()
+    assert list(df.index) == gc4settings.geocs
+    assert np.allclose(df.values, df.values.T)
+    assert (np.diag(df.values) == 0).all()
+
+
+def test_hedged_geocode(stub, hedger):
+    q = query_lst[0]
+    res = hedger.geocode(q)
+    assert res.geocoder == 'ArcGis' and not res.hedged
+    assert res.expected_km == 0.
+    assert res.info_d == stub.geodata['ArcGis'][res.place]
+
+    # slow preferred geocoder: the backup answers
+    stub.latency = {'ArcGis': 1.5}
+    res = hedger.geocode(q)
+    assert res.geocoder == 'AzureMaps' and res.hedged
+    assert res.backups == {'AzureMaps': gc4hedge.TIMEOUT}
+    assert res.latency < 1.5
+    assert res.info_d == stub.geodata['AzureMaps'][res.place]
+    assert res.expected_km == hedger.disagreement.loc['ArcGis', 'AzureMaps']
+
+    # not found by any: a failover, not a hedge
+    stub.latency = 0.
+    res = hedger.geocode('Nowhere, XX')
+    assert res.geocoder is None and res.info_d == {}
+    assert not res.hedged
+    assert res.backups == {'AzureMaps': gc4hedge.FAILOVER}
+
+    stats = hedger.get_stats()
+    assert list(stats['answers']) == [1, 1, 1]
+    assert stats.attrs['hedged'] == pytest.approx(1 / 3)
+    assert stats.attrs['failover'] == pytest.approx(1 / 3)
+
+
+def test_hedge_delay(stub, hedger):
+    assert hedger.get_delay() == 0.4
+    stub.latency = {'ArcGis': 0.02}
+    for q in query_lst[:2]:
+        assert hedger.geocode(q).geocoder == 'ArcGis'
+    assert 0.02 <= hedger.get_delay() < 0.4
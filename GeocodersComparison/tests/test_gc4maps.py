@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from .context import GeocodersComparison
+
+pytest.importorskip('folium')
+
+from GeocodersComparison import comparison
+from GeocodersComparison import gc4maps
+from GeocodersComparison import gc4shapes
+
+
+def test_write_geojson_asset(tmp_path):
+    gdf = gc4shapes.get_layer('nyc_counties', zoom=10)
+
+    src, var_name = gc4maps.write_geojson_asset(gdf, str(tmp_path))
+    path = tmp_path / src
+    assert src.startswith('assets/bounds_')
+    assert path.read_text().startswith('var {} = {{'.format(var_name))
+
+    # same content: same file, not rewritten
+    mtime = os.stat(str(path)).st_mtime_ns
+    assert gc4maps.write_geojson_asset(gdf, str(tmp_path)) == (src, var_name)
+    assert os.stat(str(path)).st_mtime_ns == mtime
+
+    other = gc4maps.write_geojson_asset(gdf.iloc[:1], str(tmp_path))
+    assert other[0] != src
+
+
+def test_frames_share_external_assets(tmp_path):
+    places = ['Bronx county', 'New York county']
+    geo_dicts = comparison.get_geo_dicts(comparison.geocs,
+                                         comparison.query_lst)
+    df_dict = comparison.get_df_dict(comparison.geocs, geo_dicts, places)
+
+    # both frames show all NYC boroughs at the same zoom:
+    specs = {p: {'filter_bounds': False} for p in places}
+    comparison.render_boro_maps(df_dict, processes=1, map_specs=specs,
+                                out_dir=str(tmp_path), external_assets=True)
+
+    assets = os.listdir(str(tmp_path / 'assets'))
+    assert len(assets) == 1
+    for p in places:
+        html = (tmp_path / (p.replace(' ', '_') + '.html')).read_text()
+        assert '<script src="assets/{}"></script>'.format(assets[0]) in html
+        assert '"Bronx"' not in html
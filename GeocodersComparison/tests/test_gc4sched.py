@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4fetch
+from GeocodersComparison import gc4sched
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4stub
+
+
+query_lst = gc4settings.query_lst
+
+
+@pytest.fixture
+def stub():
+    server = gc4stub.StubGeocoderServer(alt_prefix='sep2018', seed=0)
+    with server:
+        gc4stub.use_stub_server(server)
+        yield server
+    gc4stub.reset_geocoders_domains()
+
+
+def test_provider_queue_backoff():
+    pq = gc4sched.ProviderQueue('ArcGis', rps=10, in_flight=2,
+                                quota_left=5, max_throttled=2)
+    pq.queue.extend(enumerate(['a', 'b']))
+    assert pq.ready_at(0.) == 0.
+    item = pq.start(0.)
+    assert pq.ready_at(0.) == pytest.approx(0.1)
+
+    pq.on_throttled(item, 1.)
+    assert (pq.rps, pq.ceiling, pq.paused_until) == (5, 9, 2.)
+    assert pq.queue[0] == (0, 'a') and pq.quota_left == 5
+    pq.on_done(0.2, True)   # as if answered
+    assert pq.rps == 6
+
+    pq.running = 1
+    pq.on_throttled(pq.start(3.), 3.)
+    assert pq.paused_until == 4.
+    pq.on_throttled(pq.start(4.), 4.)
+    assert pq.stopped == 'throttled' and pq.ready_at(5.) is None
+
+
+def test_scheduler_interleaves_geocoders(stub, tmp_path):
+    ledger = gc4sched.QuotaLedger(str(tmp_path / 'quota.json'))
+    stub.throttle_rps = {'ArcGis': 20}
+    sched = gc4sched.BatchScheduler(geocs=['Nominatim', 'ArcGis', 'AzureMaps'],
+                                    limits={'Nominatim': {'rps': 20,
+                                                          'in_flight': 1}},
+                                    quotas={'AzureMaps': 3}, ledger=ledger,
+                                    show_info=False, max_backoff=0.1)
+    sched.add_all(query_lst)
+    assert sched.estimate()['Nominatim'] == pytest.approx(8 / 20)
+
+    geodata = sched.run()
+    for geo in ['Nominatim', 'ArcGis']:
+        assert dict(geodata[geo]) == stub.geodata[geo]
+
+    stats = sched.get_stats()
+    assert stats.loc['AzureMaps', 'sent'] == 3
+    assert stats.loc['AzureMaps', 'not sent'] == 5
+    assert stats.loc['AzureMaps', 'stopped'] == 'daily quota'
+    assert sum(bool(v) for v in geodata['AzureMaps'].values()) == 3
+    # the queries not sent are failed, not "not found":
+    not_sent = [q for q, e in sched.failed['AzureMaps']]
+    assert not_sent == query_lst[3:]
+    assert 'daily quota' in sched.failed['AzureMaps'][0][1]
+    assert set(not_sent) <= set(gc4fetch.get_failed_queries('AzureMaps'))
+
+    # the quota holds across runs:
+    ledger = gc4sched.QuotaLedger(str(tmp_path / 'quota.json'))
+    assert ledger.used('AzureMaps') == 3
+    sched = gc4sched.BatchScheduler(geocs=['AzureMaps'], ledger=ledger,
+                                    quotas={'AzureMaps': 4}, show_info=False)
+    assert sched.providers['AzureMaps'].quota_left == 1
+
+
+def test_scheduler_paced_run_does_not_spin(stub, tmp_path):
+    ledger = gc4sched.QuotaLedger(str(tmp_path / 'quota.json'))
+    sched = gc4sched.BatchScheduler(geocs=['Nominatim'],
+                                    limits={'Nominatim': {'rps': 5,
+                                                          'in_flight': 1}},
+                                    ledger=ledger, show_info=False)
+    # the shared limiter, as used by gc4fetch:
+    assert sched.limiters['Nominatim'] is \
+        gc4fetch.get_rate_limiter('Nominatim')
+
+    sched.add('Nominatim', query_lst[:4])
+    t0, cpu0 = time.monotonic(), time.process_time()
+    geodata = sched.run()
+    wall, cpu = time.monotonic() - t0, time.process_time() - cpu0
+
+    assert len(geodata['Nominatim']) == 4
+    assert wall >= 3 / 5. - 0.01
+    assert cpu < wall / 3
+    # the limits given hold for the run only:
+    lim = sched.limiters['Nominatim']
+    assert lim.rps == gc4settings.geocs_limits['Nominatim']['rps']
@@ -0,0 +1,95 @@
+import os
+import glob
+import shutil
+
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4shapes
+
+gpd = pytest.importorskip('geopandas')
+
+
+@pytest.fixture
+def shp_copy(tmp_path):
+    src = os.path.join(gc4settings.DIR_SHP, 'nybbwi')
+    for f in glob.glob(src + '.*'):
+        shutil.copy(f, str(tmp_path))
+    return os.path.join(str(tmp_path), 'nybbwi.shp')
+
+
+def test_read_shapefile_cached(shp_copy, tmp_path):
+    cache_dir = os.path.join(str(tmp_path), 'cache')
+
+    gdf = gc4shapes.read_shapefile(shp_copy, cache_dir=cache_dir)
+    cache_path = gc4shapes.get_cache_path(shp_copy, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == [os.path.basename(cache_path)]
+
+    cached = gc4shapes.read_shapefile(shp_copy, cache_dir=cache_dir)
+    expected = gpd.read_file(shp_copy)
+    assert cached.equals(expected)
+    assert (cached.dtypes == expected.dtypes).all()
+    assert cached.crs == gdf.crs
+
+
+def test_cache_invalidated_by_mtime(shp_copy, tmp_path):
+    cache_dir = os.path.join(str(tmp_path), 'cache')
+    gc4shapes.read_shapefile(shp_copy, cache_dir=cache_dir)
+    old = gc4shapes.get_cache_path(shp_copy, cache_dir=cache_dir)
+
+    dbf = shp_copy[:-4] + '.dbf'
+    st = os.stat(dbf)
+    os.utime(dbf, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    new = gc4shapes.get_cache_path(shp_copy, cache_dir=cache_dir)
+    assert new != old
+    gc4shapes.read_shapefile(shp_copy, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == [os.path.basename(new)]
+
+
+def test_boston_layer_format():
+    gdf = gc4shapes.get_layer('boston')
+    assert list(gdf.columns) == ['BoroCode', 'BoroName', 'Shape_Area',
+                                 'Shape_Leng', 'geometry']
+    assert gdf.BoroName.tolist() == ['Boston']
+    assert gc4shapes.get_layer('boston') is gdf
+
+
+def test_get_simplify_zoom():
+    assert gc4shapes.get_simplify_zoom(None) is None
+    assert gc4shapes.get_simplify_zoom(9) == 10
+    assert gc4shapes.get_simplify_zoom(10) == 10
+    assert gc4shapes.get_simplify_zoom(gc4shapes.simplify_zooms[-1] + 1) \
+        is None
+
+
+def test_simplified_layer():
+    shapely = pytest.importorskip('shapely')
+
+    full = gc4shapes.get_layer('boston')
+    gdf = gc4shapes.get_layer('boston', zoom=11)
+    assert gdf is gc4shapes.get_layer('boston', zoom=12)
+    assert list(gdf.columns) == list(full.columns)
+    assert gdf.crs == 'EPSG:4326'
+    assert shapely.is_valid(gdf.geometry.values).all()
+
+    n_full = shapely.get_num_coordinates(full.geometry.values).sum()
+    n = shapely.get_num_coordinates(gdf.geometry.values).sum()
+    assert n < n_full / 10
+
+    # within the tolerance: half a pixel at zoom 12 is ~19 m
+    full_4326 = full.to_crs('EPSG:4326').geometry.values
+    dist = shapely.hausdorff_distance(full_4326, gdf.geometry.values)
+    assert (dist < 0.0003).all()
+
+
+def test_simplified_suffix(monkeypatch):
+    suffix = gc4shapes.get_simplified_suffix(10)
+    assert suffix.startswith('.z10')
+    monkeypatch.setattr(gc4shapes, 'SIMPLIFY_PX', 1.)
+    assert gc4shapes.get_simplified_suffix(10) != suffix
+    monkeypatch.setattr(gc4shapes, 'COORDS_PRECISION', 1e-5)
+    assert len({suffix, gc4shapes.get_simplified_suffix(10),
+                gc4shapes.get_simplified_suffix(12)}) == 3
@@ -0,0 +1,52 @@
+import json
+import math
+
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4snaps
+
+
+def write_snapshot(geo_dir, prefix, geocs, data):
+    for g, gd in zip(geocs, data):
+        path = geo_dir / (prefix + 'geodata_' + g[:3] + '.json')
+        path.write_text(json.dumps(gd))
+
+
+def test_snapshot_drift(tmp_path, monkeypatch):
+    monkeypatch.setattr(gc4snaps.gc4settings, 'DIR_GEO', str(tmp_path))
+    geocs = ['Nominatim', 'ArcGis']
+    box = [[41., -73.], [40., -75.]]
+    old = [{'A': {'loc': [40.5, -74.], 'box': box},
+            'B': {'loc': [40.5, -74.], 'box': box}},
+           {'A': {'loc': [40.5, -74.], 'box': box}}]
+    new = [{'A': {'loc': [40.5, -74.], 'box': box},
+            'B': {'loc': [40.6, -74.], 'box': box}},
+           {'A': {'loc': [40.5, -74.], 'box': box},
+            'B': {'loc': [40.5, -74.], 'box': box}}]
+    write_snapshot(tmp_path, '2019-05-24_', geocs, new)
+    write_snapshot(tmp_path, 'sep2018_', geocs, old)
+    write_snapshot(tmp_path, '', geocs, new)
+
+    prefixes = gc4snaps.get_snapshot_prefixes(geocs)
+    assert prefixes == ['sep2018_', '2019-05-24_', '']
+
+    snaps = gc4snaps.SnapshotStore.from_geo_files(geocs=geocs)
+    assert snaps.data.shape == (3, 2, 2, 6)
+    assert snaps.snapshots == ['sep2018', '2019-05-24', 'current']
+    assert snaps['sep2018'].found.tolist() == [[True, True], [True, False]]
+
+    drift, labels = snaps.drift_km()
+    assert labels == ['2019-05-24 v. sep2018', 'current v. 2019-05-24']
+    assert drift[0, 0, 1, 0] == pytest.approx(11.1, abs=0.1)
+    assert math.isinf(drift[0, 1, 1, 0])
+    assert (drift[1] == 0).all()
+
+    changes = snaps.changes(threshold_km=1)
+    assert changes.index.tolist() == [('2019-05-24 v. sep2018', 'B',
+                                       'Nominatim'),
+                                      ('2019-05-24 v. sep2018', 'B',
+                                       'ArcGis')]
+    assert snaps.changed_places(threshold_km=1) == []
+    assert snaps.changed_places(threshold_km=1, base='sep2018') == ['B']
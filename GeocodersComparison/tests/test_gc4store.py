@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4store
+
+
+def test_geo_store_round_trip():
+    store = gc4store.GeoStore.from_geo_files(alt_prefix='sep2018')
+    assert store.data.shape == (len(gc4settings.geocs),
+                                len(gc4settings.query_lst), 6)
+    assert store.found.all()
+
+    geo_dicts = store.to_geo_dicts()
+    again = gc4store.GeoStore.from_geo_dicts(store.geocs, geo_dicts)
+    np.testing.assert_array_equal(again.data, store.data)
+
+    i, j = store.geocs_idx['ArcGis'], store.places_idx['Boston']
+    assert store.coords[i, j].tolist() == [geo_dicts[i]['Boston']['loc']] + \
+        geo_dicts[i]['Boston']['box']
+
+
+def test_geo_store_missing_and_select():
+    geo_dicts = [{'A': {'loc': [1., 2.], 'box': [[3., 4.], [0., 1.]]}},
+                 {'B': {'loc': [5., 6.], 'box': [[7., 8.], [4., 5.]]}}]
+    store = gc4store.GeoStore.from_geo_dicts(['G1', 'G2'], geo_dicts)
+
+    assert store.places == ['A', 'B']
+    assert store.found.tolist() == [[True, False], [False, True]]
+    assert store.to_geo_dicts()[0]['B'] == {}
+
+    sub = store.select(geocs=['G2'], places=['B'])
+    assert sub.locs.tolist() == [[[5., 6.]]]
+
+    with pytest.raises(ValueError):
+        gc4store.GeoStore(np.zeros((1, 1, 4)), ['G1'], ['A'])
@@ -0,0 +1,100 @@
+import pytest
+
+from .context import GeocodersComparison
+
+from GeocodersComparison import gc4fetch
+from GeocodersComparison import gc4settings
+from GeocodersComparison import gc4stub
+
+
+query_lst = gc4settings.query_lst
+
+
+@pytest.fixture
+def stub():
+    server = gc4stub.StubGeocoderServer(alt_prefix='sep2018', seed=0)
+    with server:
+        gc4stub.use_stub_server(server)
+        yield server
+    gc4stub.reset_geocoders_domains()
+
+
+@pytest.mark.parametrize('geo', ['Nominatim', 'ArcGis', 'AzureMaps'])
+def test_stub_replays_geodata(stub, geo):
+    geodata = gc4fetch.fetch_geodata(geo, query_lst, limits={})
+    assert dict(geodata) == stub.geodata[geo]
+
+
+def test_stub_errors_and_throttling(stub):
+    no_retry = dict(limits={}, retry={'retries': 0}, on_error='raise')
+    stub.error_rate = 1.
+    with pytest.raises(Exception):
+        gc4fetch.fetch_geodata('ArcGis', query_lst[:1], **no_retry)
+    assert stub.stats['errors'] == 1
+
+    stub.error_rate = 0.
+    stub.throttle_rps = {'ArcGis': 0.1}
+    with pytest.raises(Exception):
+        gc4fetch.fetch_geodata('ArcGis', query_lst[:2], **no_retry)
+    assert stub.stats['throttled'] == 1
+
+
+def test_http_errors_transience(stub):
+    # geopy's errors of the http codes it does not map: only 5xx are retried
+    g = gc4fetch.get_client('ArcGis')
+    api = g.api
+    stub.error_rate = 1.
+    with pytest.raises(Exception) as server_error:
+        g.geocode(query_lst[0])
+    stub.error_rate = 0.
+    g.api = api + '_unknown'
+    try:
+        with pytest.raises(Exception) as not_found:
+            g.geocode(query_lst[0])
+    finally:
+        g.api = api
+
+    assert gc4fetch.get_http_status(server_error.value) == 500
+    assert gc4fetch.is_transient(server_error.value)
+    assert gc4fetch.get_http_status(not_found.value) == 404
+    assert not gc4fetch.is_transient(not_found.value)
+
+
+def test_clients_keep_alive(stub):
+    for _ in range(2):
+        gc4fetch.fetch_geodata('ArcGis', query_lst, limits={})
+
+    assert stub.stats['requests'] == 2 * len(query_lst)
+    assert stub.stats['connections'] == 1
+
+
+def test_not_found_and_failed_queries(stub, monkeypatch, tmp_path):
+    from GeocodersComparison import gc4cache
+
+    geodata = gc4fetch.fetch_geodata('ArcGis', ['Nowhere, ZZ'], limits={})
+    assert geodata == {'Nowhere': {}}
+
+    # retries, then recorded: the batch is kept
+    gc4fetch.clear_failed_queries()
+    retry = {'retries': 2, 'base_delay': 0.}
+    stub.error_rate = 1.
+    geodata = gc4fetch.fetch_geodata('ArcGis', query_lst[:1], limits={},
+                                     retry=retry)
+    assert geodata == {'New York City': {}}
+    assert stub.stats['errors'] == 3
+    assert list(gc4fetch.get_failed_queries('ArcGis')) == query_lst[:1]
+
+    # the circuit opens after 5 failures in a row: the others fail fast,
+    #  with the cached (expired) geodata if any
+    cache = gc4cache.GeoCache(str(tmp_path / 'cache.sqlite'))
+    cache.put('ArcGis', query_lst[-1], None, stub.geodata['ArcGis']['Boston'],
+              ttl=-1)
+    cache.put('ArcGis', 'Elsewhere, ZZ', None, {})
+    geodata = gc4fetch.fetch_geodata('ArcGis', query_lst, limits={},
+                                     retry=retry, cache=cache)
+    assert stub.stats['errors'] == 5
+    assert gc4fetch.get_circuit_breaker('ArcGis').state == 'open'
+    assert len(gc4fetch.get_failed_queries('ArcGis')) == len(query_lst)
+    assert geodata['Boston'] == stub.geodata['ArcGis']['Boston']
+    assert not any(geodata[p] for p in list(geodata)[:-1])
+    cache.close()
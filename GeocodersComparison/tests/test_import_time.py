@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from .context import GeocodersComparison
+
+
+PKG_PARENT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                          '..'))
+
+# Cold import budget (s) of GeocodersComparison.comparison; numpy & pandas
+# take most of it:
+IMPORT_BUDGET = float(os.getenv('GC4_IMPORT_BUDGET', 1.5))
+
+heavy_modules = ['folium', 'matplotlib', 'seaborn', 'geopandas', 'shapely',
+                 'geopy', 'IPython', 'dotenv']
+
+
+def cold_import(module):
+    """Import module in a new interpreter; return (seconds, heavy modules)."""
+    code = ('import sys, time, json\n'
+            't = time.perf_counter()\n'
+            'import {}\n'
+            'dt = time.perf_counter() - t\n'
+            'print(json.dumps([dt, [m for m in {!r} if m in sys.modules]]))'
+            ).format(module, heavy_modules)
+    out = subprocess.run([sys.executable, '-c', code], cwd=PKG_PARENT,
+                         stdout=subprocess.PIPE, check=True,
+                         universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def test_comparison_import_budget():
+    # best of 3, to absorb a cold disk cache:
+    runs = [cold_import('GeocodersComparison.comparison') for _ in range(3)]
+    dt = min(r[0] for r in runs)
+
+    assert runs[0][1] == []
+    assert dt < IMPORT_BUDGET, \
+        'Import took {:.2f} s; budget: {} s'.format(dt, IMPORT_BUDGET)
+
+
+def test_fetch_path_import_is_light():
+    dt, loaded = cold_import('GeocodersComparison.gc4fetch')
+    assert loaded == []
+    assert dt < IMPORT_BUDGET
+
+
+def test_import_prints_nothing():
+    out = subprocess.run([sys.executable, '-c',
+                          'import GeocodersComparison.comparison'],
+                         cwd=PKG_PARENT, stdout=subprocess.PIPE, check=True,
+                         universal_newlines=True).stdout
+    assert out == ''